@@ -1,9 +1,9 @@
-import sqlite3
+from src.modules.database import database
 import os
 import shutil
 
 # Connect to the database
-conn = sqlite3.connect('CapRank.db')
+conn = database.connect()
 cursor = conn.cursor()
 
 # Get the post image folder
@@ -1,18 +1,69 @@
 from litestar import Litestar, get
 from litestar.config.cors import CORSConfig
 
-from src.setupDatabase import setupDatabase
+from src.setupDatabase import migrateDatabase
+from src.modules.database import database
+from src.modules.like_counters import likeCounters
+from src.modules.job_queue import jobQueue
+from src.modules.rate_limit import RateLimitMiddleware
+from src.modules.image_index import imageIndex
+from src.modules.content_filter import contentFilter
+from src.modules.user_suggest import userSuggestions
+from src.modules.username_filter import usernameFilter
+import src.modules.job_handlers
 
 from src.routes.login_and_register import Controller_LoginAndRegister
 from src.routes.user import Controller_User
 from src.routes.post import Controller_Post
 from src.routes.caption import Controller_Caption
 from src.routes.redirect import Controller_Redirect
+from src.routes.sync import Controller_Sync
+from src.routes.batch import Controller_Batch
+from src.routes.export import Controller_Export
 
 from litestar.static_files.config import StaticFilesConfig
 from pathlib import Path
+from contextlib import asynccontextmanager
+import asyncio
+
+
+@asynccontextmanager
+async def appLifespan(app: Litestar):
+    # A no-op in workers started by src.server, which migrates once before starting them
+    migrateDatabase()
+
+    await database.open()
+    app.state.database = database
+
+    # Reloaded from then on whenever the word list changes
+    contentFilter.load()
+
+    # Typeahead is answered from memory only, so the index is there before the first request
+    await userSuggestions.rebuild()
+    await usernameFilter.rebuild()
+
+    flushTask = None
+    if likeCounters.buffered:
+        flushTask = asyncio.create_task(likeCounters.runFlushLoop())
+
+    jobQueue.start()
+
+    try:
+        yield
+
+    finally:
+        # The server has stopped taking requests and drained in-flight ones by now
+        await jobQueue.stop()
+
+        if flushTask:
+            flushTask.cancel()
+
+        imageIndex.close()
+
+        # Fold whatever is still buffered in before the queued writes drain
+        await likeCounters.flush()
+        await database.close()
 
-setupDatabase()
 
 @get("/")
 async def root() -> dict:
@@ -33,7 +84,7 @@ app = Litestar(
     cors_config=CORSConfig(
         allow_origins=ALLOWED_ORIGINS,
         allow_methods=["GET", "POST", "PUT", "DELETE", "OPTIONS"],
-        allow_headers=["Content-Type", "Authorization"],
+        allow_headers=["Content-Type", "Authorization", "Idempotency-Key"],
         allow_credentials=True,
         max_age=3600  # Cache preflight requests for 1 hour
     ),
@@ -43,8 +94,13 @@ app = Litestar(
         Controller_User,
         Controller_Post,
         Controller_Caption,
-        Controller_Redirect
+        Controller_Redirect,
+        Controller_Sync,
+        Controller_Batch,
+        Controller_Export
     ],
+    middleware=[RateLimitMiddleware],
+    lifespan=[appLifespan],
     static_files_config=[
         StaticFilesConfig(
             directories=[Path("src/user_post_images")],
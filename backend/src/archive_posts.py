@@ -0,0 +1,66 @@
+"""
+Move old posts, with their captions, likes and comments, into the archive database.
+
+    python -m src.archive_posts --dry-run
+    python -m src.archive_posts --older-than-days 180 --max-seconds 300
+"""
+
+import argparse
+import asyncio
+from datetime import timedelta
+
+from src.modules.database import database
+from src.setupDatabase import migrateDatabase
+from src.modules.archive import PostArchiver, ARCHIVE_AFTER_DAYS, ARCHIVE_BATCH_SIZE
+
+
+def parseArguments():
+    parser = argparse.ArgumentParser(description="Archive old CapRank posts")
+    parser.add_argument('--older-than-days', type=float, default=ARCHIVE_AFTER_DAYS)
+    parser.add_argument('--batch-size', type=int, default=ARCHIVE_BATCH_SIZE)
+    parser.add_argument('--max-seconds', type=float, default=None,
+                        help="stop after this long; the next run carries on with the posts left")
+    parser.add_argument('--dry-run', action='store_true', help="only count the posts that would be archived")
+    parser.add_argument('--verbose', action='store_true', help="print progress after every batch")
+    return parser.parse_args()
+
+
+def printSizes(title: str, sizes: list):
+    print(title)
+    for size in sizes:
+        print(f"    {size}")
+
+
+async def main():
+    arguments = parseArguments()
+
+    # Creates the archive database on a deployment that hasn't got one yet
+    migrateDatabase()
+
+    try:
+        archiver = PostArchiver(batchSize=arguments.batch_size, dryRun=arguments.dry_run)
+
+        before = await archiver.hotSetSize()
+        printSizes("Hot set before:", before)
+
+        archived = await archiver.run(
+            timedelta(days=arguments.older_than_days), arguments.max_seconds, progress=print if arguments.verbose else None
+        )
+
+        if arguments.dry_run:
+            print(f"Would archive {archived} posts, nothing was moved")
+            return
+
+        after = await archiver.hotSetSize()
+        printSizes("Hot set after:", after)
+
+        print(f"Archived {archived} posts")
+        if all(size.bytes is not None for size in before + after):
+            freed = sum(size.bytes for size in before) - sum(size.bytes for size in after)
+            print(f"Hot tables and indexes shrank by {freed / 1e6:.1f} MB; the freed pages are reused before the file grows")
+    finally:
+        await database.close()
+
+
+if __name__ == '__main__':
+    asyncio.run(main())
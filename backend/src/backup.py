@@ -0,0 +1,106 @@
+"""
+Back up the live SQLite database, with its archive, without stopping the server, and restore a backup.
+
+    python -m src.backup create --compress
+    python -m src.backup create --every 3600 --keep 24
+    python -m src.backup list
+    python -m src.backup verify backups/CapRank-20240101-120000.db.gz
+    python -m src.backup restore backups/CapRank-20240101-120000.db.gz
+"""
+
+import argparse
+import asyncio
+import os
+
+from src.modules.database import database
+from src.modules.backup import (
+    BACKUP_DIRECTORY, BACKUP_KEEP, BACKUP_PAGES_PER_STEP, BACKUP_STEP_SLEEP_SECONDS,
+    archiveBackupPath, createBackup, listBackups, verifyBackup, restoreBackup
+)
+
+
+async def runCreate(arguments):
+    while True:
+        try:
+            stats = await asyncio.to_thread(
+                createBackup, database.databaseName, arguments.directory, arguments.compress, not arguments.no_verify,
+                arguments.pages_per_step, arguments.sleep, arguments.keep
+            )
+            print(stats)
+        except Exception as e:
+            # A scheduled run tries again next time rather than stopping the schedule
+            if not arguments.every:
+                raise
+            print(f"Backup failed: {e}")
+
+        if not arguments.every:
+            return
+        await asyncio.sleep(arguments.every)
+
+
+async def runList(arguments):
+    backups = listBackups(arguments.directory)
+    if not backups:
+        print(f"No backups in {arguments.directory}")
+    for path in backups:
+        archivePath = archiveBackupPath(path)
+        archive = f"  with archive {os.path.getsize(archivePath) / 1e6:.1f} MB" if os.path.exists(archivePath) else ""
+        print(f"{path}  {os.path.getsize(path) / 1e6:.1f} MB{archive}")
+
+
+async def runVerify(arguments):
+    problems = await asyncio.to_thread(verifyBackup, arguments.path)
+    if problems:
+        print(f"{arguments.path} is damaged:")
+        for problem in problems:
+            print(f"    {problem}")
+        raise SystemExit(1)
+    print(f"{arguments.path} passed its integrity check")
+
+
+async def runRestore(arguments):
+    await asyncio.to_thread(restoreBackup, arguments.path, database.databaseName)
+    archive = " and its archive" if os.path.exists(archiveBackupPath(arguments.path)) else ""
+    print(f"Restored {database.databaseName}{archive} from {arguments.path}")
+
+
+def parseArguments():
+    parser = argparse.ArgumentParser(description="Back up and restore the CapRank SQLite database")
+    parser.add_argument('--directory', default=BACKUP_DIRECTORY)
+    commands = parser.add_subparsers(dest='command', required=True)
+
+    createParser = commands.add_parser('create', help="back up the database while it is in use")
+    createParser.add_argument('--compress', action='store_true', help="gzip the backup")
+    createParser.add_argument('--no-verify', action='store_true', help="skip the integrity check of the copy")
+    createParser.add_argument('--pages-per-step', type=int, default=BACKUP_PAGES_PER_STEP)
+    createParser.add_argument('--sleep', type=float, default=BACKUP_STEP_SLEEP_SECONDS, help="seconds to pause between steps")
+    createParser.add_argument('--keep', type=int, default=BACKUP_KEEP, help="newest backups to keep, older ones are deleted")
+    createParser.add_argument('--every', type=float, default=None, help="keep running, backing up every this many seconds")
+    createParser.set_defaults(run=runCreate)
+
+    commands.add_parser('list', help="backups in the directory, oldest first").set_defaults(run=runList)
+
+    verifyParser = commands.add_parser('verify', help="integrity check a backup")
+    verifyParser.add_argument('path')
+    verifyParser.set_defaults(run=runVerify)
+
+    restoreParser = commands.add_parser('restore', help="replace the database with a backup; stop the server first")
+    restoreParser.add_argument('path')
+    restoreParser.set_defaults(run=runRestore)
+
+    return parser.parse_args()
+
+
+async def main():
+    arguments = parseArguments()
+    if database.dialect != 'sqlite':
+        raise SystemExit("Backups here are of the SQLite database; back up PostgreSQL with pg_dump")
+
+    try:
+        await arguments.run(arguments)
+    finally:
+        await database.close()
+
+
+if __name__ == '__main__':
+    asyncio.run(main())
@@ -0,0 +1,70 @@
+"""
+Time near-duplicate lookups in the image index against a linear scan, on random 64 bit hashes.
+
+    python -m src.benchmark_image_index
+    python -m src.benchmark_image_index --images 1000000 --queries 2000 --distance 6
+"""
+
+import argparse
+import random
+import time
+
+from src.modules.image_index import MultiIndexHashes, DUPLICATE_IMAGE_MAX_DISTANCE
+
+
+def nearbyHash(hashValue: int, bits: int) -> int:
+    for bit in random.sample(range(64), bits):
+        hashValue ^= 1 << bit
+    return hashValue
+
+
+def parseArguments():
+    parser = argparse.ArgumentParser(description="Benchmark the CapRank near-duplicate image index")
+    parser.add_argument('--images', type=int, default=1_000_000)
+    parser.add_argument('--queries', type=int, default=1000)
+    parser.add_argument('--distance', type=int, default=DUPLICATE_IMAGE_MAX_DISTANCE)
+    parser.add_argument('--scan-queries', type=int, default=5, help="queries timed with a linear scan for comparison")
+    return parser.parse_args()
+
+
+def main():
+    arguments = parseArguments()
+    random.seed(1)
+
+    hashes = [random.getrandbits(64) for _ in range(arguments.images)]
+
+    started = time.perf_counter()
+    index = MultiIndexHashes()
+    for postId, hashValue in enumerate(hashes, start=1):
+        index.add(postId, hashValue)
+    print(f"Indexed {len(index)} hashes in {time.perf_counter() - started:.1f}s")
+
+    # Half the queries are edits of an indexed image, half match nothing
+    queries = []
+    for i in range(arguments.queries):
+        if i % 2:
+            queries.append(nearbyHash(random.choice(hashes), random.randint(0, arguments.distance)))
+        else:
+            queries.append(random.getrandbits(64))
+
+    timings = []
+    found = 0
+    for query in queries:
+        started = time.perf_counter()
+        found += bool(index.search(query, arguments.distance))
+        timings.append(time.perf_counter() - started)
+    timings.sort()
+
+    print(f"Index lookups: {sum(timings) / len(timings) * 1000:.3f}ms mean, "
+          f"{timings[len(timings) // 2] * 1000:.3f}ms median, {timings[int(len(timings) * 0.99)] * 1000:.3f}ms p99, "
+          f"{found} of {len(queries)} found a near duplicate")
+
+    started = time.perf_counter()
+    for query in queries[:arguments.scan_queries]:
+        sorted((hashValue ^ query).bit_count() for hashValue in hashes)[:1]
+    scanSeconds = (time.perf_counter() - started) / max(1, arguments.scan_queries)
+    print(f"Linear scan: {scanSeconds * 1000:.1f}ms per lookup")
+
+
+if __name__ == '__main__':
+    main()
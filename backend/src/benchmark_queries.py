@@ -0,0 +1,133 @@
+"""
+Compare the query registry in src.modules.queries with the inline SELECT * pattern it replaced,
+on a scratch database, measuring query, row mapping and JSON encoding together. Buffered like
+deltas are only ever folded in by Query.all, so the inline rows skip them and the registry
+does strictly more work.
+
+    python -m src.benchmark_queries
+    python -m src.benchmark_queries --posts 20000 --repeat 50
+"""
+
+import argparse
+import os
+import random
+import sqlite3
+import tempfile
+import time
+
+from litestar.serialization import encode_json
+
+from src.setupDatabase import setupSQLiteSchema
+from src.modules.like_counters import likeCounters
+from src.modules.like_filter import viewerLikeFilters
+from src.modules import queries
+
+
+def seedDatabase(connection, postCount: int, captionsPerPost: int):
+    cursor = connection.cursor()
+    setupSQLiteSchema(cursor)
+
+    cursor.executemany("""
+        INSERT INTO User (id, username, name, password)
+        VALUES (?, ?, ?, ?)
+    """, [(userId, f"user{userId}", f"User {userId}", 'pass') for userId in range(1, 101)])
+
+    cursor.executemany("""
+        INSERT INTO Post (id, userId, imageName, likes, captionCount)
+        VALUES (?, ?, ?, ?, ?)
+    """, [(postId, random.randint(1, 100), f"{postId}.jpg", random.randint(0, 500), captionsPerPost) for postId in range(1, postCount + 1)])
+
+    cursor.executemany("""
+        INSERT INTO Caption (postId, userId, text, likes)
+        VALUES (?, ?, ?, ?)
+    """, [
+        (postId, random.randint(1, 100), f"Caption {i} of post {postId}", random.randint(0, 100))
+        for postId in range(1, postCount + 1)
+        for i in range(captionsPerPost)
+    ])
+
+    cursor.executemany("""
+        INSERT INTO UserLikedPosts (userId, postId)
+        VALUES (1, ?)
+    """, [(postId,) for postId in range(1, postCount + 1, 7)])
+
+    connection.commit()
+
+
+def inlinePosts(cursor, viewerId):
+    cursor.execute("""
+        SELECT p.*, u.username
+        FROM LivePost p
+        JOIN User u ON p.userId = u.id
+    """)
+    return viewerLikeFilters.withLikedFlag(cursor, 'post', viewerId, cursor.fetchall())
+
+
+def registryPosts(cursor, viewerId):
+    return queries.POSTS_WITH_USERNAME.all(cursor, viewerId=viewerId)
+
+
+def inlineCaptions(cursor, postId, viewerId):
+    cursor.execute("""
+        SELECT *
+        FROM LiveCaption
+        WHERE postId = ?
+        ORDER BY likes DESC, created_at ASC
+    """, (postId,))
+    return viewerLikeFilters.withLikedFlag(cursor, 'caption', viewerId, cursor.fetchall())
+
+
+def registryCaptions(cursor, postId, viewerId):
+    return queries.CAPTIONS_BY_POST.all(cursor, (postId,), viewerId)
+
+
+def timeCalls(call, repeat: int) -> float:
+    started = time.perf_counter()
+    for _ in range(repeat):
+        encode_json({'status': 'green', 'data': call()})
+    return (time.perf_counter() - started) / repeat
+
+
+def parseArguments():
+    parser = argparse.ArgumentParser(description="Benchmark the CapRank query registry against inline queries")
+    parser.add_argument('--posts', type=int, default=10000)
+    parser.add_argument('--captions-per-post', type=int, default=5)
+    parser.add_argument('--repeat', type=int, default=20)
+    return parser.parse_args()
+
+
+def main():
+    arguments = parseArguments()
+    random.seed(1)
+
+    with tempfile.TemporaryDirectory() as directory:
+        connection = sqlite3.connect(os.path.join(directory, 'benchmark.db'))
+        seedDatabase(connection, arguments.posts, arguments.captions_per_post)
+        cursor = connection.cursor()
+
+        # Pending deltas on a few posts, as in buffered like counter mode
+        likeCounters.pending['post'] = {postId: 1 for postId in range(1, arguments.posts + 1, 50)}
+
+        postIds = [random.randint(1, arguments.posts) for _ in range(200)]
+        cases = [
+            ('all posts', lambda: inlinePosts(cursor, None), lambda: registryPosts(cursor, None), arguments.repeat),
+            ('all posts, viewer', lambda: inlinePosts(cursor, 1), lambda: registryPosts(cursor, 1), arguments.repeat),
+            ('200 caption pages', lambda: [inlineCaptions(cursor, postId, 1) for postId in postIds],
+                lambda: [registryCaptions(cursor, postId, 1) for postId in postIds], arguments.repeat),
+        ]
+
+        print(f"{'case':<20} {'inline':>12} {'registry':>12} {'speedup':>8}")
+        for name, inline, registry, repeat in cases:
+            # Warm the statement cache and the viewer's like filter first
+            inline()
+            registry()
+            inlineSeconds = timeCalls(inline, repeat)
+            registrySeconds = timeCalls(registry, repeat)
+            print(f"{name:<20} {inlineSeconds * 1000:>10.2f}ms {registrySeconds * 1000:>10.2f}ms {inlineSeconds / registrySeconds:>7.2f}x")
+
+        likeCounters.pending['post'] = {}
+        connection.close()
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,102 @@
+"""
+Report captions that repeat another caption on the same post, keeping the most liked of each group.
+
+    python -m src.caption_duplicates
+    python -m src.caption_duplicates --threshold 0.9 --post-id 42 --json
+"""
+
+import argparse
+import asyncio
+import json
+
+from src.modules.database import database
+from src.modules.caption_dedup import CaptionLSH, minHash, CAPTION_DUPLICATE_THRESHOLD
+
+
+def duplicateGroups(captions: list, threshold: float) -> list:
+    """
+    Group (id, text, likes) captions of one post: each caption joins the most similar caption
+    kept before it, going from most to least liked, or is kept itself. Returns (keptId, duplicateIds) pairs.
+    """
+
+    index = CaptionLSH()
+    groups = {}
+    for captionId, text, _ in sorted(captions, key=lambda caption: (-caption[2], caption[0])):
+        signature = minHash(text)
+        matches = index.similar(signature, threshold)
+        if matches:
+            groups[matches[0][0]].append(captionId)
+        else:
+            index.add(captionId, signature)
+            groups[captionId] = []
+
+    return [(keptId, duplicateIds) for keptId, duplicateIds in groups.items() if duplicateIds]
+
+
+def parseArguments():
+    parser = argparse.ArgumentParser(description="Report near-duplicate CapRank captions per post")
+    parser.add_argument('--threshold', type=float, default=CAPTION_DUPLICATE_THRESHOLD)
+    parser.add_argument('--post-id', type=int, default=None, help="only check this post")
+    parser.add_argument('--batch-size', type=int, default=500, help="posts read per query")
+    parser.add_argument('--json', action='store_true', help="print one JSON object per duplicate group")
+    return parser.parse_args()
+
+
+async def main():
+    arguments = parseArguments()
+
+    postsChecked = groupCount = duplicateCount = 0
+    afterPostId = 0
+    try:
+        while True:
+            def nextCaptions(cursor):
+                if arguments.post_id is not None:
+                    postIds = [arguments.post_id] if afterPostId < arguments.post_id else []
+                else:
+                    cursor.execute("""
+                        SELECT id
+                        FROM LivePost
+                        WHERE id > ? AND captionCount > 1
+                        ORDER BY id
+                        LIMIT ?
+                    """, (afterPostId, arguments.batch_size))
+                    postIds = [row[0] for row in cursor.fetchall()]
+
+                if not postIds:
+                    return [], {}
+
+                placeholders = ', '.join('?' for _ in postIds)
+                cursor.execute(f"""
+                    SELECT postId, id, text, likes
+                    FROM LiveCaption
+                    WHERE postId IN ({placeholders})
+                """, postIds)
+
+                captionsByPost = {}
+                for postId, captionId, text, likes in cursor.fetchall():
+                    captionsByPost.setdefault(postId, []).append((captionId, text, likes))
+                return postIds, captionsByPost
+
+            postIds, captionsByPost = await database.read(nextCaptions)
+            if not postIds:
+                break
+            afterPostId = postIds[-1]
+            postsChecked += len(postIds)
+
+            for postId, captions in captionsByPost.items():
+                for keptId, duplicateIds in duplicateGroups(captions, arguments.threshold):
+                    groupCount += 1
+                    duplicateCount += len(duplicateIds)
+                    if arguments.json:
+                        print(json.dumps({'postId': postId, 'keptCaptionId': keptId, 'duplicateCaptionIds': duplicateIds}))
+                    else:
+                        print(f"Post {postId}: caption {keptId} is repeated by {', '.join(map(str, duplicateIds))}")
+    finally:
+        await database.close()
+
+    if not arguments.json:
+        print(f"Checked {postsChecked} posts: {duplicateCount} duplicate captions in {groupCount} groups")
+
+
+if __name__ == '__main__':
+    asyncio.run(main())
@@ -0,0 +1,48 @@
+"""
+Remove image files no post refers to and rows whose post, caption or user is gone.
+
+    python -m src.collect_garbage --dry-run
+    python -m src.collect_garbage --max-seconds 60
+"""
+
+import argparse
+import asyncio
+
+from src.modules.database import database
+from src.modules.garbage_collector import GarbageCollector, GC_CHUNK_SIZE
+
+
+def parseArguments():
+    parser = argparse.ArgumentParser(description="Collect orphaned CapRank images and dangling rows")
+    parser.add_argument('--dry-run', action='store_true', help="only report what would be removed")
+    parser.add_argument('--chunk-size', type=int, default=GC_CHUNK_SIZE)
+    parser.add_argument('--max-seconds', type=float, default=None,
+                        help="stop after this long; the next run resumes where this one stopped")
+    parser.add_argument('--restart', action='store_true', help="ignore progress saved by an interrupted run")
+    parser.add_argument('--verbose', action='store_true', help="print every orphan found")
+    return parser.parse_args()
+
+
+async def main():
+    arguments = parseArguments()
+
+    collector = GarbageCollector(chunkSize=arguments.chunk_size, dryRun=arguments.dry_run)
+    if arguments.restart and not arguments.dry_run:
+        collector.reset()
+
+    try:
+        allStats = await collector.run(arguments.max_seconds, progress=print if arguments.verbose else None)
+    finally:
+        await database.close()
+
+    for stats in allStats:
+        print(stats)
+
+    if collector.state:
+        print("Stopped early, run again to continue")
+    elif arguments.dry_run:
+        print("Dry run, nothing was removed")
+
+
+if __name__ == '__main__':
+    asyncio.run(main())
@@ -0,0 +1,42 @@
+"""
+Export a table as NDJSON or CSV with flat memory use, to a file or stdout.
+
+    python -m src.export captions --format csv --output captions.csv
+    python -m src.export comments --since 2024-01-01 --post-id 42
+"""
+
+import argparse
+import asyncio
+import sys
+
+from src.modules.database import database
+from src.modules.export import EXPORT_TABLES, EXPORT_FORMATS, exportRows, normalizeSince
+
+
+def parseArguments():
+    parser = argparse.ArgumentParser(description="Export a CapRank table")
+    parser.add_argument('table', choices=list(EXPORT_TABLES))
+    parser.add_argument('--format', choices=list(EXPORT_FORMATS), default='ndjson')
+    parser.add_argument('--since', default=None, help="only rows created at or after this ISO date or time")
+    parser.add_argument('--post-id', type=int, default=None, help="only rows of this post")
+    parser.add_argument('--after-id', type=int, default=None, help="only rows with a larger id, to resume an export")
+    parser.add_argument('--output', default=None, help="file to write, stdout by default")
+    return parser.parse_args()
+
+
+async def main():
+    arguments = parseArguments()
+    since = normalizeSince(arguments.since) if arguments.since else None
+
+    output = open(arguments.output, 'wb') if arguments.output else sys.stdout.buffer
+    try:
+        async for chunk in exportRows(arguments.table, arguments.format, since, arguments.post_id, arguments.after_id):
+            output.write(chunk)
+    finally:
+        if arguments.output:
+            output.close()
+        await database.close()
+
+
+if __name__ == '__main__':
+    asyncio.run(main())
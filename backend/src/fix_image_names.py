@@ -1,10 +1,10 @@
-import sqlite3
+from src.modules.database import database
 import os
 from pathlib import Path
 
 def fix_image_names():
     # Connect to the database
-    connection = sqlite3.connect('CapRank.db')
+    connection = database.connect()
     cursor = connection.cursor()
 
     # First, delete all posts that don't have corresponding images
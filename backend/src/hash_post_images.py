@@ -0,0 +1,80 @@
+"""
+Store the image hash of posts created before duplicate detection, so uploads are matched against them too.
+
+    python -m src.hash_post_images
+    python -m src.hash_post_images --batch-size 500
+"""
+
+import argparse
+import asyncio
+import os
+
+from src.modules.database import database
+from src.modules.change_log import recordChange
+from src.modules.image_index import imageIndex, PILLOW_AVAILABLE
+from src.routes.post import postImageFolder
+
+
+def parseArguments():
+    parser = argparse.ArgumentParser(description="Hash the images of CapRank posts that have no image hash yet")
+    parser.add_argument('--batch-size', type=int, default=200)
+    return parser.parse_args()
+
+
+async def main():
+    arguments = parseArguments()
+    if not PILLOW_AVAILABLE:
+        print("Pillow is not installed, nothing can be hashed")
+        return
+
+    hashed = skipped = 0
+    afterId = 0
+    try:
+        while True:
+            def nextPosts(cursor):
+                cursor.execute("""
+                    SELECT p.id, p.imageName
+                    FROM LivePost p
+                    LEFT JOIN PostImageHash h ON h.postId = p.id
+                    WHERE h.postId IS NULL AND p.id > ?
+                    ORDER BY p.id
+                    LIMIT ?
+                """, (afterId, arguments.batch_size))
+                return cursor.fetchall()
+
+            posts = await database.read(nextPosts)
+            if not posts:
+                break
+            afterId = posts[-1][0]
+
+            hashes = []
+            for postId, imageName in posts:
+                imagePath = os.path.join(postImageFolder, imageName)
+                if not os.path.exists(imagePath):
+                    skipped += 1
+                    continue
+
+                with open(imagePath, 'rb') as f:
+                    imageHash = await imageIndex.hash(f.read())
+
+                if imageHash is None:
+                    skipped += 1
+                else:
+                    hashes.append((postId, imageHash))
+
+            def storeHashes(cursor):
+                for postId, imageHash in hashes:
+                    imageIndex.recordHash(cursor, postId, imageHash)
+                # Running servers pick hashes up from the ChangeLog, whatever the post's id
+                recordChange(cursor, 'post', [postId for postId, _ in hashes])
+
+            await database.write(storeHashes)
+            hashed += len(hashes)
+            print(f"Hashed {hashed} images, skipped {skipped} missing or unreadable ones")
+    finally:
+        imageIndex.close()
+        await database.close()
+
+
+if __name__ == '__main__':
+    asyncio.run(main())
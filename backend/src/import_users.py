@@ -0,0 +1,75 @@
+"""
+Register users in bulk from a CSV file with username,name,password[,profilePicture] columns.
+Taken usernames are skipped and reported, so an interrupted import can simply be run again.
+
+    python -m src.import_users users.csv
+    python -m src.import_users users.csv --batch-size 1000 --verbose
+"""
+
+import argparse
+import asyncio
+import csv
+
+from pydantic import ValidationError
+
+from src.modules.data_types import DT_UserRegister
+from src.modules.database import database
+from src.modules.user_service import insertUser
+
+
+def parseArguments():
+    parser = argparse.ArgumentParser(description="Bulk register CapRank users from a CSV file")
+    parser.add_argument('path')
+    parser.add_argument('--batch-size', type=int, default=500, help="users registered per write operation")
+    parser.add_argument('--verbose', action='store_true', help="print every skipped row")
+    return parser.parse_args()
+
+
+async def registerBatch(users: list) -> list:
+    """New user ids, None where the username was taken, from one write operation for the whole batch."""
+
+    def insertUsers(cursor):
+        return [insertUser(cursor, user.username, user.name, user.password, user.profilePicture) for user in users]
+
+    return await database.write(insertUsers)
+
+
+async def main():
+    arguments = parseArguments()
+    counts = {'created': 0, 'taken': 0, 'invalid': 0}
+
+    async def flush(batch: list):
+        for user, userId in zip(batch, await registerBatch(batch)):
+            if userId is not None:
+                counts['created'] += 1
+                continue
+            counts['taken'] += 1
+            if arguments.verbose:
+                print(f"{user.username}: username already taken")
+
+    try:
+        with open(arguments.path, newline='', encoding='utf-8') as f:
+            batch = []
+            for lineNumber, row in enumerate(csv.DictReader(f), start=2):
+                try:
+                    batch.append(DT_UserRegister(**{key: value or None for key, value in row.items() if key}))
+                except ValidationError as e:
+                    counts['invalid'] += 1
+                    if arguments.verbose:
+                        print(f"Line {lineNumber}: {e.errors()[0]['loc'][0]}: {e.errors()[0]['msg']}")
+
+                if len(batch) >= arguments.batch_size:
+                    await flush(batch)
+                    batch = []
+                    print(f"Registered {counts['created']} users so far")
+
+            if batch:
+                await flush(batch)
+    finally:
+        await database.close()
+
+    print(f"Registered {counts['created']} users, skipped {counts['taken']} taken usernames and {counts['invalid']} invalid rows")
+
+
+if __name__ == '__main__':
+    asyncio.run(main())
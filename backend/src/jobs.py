@@ -0,0 +1,132 @@
+"""
+Inspect and work the background job queue.
+
+    python -m src.jobs stats
+    python -m src.jobs list --status failed
+    python -m src.jobs retry --failed
+    python -m src.jobs drain
+"""
+
+import argparse
+import asyncio
+from datetime import timedelta
+
+from src.modules.database import database, timestampIn
+from src.modules.job_queue import jobQueue
+import src.modules.job_handlers
+
+
+async def showStats(arguments):
+    rows = await jobQueue.stats()
+    if not rows:
+        print("Job queue is empty")
+        return
+
+    print(f"{'kind':<20} {'status':<10} {'count':>8}  oldest")
+    for kind, status, count, oldest in rows:
+        print(f"{kind:<20} {status:<10} {count:>8}  {oldest}")
+
+
+async def listJobs(arguments):
+    def fetchJobs(cursor):
+        conditions = []
+        parameters = []
+        if arguments.status:
+            conditions.append("status = ?")
+            parameters.append(arguments.status)
+        if arguments.kind:
+            conditions.append("kind = ?")
+            parameters.append(arguments.kind)
+
+        where = f"WHERE {' AND '.join(conditions)}" if conditions else ""
+        cursor.execute(f"""
+            SELECT id, kind, status, priority, attempts, maxAttempts, runAfter, lastError, payload
+            FROM Job
+            {where}
+            ORDER BY id DESC
+            LIMIT ?
+        """, (*parameters, arguments.limit))
+        return cursor.fetchall()
+
+    for jobId, kind, status, priority, attempts, maxAttempts, runAfter, lastError, payload in await database.read(fetchJobs):
+        print(f"#{jobId} {kind} [{status}] priority={priority} attempts={attempts}/{maxAttempts} runAfter={runAfter}")
+        print(f"    payload: {payload[:200]}")
+        if lastError:
+            print(f"    error: {lastError}")
+
+
+async def drainJobs(arguments):
+    attempted = await jobQueue.drain()
+    print(f"Ran {attempted} job(s)")
+
+
+async def retryJobs(arguments):
+    def requeue(cursor):
+        if arguments.failed:
+            cursor.execute("""
+                UPDATE Job
+                SET status = 'queued', attempts = 0, runAfter = ?
+                WHERE status = 'failed'
+            """, (timestampIn(timedelta()),))
+        else:
+            placeholders = ', '.join('?' for _ in arguments.ids)
+            cursor.execute(f"""
+                UPDATE Job
+                SET status = 'queued', attempts = 0, runAfter = ?
+                WHERE id IN ({placeholders}) AND status != 'running'
+            """, (timestampIn(timedelta()), *arguments.ids))
+        return cursor.rowcount
+
+    print(f"Requeued {await database.write(requeue)} job(s)")
+
+
+async def purgeJobs(arguments):
+    def deleteFinished(cursor):
+        cursor.execute("""
+            DELETE FROM Job
+            WHERE status = ?
+        """, (arguments.status,))
+        return cursor.rowcount
+
+    print(f"Deleted {await database.write(deleteFinished)} {arguments.status} job(s)")
+
+
+def parseArguments():
+    parser = argparse.ArgumentParser(description="Inspect and work the CapRank job queue")
+    commands = parser.add_subparsers(dest='command', required=True)
+
+    commands.add_parser('stats', help="job counts by kind and status").set_defaults(run=showStats)
+
+    listParser = commands.add_parser('list', help="most recent jobs")
+    listParser.add_argument('--status', choices=['queued', 'running', 'done', 'failed'])
+    listParser.add_argument('--kind')
+    listParser.add_argument('--limit', type=int, default=20)
+    listParser.set_defaults(run=listJobs)
+
+    commands.add_parser('drain', help="run every due job in this process, then exit").set_defaults(run=drainJobs)
+
+    retryParser = commands.add_parser('retry', help="queue jobs again with a fresh attempt budget")
+    retryParser.add_argument('ids', nargs='*', type=int)
+    retryParser.add_argument('--failed', action='store_true', help="every failed job")
+    retryParser.set_defaults(run=retryJobs)
+
+    purgeParser = commands.add_parser('purge', help="delete finished jobs")
+    purgeParser.add_argument('--status', choices=['done', 'failed'], default='done')
+    purgeParser.set_defaults(run=purgeJobs)
+
+    arguments = parser.parse_args()
+    if arguments.command == 'retry' and not (arguments.ids or arguments.failed):
+        parser.error("retry needs job ids or --failed")
+    return arguments
+
+
+async def main():
+    arguments = parseArguments()
+    try:
+        await arguments.run(arguments)
+    finally:
+        await database.close()
+
+
+if __name__ == '__main__':
+    asyncio.run(main())
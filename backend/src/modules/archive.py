@@ -0,0 +1,159 @@
+import asyncio
+import os
+import sqlite3
+import time
+from datetime import timedelta
+
+from src.modules.database import database as defaultDatabase, timestampAgo
+
+
+# Posts created longer ago than this are moved to the archive database
+ARCHIVE_AFTER_DAYS = float(os.environ.get('CAPRANK_ARCHIVE_AFTER_DAYS', '365'))
+
+# Posts moved per transaction, with everything hanging off them
+ARCHIVE_BATCH_SIZE = 200
+
+# Tables moved along with a post: (table, columns, condition picking the rows of the posts {postIds}).
+# PostLikeBucket isn't kept; trending only sums recent buckets, and an old post has none.
+ARCHIVED_TABLES = [
+    ('Post', ['id', 'userId', 'imageName', 'created_at', 'likes', 'topCaptionId', 'captionCount', 'deleted_at'],
+        "id IN ({postIds})"),
+    ('Caption', ['id', 'postId', 'userId', 'text', 'created_at', 'likes', 'commentCount'],
+        "postId IN ({postIds})"),
+    ('UserLikedPosts', ['userId', 'postId', 'created_at'],
+        "postId IN ({postIds})"),
+    ('UserLikedCaptions', ['userId', 'captionId', 'created_at'],
+        "captionId IN (SELECT id FROM main.Caption WHERE postId IN ({postIds}))"),
+    ('CaptionComments', ['id', 'captionId', 'userId', 'text', 'created_at', 'parentId'],
+        "captionId IN (SELECT id FROM main.Caption WHERE postId IN ({postIds}))"),
+    ('PostImageHash', ['postId', 'hash'],
+        "postId IN ({postIds})"),
+]
+
+
+class TableSize:
+    def __init__(self, table: str, rows: int, byteCount: int = None):
+        self.table = table
+        self.rows = rows
+        # Pages in use by the table and its indexes, None where SQLite is built without dbstat
+        self.bytes = byteCount
+
+
+    def __str__(self) -> str:
+        size = f"{self.bytes / 1e6:10.1f} MB" if self.bytes is not None else f"{'?':>10} MB"
+        return f"{self.table:<18} {self.rows:>10} rows  {size}"
+
+
+
+class PostArchiver:
+    """
+    Moves old posts out of the hot tables into the archive database attached as 'archive'.
+
+    Almost every request is about recent posts, so the tables and indexes they hit stay small
+    enough to keep in cache; reads fall back to the archive for the ids the hot tables don't
+    have (see Query.oneOrArchived). A batch is copied in one transaction and then, in the
+    next, copied again and deleted from the hot tables, whose foreign keys cascade the delete
+    to everything hanging off the posts. Commits spanning two WAL databases aren't atomic
+    across them, so the first copy makes sure a crash between the two files' commits can at
+    worst lose what was added to those posts in the moment between the transactions.
+    Likes and new captions on archived posts are refused as on a deleted post, but owners can
+    still delete archived posts and captions, which the purge jobs then remove from the archive.
+    """
+
+    def __init__(self, database=defaultDatabase, batchSize: int = ARCHIVE_BATCH_SIZE, dryRun: bool = False):
+        if database.dialect != 'sqlite':
+            raise RuntimeError("Archiving moves rows between SQLite files; on PostgreSQL partition Post by created_at instead")
+
+        self.database = database
+        self.batchSize = batchSize
+        self.dryRun = dryRun
+
+
+    async def hotSetSize(self) -> list:
+        def measureTables(cursor):
+            tables = [table for table, _, _ in ARCHIVED_TABLES]
+            try:
+                placeholders = ', '.join('?' for _ in tables)
+                cursor.execute(f"""
+                    SELECT m.tbl_name, SUM(s.pgsize)
+                    FROM dbstat('main') s
+                    JOIN main.sqlite_master m ON m.name = s.name
+                    WHERE m.tbl_name IN ({placeholders})
+                    GROUP BY m.tbl_name
+                """, tables)
+                sizes = dict(cursor.fetchall())
+            except sqlite3.OperationalError:
+                sizes = None
+
+            return [
+                TableSize(table, cursor.execute(f"SELECT COUNT(*) FROM main.{table}").fetchone()[0],
+                          sizes.get(table, 0) if sizes is not None else None)
+                for table in tables
+            ]
+
+        return await self.database.read(measureTables)
+
+
+    async def _nextPostIds(self, cutoff: str, afterId: int) -> list:
+        def fetchOldPostIds(cursor):
+            # Soft deleted posts and posts of deleted users are left to the purge jobs
+            cursor.execute("""
+                SELECT id
+                FROM LivePost
+                WHERE created_at < ? AND id > ?
+                ORDER BY id
+                LIMIT ?
+            """, (cutoff, afterId, self.batchSize))
+            return [row[0] for row in cursor.fetchall()]
+
+        return await self.database.read(fetchOldPostIds)
+
+
+    async def archiveBatch(self, postIds: list) -> int:
+        placeholders = ', '.join('?' for _ in postIds)
+
+        def copyRows(cursor):
+            for table, columns, belongsToPosts in ARCHIVED_TABLES:
+                columnList = ', '.join(columns)
+                cursor.execute(f"""
+                    INSERT OR REPLACE INTO archive.{table} ({columnList})
+                    SELECT {columnList}
+                    FROM main.{table}
+                    WHERE {belongsToPosts.format(postIds=placeholders)}
+                """, postIds)
+
+        def copyAgainAndDelete(cursor):
+            # Anything added to the posts since the first copy comes along too
+            copyRows(cursor)
+            cursor.execute(f"""
+                DELETE FROM main.Post
+                WHERE id IN ({placeholders})
+            """, postIds)
+            return cursor.rowcount
+
+        await self.database.write(copyRows)
+        return await self.database.write(copyAgainAndDelete)
+
+
+    async def run(self, olderThan: timedelta, maxSeconds: float = None, progress=None) -> int:
+        """Archive every live post created before olderThan ago, batch by batch; returns how many were (or would be) moved."""
+
+        cutoff = timestampAgo(olderThan)
+        start = time.monotonic()
+        archived = 0
+        afterId = 0
+
+        while maxSeconds is None or time.monotonic() - start < maxSeconds:
+            postIds = await self._nextPostIds(cutoff, afterId)
+            if not postIds:
+                break
+            afterId = postIds[-1]
+
+            archived += len(postIds) if self.dryRun else await self.archiveBatch(postIds)
+            if progress:
+                progress(f"{'would archive' if self.dryRun else 'archived'} {archived} posts, up to id {afterId}")
+
+            # Let other tasks on the loop, and other processes' writers, in between batches
+            await asyncio.sleep(0)
+
+        return archived
@@ -0,0 +1,260 @@
+import gzip
+import os
+import shutil
+import sqlite3
+import tempfile
+import time
+from contextlib import contextmanager
+from datetime import datetime, timezone
+
+from src.modules.database import DATABASE_NAME, archiveNameFor
+
+
+# Where backups are written and looked for
+BACKUP_DIRECTORY = os.environ.get('CAPRANK_BACKUP_DIR', 'backups')
+
+# Pages copied per backup step, 1 MB at the default 4 KB page size
+BACKUP_PAGES_PER_STEP = 256
+
+# Pause after each step, so a backup takes a share of the disk rather than all of it
+BACKUP_STEP_SLEEP_SECONDS = float(os.environ.get('CAPRANK_BACKUP_STEP_SLEEP', '0.005'))
+
+# Newest backups kept; older ones are deleted after each successful backup
+BACKUP_KEEP = int(os.environ.get('CAPRANK_BACKUP_KEEP', '7'))
+
+BACKUP_PREFIX = 'CapRank-'
+
+# Marks the archive database's copy, which shares its backup's timestamp
+ARCHIVE_INFIX = '.archive'
+
+
+class BackupStats:
+    def __init__(self, path: str):
+        self.path = path
+        self.pages = 0
+        self.steps = 0
+        self.bytes = 0
+        self.seconds = 0.0
+        self.verified = False
+        self.archivePath = None
+
+
+    def __str__(self) -> str:
+        verified = "verified" if self.verified else "not verified"
+        archive = f"  with {self.archivePath}" if self.archivePath else ""
+        return f"{self.path}{archive}  {self.pages} pages in {self.steps} steps  {self.bytes / 1e6:.1f} MB  {self.seconds:.2f}s  {verified}"
+
+
+
+def backupPath(directory: str, compress: bool) -> str:
+    stamp = datetime.now(timezone.utc).strftime('%Y%m%d-%H%M%S')
+    return os.path.join(directory, f"{BACKUP_PREFIX}{stamp}.db{'.gz' if compress else ''}")
+
+
+def archiveBackupPath(path: str) -> str:
+    """Where the archive's copy of a backup goes: CapRank-20240101-120000.db.gz pairs with CapRank-20240101-120000.archive.db.gz."""
+    directory, name = os.path.split(path)
+    return os.path.join(directory, name.replace('.db', f'{ARCHIVE_INFIX}.db', 1))
+
+
+def listBackups(directory: str = BACKUP_DIRECTORY) -> list:
+    """Backups in directory, oldest first, by their main file; an archive copy goes with the backup it pairs with."""
+
+    if not os.path.isdir(directory):
+        return []
+
+    names = [
+        name for name in os.listdir(directory)
+        if name.startswith(BACKUP_PREFIX) and name.endswith(('.db', '.db.gz')) and f'{ARCHIVE_INFIX}.db' not in name
+    ]
+    return [os.path.join(directory, name) for name in sorted(names)]
+
+
+def pruneBackups(directory: str = BACKUP_DIRECTORY, keep: int = BACKUP_KEEP) -> list:
+    """Delete all but the newest keep backups along with their archive copies, returning the main paths removed."""
+
+    backups = listBackups(directory)
+    removed = backups[:max(0, len(backups) - keep)]
+    for path in removed:
+        if os.path.exists(archiveBackupPath(path)):
+            os.remove(archiveBackupPath(path))
+        os.remove(path)
+    return removed
+
+
+@contextmanager
+def openedBackup(path: str):
+    """A read-only connection to a backup, decompressed into a temporary file first if needed."""
+
+    temporaryPath = None
+    try:
+        if path.endswith('.gz'):
+            descriptor, temporaryPath = tempfile.mkstemp(suffix='.db')
+            with os.fdopen(descriptor, 'wb') as output, gzip.open(path, 'rb') as compressed:
+                shutil.copyfileobj(compressed, output)
+
+        connection = sqlite3.connect(f'file:{temporaryPath or path}?mode=ro', uri=True)
+        try:
+            yield connection
+        finally:
+            connection.close()
+    finally:
+        if temporaryPath:
+            os.remove(temporaryPath)
+
+
+def integrityProblems(connection: sqlite3.Connection) -> list:
+    """What PRAGMA integrity_check finds wrong with a database, empty if nothing."""
+
+    return [row[0] for row in connection.execute("PRAGMA integrity_check") if row[0] != 'ok']
+
+
+def verifyBackup(path: str) -> list:
+    """Integrity problems in a backup and in its archive copy, if it has one."""
+
+    with openedBackup(path) as connection:
+        problems = integrityProblems(connection)
+
+    archivePath = archiveBackupPath(path)
+    if os.path.exists(archivePath):
+        with openedBackup(archivePath) as connection:
+            problems += [f"archive: {problem}" for problem in integrityProblems(connection)]
+    return problems
+
+
+def _copySchema(source: sqlite3.Connection, schema: str, partialPath: str, stats: BackupStats,
+                verify: bool, pagesPerStep: int, sleepSeconds: float):
+    """Copy one attached database of source into a new file at partialPath."""
+
+    copiedPages = 0
+
+    def onStep(status, remaining, total):
+        nonlocal copiedPages
+        copiedPages = total
+        stats.steps += 1
+        if remaining and sleepSeconds:
+            time.sleep(sleepSeconds)
+
+    destination = sqlite3.connect(partialPath)
+    try:
+        source.backup(destination, pages=pagesPerStep, progress=onStep, name=schema)
+
+        # Self-contained, so the backup is the one file with no -wal beside it
+        destination.execute("PRAGMA journal_mode = DELETE")
+
+        if verify:
+            problems = integrityProblems(destination)
+            if problems:
+                raise RuntimeError(f"Backup of {schema} failed its integrity check: {'; '.join(problems[:5])}")
+    finally:
+        destination.close()
+
+    stats.pages += copiedPages
+
+
+def _compressed(partialPath: str) -> str:
+    with open(partialPath, 'rb') as uncompressed, gzip.open(f"{partialPath}.gz", 'wb', compresslevel=6) as output:
+        shutil.copyfileobj(uncompressed, output)
+    os.remove(partialPath)
+    return f"{partialPath}.gz"
+
+
+def createBackup(databaseName: str = DATABASE_NAME, directory: str = BACKUP_DIRECTORY, compress: bool = False,
+                 verify: bool = True, pagesPerStep: int = BACKUP_PAGES_PER_STEP,
+                 sleepSeconds: float = BACKUP_STEP_SLEEP_SECONDS, keep: int = BACKUP_KEEP) -> BackupStats:
+    """
+    Copy a live database, and its archive if it has one, into a new backup with the SQLite backup API.
+
+    The copy reads one read transaction's snapshot throughout. In WAL mode that never blocks
+    writers, and it keeps the copy consistent: without it, every commit made while copying
+    would restart the backup, which under steady writes would never finish. The archive is
+    attached to the same connection and its snapshot taken in the same transaction, so the
+    two copies agree on which posts have moved and none is in both or neither. The copy goes
+    pagesPerStep pages at a time with a pause after each step. Each file is written under a
+    temporary name and renamed into place once verified, the main file last, so a listed
+    backup is always whole.
+    """
+
+    os.makedirs(directory, exist_ok=True)
+    stats = BackupStats(backupPath(directory, compress))
+    start = time.monotonic()
+
+    source = sqlite3.connect(f'file:{databaseName}?mode=ro', uri=True)
+    copies = [('main', stats.path)]
+    archiveName = archiveNameFor(databaseName)
+    if os.path.exists(archiveName):
+        source.execute("ATTACH DATABASE ? AS archive", (f'file:{archiveName}?mode=ro',))
+        stats.archivePath = archiveBackupPath(stats.path)
+        copies.append(('archive', stats.archivePath))
+
+    partialPaths = []
+    try:
+        source.execute("BEGIN")
+        for schema, _ in copies:
+            source.execute(f"SELECT 1 FROM {schema}.sqlite_master LIMIT 1").fetchall()
+
+        for schema, path in copies:
+            partialPaths.append(f"{path.removesuffix('.gz')}.partial")
+            _copySchema(source, schema, partialPaths[-1], stats, verify, pagesPerStep, sleepSeconds)
+        source.rollback()
+        stats.verified = verify
+
+        if compress:
+            partialPaths = [_compressed(partialPath) for partialPath in partialPaths]
+    except BaseException:
+        for partialPath in partialPaths:
+            if os.path.exists(partialPath):
+                os.remove(partialPath)
+        raise
+    finally:
+        source.close()
+
+    for (_, path), partialPath in reversed(list(zip(copies, partialPaths))):
+        os.replace(partialPath, path)
+        stats.bytes += os.path.getsize(path)
+    stats.seconds = time.monotonic() - start
+
+    pruneBackups(directory, keep)
+    return stats
+
+
+def _restoreFile(path: str, databaseName: str):
+    with openedBackup(path) as backup:
+        target = sqlite3.connect(databaseName)
+        try:
+            backup.backup(target)
+            target.execute("PRAGMA journal_mode = WAL")
+            target.execute("PRAGMA wal_checkpoint(TRUNCATE)")
+        finally:
+            target.close()
+
+
+def restoreBackup(path: str, databaseName: str = DATABASE_NAME):
+    """
+    Replace a database's contents, and its archive's, with a backup's, after checking the backup's integrity.
+
+    The database and archive are restored as the pair they were backed up as. Restoring one
+    without the other would leave posts both live and archived, or in neither, so a backup
+    taken before there was an archive is refused while an archive exists; move the archive
+    aside first. The pages are written through a connection to the database rather than by
+    copying files, so a -wal file left beside the old database can't be replayed over the
+    restored one. Stop the server first; its open connections would otherwise see the data
+    swapped under them.
+    """
+
+    archivePath = archiveBackupPath(path)
+    archiveName = archiveNameFor(databaseName)
+    hasArchiveBackup = os.path.exists(archivePath)
+    if not hasArchiveBackup and os.path.exists(archiveName):
+        raise RuntimeError(
+            f"{path} was taken without an archive but {archiveName} exists; "
+            f"restoring only the main database would duplicate or lose archived posts, move {archiveName} aside first"
+        )
+
+    problems = verifyBackup(path)
+    if problems:
+        raise RuntimeError(f"Backup failed its integrity check, not restoring it: {'; '.join(problems[:5])}")
+
+    _restoreFile(path, databaseName)
+    if hasArchiveBackup:
+        _restoreFile(archivePath, archiveName)
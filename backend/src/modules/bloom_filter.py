@@ -0,0 +1,36 @@
+import hashlib
+import math
+
+
+class BloomFilter:
+    """
+    Set membership of byte strings in a fixed bit array: no false negatives, and false
+    positives at about falsePositiveRate while no more than capacity keys have been added.
+    """
+
+    def __init__(self, capacity: int, falsePositiveRate: float):
+        self.capacity = max(1, capacity)
+
+        # Standard sizing: m = -n ln(p) / ln(2)^2 bits and k = m/n ln(2) hashes
+        self.bitCount = max(8, int(-self.capacity * math.log(falsePositiveRate) / math.log(2) ** 2))
+        self.hashCount = max(1, round(self.bitCount / self.capacity * math.log(2)))
+        self.bits = bytearray((self.bitCount + 7) // 8)
+        self.count = 0
+
+
+    def _positions(self, key: bytes):
+        # Double hashing: k positions from two independent 64 bit halves of one digest
+        digest = hashlib.blake2b(key, digest_size=16).digest()
+        first = int.from_bytes(digest[:8], 'little')
+        second = int.from_bytes(digest[8:], 'little') | 1
+        return ((first + i * second) % self.bitCount for i in range(self.hashCount))
+
+
+    def add(self, key: bytes):
+        for position in self._positions(key):
+            self.bits[position >> 3] |= 1 << (position & 7)
+        self.count += 1
+
+
+    def __contains__(self, key: bytes) -> bool:
+        return all(self.bits[position >> 3] & (1 << (position & 7)) for position in self._positions(key))
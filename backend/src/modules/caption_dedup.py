@@ -0,0 +1,219 @@
+import hashlib
+import os
+import re
+import threading
+from collections import OrderedDict
+from datetime import timedelta
+
+from litestar import status_codes
+from litestar.exceptions import HTTPException
+
+from src.modules.database import timestampAgo
+
+
+# What createCaption does with a caption too similar to one already on the post:
+# 'reject' refuses it with 409, 'flag' stores it and reports duplicateOfCaptionId, 'off' skips the check
+CAPTION_DUPLICATE_POLICY = os.environ.get('CAPRANK_CAPTION_DUPLICATE_POLICY', 'flag')
+
+# Estimated Jaccard similarity of two captions' character trigrams from which they count as duplicates
+CAPTION_DUPLICATE_THRESHOLD = float(os.environ.get('CAPRANK_CAPTION_DUPLICATE_THRESHOLD', '0.8'))
+
+# MinHash signature length, split into LSH bands of MINHASH_ROWS values; 8 x 8 puts the
+# similarity at which two captions become likely candidates near 0.77
+MINHASH_BANDS = 8
+MINHASH_ROWS = 8
+MINHASH_PERMUTATIONS = MINHASH_BANDS * MINHASH_ROWS
+
+# Posts whose caption index is kept in memory; the least recently checked goes first
+MAX_INDEXED_POSTS = 2000
+
+# Captions younger than this are read again on every check. On PostgreSQL a caption can
+# commit after one with a higher id, and no write transaction stays open this long.
+CAPTION_SETTLE_SECONDS = 60
+
+SHINGLE_SIZE = 3
+
+# Offset added per bin skipped when filling an empty bin from its neighbour, so borrowed
+# values only match values borrowed the same distance away
+_DENSIFY_OFFSET = 1 << 58
+
+
+def shingles(text: str) -> set:
+    """Character trigrams of the caption with case, punctuation and spacing folded away."""
+
+    normalized = ' '.join(re.sub(r'[\W_]+', ' ', text.lower()).split())
+    if len(normalized) <= SHINGLE_SIZE:
+        return {normalized}
+    return {normalized[i:i + SHINGLE_SIZE] for i in range(len(normalized) - SHINGLE_SIZE + 1)}
+
+
+def minHash(text: str) -> tuple:
+    """
+    One permutation MinHash signature: each trigram is hashed once into one of
+    MINHASH_PERMUTATIONS bins keeping the minimum, and empty bins borrow from the next
+    filled one, which costs one hash per trigram rather than one per trigram per permutation.
+    """
+
+    bins = [None] * MINHASH_PERMUTATIONS
+    for shingle in shingles(text):
+        shingleHash = int.from_bytes(hashlib.blake2b(shingle.encode(), digest_size=8).digest(), 'big')
+        slot = shingleHash % MINHASH_PERMUTATIONS
+        value = shingleHash // MINHASH_PERMUTATIONS
+        if bins[slot] is None or value < bins[slot]:
+            bins[slot] = value
+
+    signature = []
+    for slot in range(MINHASH_PERMUTATIONS):
+        distance = 0
+        while bins[(slot + distance) % MINHASH_PERMUTATIONS] is None:
+            distance += 1
+        signature.append(bins[(slot + distance) % MINHASH_PERMUTATIONS] + distance * _DENSIFY_OFFSET)
+    return tuple(signature)
+
+
+def similarity(signature: tuple, otherSignature: tuple) -> float:
+    """Estimated Jaccard similarity of the captions behind two signatures."""
+
+    return sum(1 for value, otherValue in zip(signature, otherSignature) if value == otherValue) / MINHASH_PERMUTATIONS
+
+
+
+class CaptionLSH:
+    """MinHash signatures of one post's captions, banded so similar ones share a bucket."""
+
+    def __init__(self):
+        self.bands = [{} for _ in range(MINHASH_BANDS)]
+        self.signatures = {}
+        # Every caption of the post up to this id is indexed
+        self.settledCaptionId = 0
+
+
+    def add(self, captionId: int, signature: tuple):
+        self.signatures[captionId] = signature
+        for band, buckets in enumerate(self.bands):
+            buckets.setdefault(signature[band * MINHASH_ROWS:(band + 1) * MINHASH_ROWS], []).append(captionId)
+
+
+    def similar(self, signature: tuple, threshold: float = CAPTION_DUPLICATE_THRESHOLD) -> list:
+        """(captionId, similarity) pairs at or above threshold, most similar first."""
+
+        candidates = set()
+        for band, buckets in enumerate(self.bands):
+            candidates.update(buckets.get(signature[band * MINHASH_ROWS:(band + 1) * MINHASH_ROWS], ()))
+
+        matches = [(captionId, similarity(signature, self.signatures[captionId])) for captionId in candidates]
+        matches = [match for match in matches if match[1] >= threshold]
+        matches.sort(key=lambda match: (-match[1], match[0]))
+        return matches
+
+
+
+class CaptionDuplicates:
+    """
+    Spots a new caption that repeats one already on its post.
+
+    Each post's index is built from LiveCaption the first time a caption is added to it,
+    and catches up on captions other workers added by reading only ids past the newest
+    settled one, so a check costs a constant number of bucket lookups however many captions
+    the post has. Captions from the last CAPTION_SETTLE_SECONDS are read again each time,
+    so one that committed after a caption with a higher id isn't skipped. Candidates are
+    confirmed against LiveCaption, as captions deleted since they were indexed stay in the buckets.
+    """
+
+    def __init__(self, policy: str = CAPTION_DUPLICATE_POLICY, threshold: float = CAPTION_DUPLICATE_THRESHOLD,
+                 maxIndexedPosts: int = MAX_INDEXED_POSTS):
+        if policy not in ('reject', 'flag', 'off'):
+            raise ValueError(f"Unsupported caption duplicate policy: {policy}")
+
+        self.policy = policy
+        self.threshold = threshold
+        self.maxIndexedPosts = maxIndexedPosts
+        self.posts = OrderedDict()
+        # PostgreSQL runs write operations on several threads at once
+        self.lock = threading.Lock()
+
+
+    def _postIndex(self, cursor, postId: int) -> CaptionLSH:
+        with self.lock:
+            index = self.posts.get(postId)
+            if index is None:
+                index = self.posts[postId] = CaptionLSH()
+                if len(self.posts) > self.maxIndexedPosts:
+                    self.posts.popitem(last=False)
+            else:
+                self.posts.move_to_end(postId)
+            settledCaptionId = index.settledCaptionId
+            indexedIds = set(index.signatures)
+
+        cursor.execute("""
+            SELECT id, text, created_at
+            FROM LiveCaption
+            WHERE postId = ? AND id > ?
+            ORDER BY id
+        """, (postId, settledCaptionId))
+        captions = cursor.fetchall()
+        newCaptions = [(captionId, minHash(text)) for captionId, text, _ in captions if captionId not in indexedIds]
+
+        # The mark only moves past captions old enough that no lower id can still be uncommitted
+        settledBefore = timestampAgo(timedelta(seconds=CAPTION_SETTLE_SECONDS))
+        for captionId, _, createdAt in captions:
+            if str(createdAt) >= settledBefore:
+                break
+            settledCaptionId = captionId
+
+        with self.lock:
+            for captionId, signature in newCaptions:
+                if captionId not in index.signatures:
+                    index.add(captionId, signature)
+            index.settledCaptionId = max(index.settledCaptionId, settledCaptionId)
+
+        return index
+
+
+    def duplicateOf(self, cursor, postId: int, text: str):
+        """Id of the live caption on postId most similar to text above the threshold, or None."""
+
+        index = self._postIndex(cursor, postId)
+        signature = minHash(text)
+        with self.lock:
+            matches = index.similar(signature, self.threshold)
+        if not matches:
+            return None
+
+        placeholders = ', '.join('?' for _ in matches)
+        cursor.execute(f"""
+            SELECT id
+            FROM LiveCaption
+            WHERE id IN ({placeholders})
+        """, [captionId for captionId, _ in matches])
+        liveIds = {row[0] for row in cursor.fetchall()}
+
+        return next((captionId for captionId, _ in matches if captionId in liveIds), None)
+
+
+    def check(self, cursor, postId: int, text: str):
+        """
+        Apply the policy to a caption about to be added to postId, inside the write operation
+        adding it: raises 409 under 'reject', else returns the caption it duplicates, if any.
+        """
+
+        if self.policy == 'off':
+            return None
+
+        duplicateId = self.duplicateOf(cursor, postId, text)
+        if duplicateId is not None and self.policy == 'reject':
+            raise HTTPException(
+                status_code=status_codes.HTTP_409_CONFLICT,
+                detail=f"A caption like this one is already on the post: {duplicateId}",
+                extra={'duplicateOfCaptionId': duplicateId}
+            )
+        return duplicateId
+
+
+    def clear(self):
+        with self.lock:
+            self.posts.clear()
+
+
+
+captionDuplicates = CaptionDuplicates()
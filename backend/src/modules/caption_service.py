@@ -0,0 +1,120 @@
+from litestar import status_codes
+from litestar.exceptions import HTTPException
+
+from src.modules.change_log import recordChange
+from src.modules.caption_dedup import captionDuplicates
+from src.modules.content_filter import contentFilter
+
+
+def insertCaption(cursor, postId: int, userId: int, password: str, text: str) -> dict:
+    """
+    Add a caption to a post inside a write operation, returning its captionId and, when it
+    repeats a caption already on the post, that caption's id as duplicateOfCaptionId.
+    """
+
+    # Raises or masks blocked words, depending on the policy
+    text = contentFilter.check(text)
+
+    # Verify user credentials
+    cursor.execute("""
+        SELECT *
+        FROM LiveUser
+        WHERE id = ? AND password = ?
+    """, (userId, password))
+
+    user = cursor.fetchone()
+    if not user:
+        raise HTTPException(status_code=status_codes.HTTP_401_UNAUTHORIZED, detail="Invalid credentials")
+
+    # Verify post exists
+    cursor.execute("""
+        SELECT *
+        FROM LivePost
+        WHERE id = ?
+    """, (postId,))
+
+    post = cursor.fetchone()
+    if not post:
+        raise HTTPException(status_code=status_codes.HTTP_404_NOT_FOUND, detail="Post not found")
+
+    # Raises under the 'reject' policy
+    duplicate_of = captionDuplicates.check(cursor, postId, text)
+
+    # Create caption
+    cursor.execute("""
+        INSERT INTO Caption (postId, userId, text)
+        VALUES (?, ?, ?)
+        RETURNING id
+    """, (postId, userId, text))
+
+    caption_id = cursor.fetchone()[0]
+
+    cursor.execute("""
+        UPDATE Post
+        SET captionCount = captionCount + 1
+        WHERE id = ?
+    """, (postId,))
+
+    recordChange(cursor, 'caption', caption_id)
+    recordChange(cursor, 'post', postId)
+
+    if duplicate_of is not None:
+        return {'captionId': caption_id, 'duplicateOfCaptionId': duplicate_of}
+    return {'captionId': caption_id}
+
+
+def insertComment(cursor, captionId: int, userId: int, password: str, text: str, parentId: int = None) -> int:
+    """Add a comment, or a reply to parentId, to a caption inside a write operation, returning its id."""
+
+    text = contentFilter.check(text)
+
+    # Verify user credentials
+    cursor.execute("""
+        SELECT *
+        FROM LiveUser
+        WHERE id = ? AND password = ?
+    """, (userId, password))
+
+    user = cursor.fetchone()
+    if not user:
+        raise HTTPException(status_code=status_codes.HTTP_401_UNAUTHORIZED, detail="Invalid credentials")
+
+    # Verify caption exists
+    cursor.execute("""
+        SELECT *
+        FROM LiveCaption
+        WHERE id = ?
+    """, (captionId,))
+
+    caption = cursor.fetchone()
+    if not caption:
+        raise HTTPException(status_code=status_codes.HTTP_404_NOT_FOUND, detail="Caption not found")
+
+    # A reply has to stay in the thread of its parent
+    if parentId is not None:
+        cursor.execute("""
+            SELECT 1
+            FROM CaptionComments
+            WHERE id = ? AND captionId = ?
+        """, (parentId, captionId))
+
+        if not cursor.fetchone():
+            raise HTTPException(status_code=status_codes.HTTP_404_NOT_FOUND, detail="Parent comment not found on this caption")
+
+    # Create comment
+    cursor.execute("""
+        INSERT INTO CaptionComments (captionId, userId, text, parentId)
+        VALUES (?, ?, ?, ?)
+        RETURNING id
+    """, (captionId, userId, text, parentId))
+
+    comment_id = cursor.fetchone()[0]
+
+    cursor.execute("""
+        UPDATE Caption
+        SET commentCount = commentCount + 1
+        WHERE id = ?
+    """, (captionId,))
+
+    recordChange(cursor, 'caption', captionId)
+    return comment_id
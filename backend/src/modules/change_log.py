@@ -0,0 +1,41 @@
+from src.modules.database import PostgresCursor
+
+
+# Entity kinds a client caches, as named in ChangeLog.entity
+CHANGE_ENTITIES = ('post', 'caption', 'user')
+
+# Any constant shared by every process; serialises ChangeLog inserts in PostgreSQL
+POSTGRES_CHANGE_LOG_LOCK_KEY = 4_711_231
+
+
+def _lockChangeLog(cursor):
+    # Sequence numbers must become visible in order, or a client syncing in between would
+    # skip one for good. SQLite's single writer guarantees that; PostgreSQL needs the
+    # transactions that log changes to commit one at a time.
+    if isinstance(cursor, PostgresCursor):
+        cursor.execute("SELECT pg_advisory_xact_lock(?)", (POSTGRES_CHANGE_LOG_LOCK_KEY,))
+
+
+def recordChange(cursor, entity: str, entityIds):
+    """Log that the given posts, captions or users changed, inside the write operation that changed them."""
+
+    entityIds = [entityIds] if isinstance(entityIds, (int, str)) else list(entityIds)
+    if not entityIds:
+        return
+
+    _lockChangeLog(cursor)
+    cursor.executemany("""
+        INSERT INTO ChangeLog (entity, entityId)
+        VALUES (?, ?)
+    """, [(entity, int(entityId)) for entityId in entityIds])
+
+
+def recordChangesWhere(cursor, entity: str, idQuery: str, parameters=()):
+    """Log a change for every id idQuery selects, for changes touching many rows at once."""
+
+    _lockChangeLog(cursor)
+    cursor.execute(f"""
+        INSERT INTO ChangeLog (entity, entityId)
+        SELECT ?, id
+        FROM ({idQuery}) changed
+    """, (entity, *parameters))
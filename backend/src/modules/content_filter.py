@@ -0,0 +1,225 @@
+import os
+import threading
+import time
+import unicodedata
+from collections import deque
+
+from litestar import status_codes
+from litestar.exceptions import HTTPException
+
+
+# One blocked word or phrase per line; blank lines and lines starting with # are skipped
+BLOCKED_WORDS_FILE = os.environ.get('CAPRANK_BLOCKED_WORDS_FILE', 'src/blocked_words.txt')
+
+# What a caption or comment containing a blocked word gets: 'reject' refuses it with 400,
+# 'mask' stores it with the matches replaced by asterisks, 'off' skips the check
+CONTENT_FILTER_POLICY = os.environ.get('CAPRANK_CONTENT_FILTER_POLICY', 'reject')
+
+# How often the word list's modification time is checked, so edits apply without a restart
+CONTENT_FILTER_RELOAD_SECONDS = float(os.environ.get('CAPRANK_CONTENT_FILTER_RELOAD', '5'))
+
+# Look-alike characters folded into the letter they stand in for, after NFKD and case folding
+CONFUSABLES = {
+    '0': 'o', '1': 'i', '3': 'e', '4': 'a', '5': 's', '7': 't', '8': 'b', '9': 'g',
+    '@': 'a', '$': 's',
+    # Cyrillic and Greek letters drawn like Latin ones
+    'а': 'a', 'в': 'b', 'е': 'e', 'к': 'k', 'м': 'm', 'н': 'h', 'о': 'o', 'р': 'p',
+    'с': 'c', 'т': 't', 'у': 'y', 'х': 'x', 'і': 'i', 'ј': 'j', 'ѕ': 's',
+    'α': 'a', 'β': 'b', 'ε': 'e', 'ι': 'i', 'κ': 'k', 'ν': 'v', 'ο': 'o', 'ρ': 'p',
+    'τ': 't', 'υ': 'u', 'χ': 'x',
+}
+
+_ASCII_CONFUSABLES = str.maketrans({character: letter for character, letter in CONFUSABLES.items() if character.isascii()})
+
+
+def normalize(text: str):
+    """
+    Text folded for matching, and for each of its characters the index of the character of
+    text it came from: case folded, accents and width variants removed, look-alikes mapped.
+    """
+
+    # Most captions are plain ASCII, where folding keeps every character in place
+    if text.isascii():
+        return text.lower().translate(_ASCII_CONFUSABLES), range(len(text))
+
+    folded = []
+    origins = []
+    for index, character in enumerate(text):
+        for part in unicodedata.normalize('NFKD', character).casefold():
+            if unicodedata.combining(part):
+                continue
+            folded.append(CONFUSABLES.get(part, part))
+            origins.append(index)
+    return ''.join(folded), origins
+
+
+def _isWordCharacter(character: str) -> bool:
+    return character.isalnum()
+
+
+
+class AhoCorasick:
+    """
+    Automaton matching every pattern in one left to right pass over the text.
+
+    States are trie nodes of the patterns; a node's fail link points to the longest proper
+    suffix of its path that is also a trie path, so on a mismatch the scan follows fail links
+    instead of going back in the text, and each character costs amortised constant time
+    however many patterns there are.
+    """
+
+    def __init__(self, patterns):
+        self.goto = [{}]
+        self.fail = [0]
+        # Lengths of the patterns ending at each state, including those reached by fail links
+        self.output = [()]
+
+        for pattern in patterns:
+            state = 0
+            for character in pattern:
+                nextState = self.goto[state].get(character)
+                if nextState is None:
+                    nextState = len(self.goto)
+                    self.goto[state][character] = nextState
+                    self.goto.append({})
+                    self.fail.append(0)
+                    self.output.append(())
+                state = nextState
+            if len(pattern) not in self.output[state]:
+                self.output[state] += (len(pattern),)
+
+        queue = deque(self.goto[0].values())
+        while queue:
+            state = queue.popleft()
+            for character, nextState in self.goto[state].items():
+                queue.append(nextState)
+                fallback = self.fail[state]
+                while fallback and character not in self.goto[fallback]:
+                    fallback = self.fail[fallback]
+                self.fail[nextState] = self.goto[fallback].get(character, 0)
+                self.output[nextState] += self.output[self.fail[nextState]]
+
+
+    def __len__(self):
+        return len(self.goto)
+
+
+    def scan(self, text: str):
+        """Yield (start, end) of every pattern occurrence in text."""
+
+        goto, fail, output = self.goto, self.fail, self.output
+        state = 0
+        for index, character in enumerate(text):
+            while state and character not in goto[state]:
+                state = fail[state]
+            state = goto[state].get(character, 0)
+            for length in output[state]:
+                yield index + 1 - length, index + 1
+
+
+
+class ContentFilter:
+    """
+    Blocked words in caption and comment text.
+
+    Words are normalized like the text, so 'B@D' and 'ｂａｄ' match 'bad', and compiled into one
+    Aho-Corasick automaton. Matches must start and end on a word boundary, so a blocked word
+    inside a longer, harmless word doesn't count. The word list is reloaded when its file
+    changes; a reload builds a new automaton and swaps it in, so scans never see half of one.
+    """
+
+    def __init__(self, path: str = BLOCKED_WORDS_FILE, policy: str = CONTENT_FILTER_POLICY,
+                 reloadSeconds: float = CONTENT_FILTER_RELOAD_SECONDS, words=None):
+        if policy not in ('reject', 'mask', 'off'):
+            raise ValueError(f"Unsupported content filter policy: {policy}")
+
+        self.path = path
+        self.policy = policy
+        self.reloadSeconds = reloadSeconds
+        self.automaton = AhoCorasick([])
+        self.loadedMtime = None
+        self.checkedAt = None
+        self.lock = threading.Lock()
+
+        if words is not None:
+            self.path = None
+            self.setWords(words)
+
+
+    def setWords(self, words):
+        patterns = {normalize(word.strip())[0] for word in words if word.strip()}
+        self.automaton = AhoCorasick(sorted(patterns))
+
+
+    def load(self):
+        """(Re)load the word list if its file changed since it was last loaded."""
+
+        self.checkedAt = time.monotonic()
+        if self.path is None:
+            return
+
+        try:
+            mtime = os.stat(self.path).st_mtime
+        except FileNotFoundError:
+            mtime = None
+
+        with self.lock:
+            if mtime == self.loadedMtime:
+                return
+
+            if mtime is None:
+                words = []
+            else:
+                with open(self.path, encoding='utf-8') as f:
+                    words = [line for line in f if line.strip() and not line.lstrip().startswith('#')]
+
+            self.setWords(words)
+            self.loadedMtime = mtime
+
+
+    def matches(self, text: str) -> list:
+        """(start, end) spans of text holding a blocked word, in order."""
+
+        if self.checkedAt is None or time.monotonic() - self.checkedAt > self.reloadSeconds:
+            self.load()
+
+        normalized, origins = normalize(text)
+        spans = []
+        for start, end in self.automaton.scan(normalized):
+            if start > 0 and _isWordCharacter(normalized[start - 1]):
+                continue
+            if end < len(normalized) and _isWordCharacter(normalized[end]):
+                continue
+            spans.append((origins[start], origins[end - 1] + 1))
+
+        spans.sort()
+        return spans
+
+
+    def check(self, text: str) -> str:
+        """Apply the policy to text about to be stored: raises 400 under 'reject', returns it masked under 'mask'."""
+
+        if self.policy == 'off' or not text:
+            return text
+
+        spans = self.matches(text)
+        if not spans:
+            return text
+
+        if self.policy == 'reject':
+            raise HTTPException(
+                status_code=status_codes.HTTP_400_BAD_REQUEST,
+                detail="Text contains blocked words",
+                extra={'matches': [[start, end] for start, end in spans]}
+            )
+
+        masked = list(text)
+        for start, end in spans:
+            for index in range(start, end):
+                if not masked[index].isspace():
+                    masked[index] = '*'
+        return ''.join(masked)
+
+
+
+contentFilter = ContentFilter()
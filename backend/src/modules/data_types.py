@@ -1,7 +1,7 @@
-from pydantic import BaseModel, Field, ConfigDict
+from pydantic import BaseModel, Field, ConfigDict, model_validator
 from litestar.datastructures import UploadFile
 
-from typing import Optional, Annotated
+from typing import Optional, Annotated, List, Literal
 
 
 class DT_UserRegister(BaseModel):
@@ -53,8 +53,55 @@ class DT_CaptionCreate(BaseModel):
     text: str
 
 
+class DT_LikeSet(BaseModel):
+    userId: Annotated[int, Field(ge=1)]
+    password: Annotated[str, Field(min_length=1)]
+
+
 class DT_CommentCreate(BaseModel):
     captionId: int
     userId: int
     password: str
     text: str
+    parentId: Optional[int] = None
+
+
+
+# Operations POST /batch accepts, and the field each one targets
+BATCH_OPERATION_TARGETS = {
+    'likePost': 'postId',
+    'unlikePost': 'postId',
+    'likeCaption': 'captionId',
+    'unlikeCaption': 'captionId',
+    'createCaption': 'postId',
+    'addComment': 'captionId',
+}
+
+# Operations a single POST /batch may carry, so one batch can't hold the writer for long
+MAX_BATCH_OPERATIONS = 100
+
+
+class DT_BatchOperation(BaseModel):
+    op: Literal['likePost', 'unlikePost', 'likeCaption', 'unlikeCaption', 'createCaption', 'addComment']
+    postId: Optional[Annotated[int, Field(ge=1)]] = None
+    captionId: Optional[Annotated[int, Field(ge=1)]] = None
+    text: Optional[Annotated[str, Field(min_length=1)]] = None
+    parentId: Optional[int] = None
+    idempotencyKey: Optional[Annotated[str, Field(min_length=1, max_length=200)]] = None
+
+    @model_validator(mode='after')
+    def checkFields(self):
+        target = BATCH_OPERATION_TARGETS[self.op]
+        if getattr(self, target) is None:
+            raise ValueError(f"{self.op} needs {target}")
+        if self.op in ('createCaption', 'addComment') and self.text is None:
+            raise ValueError(f"{self.op} needs text")
+        return self
+
+
+class DT_Batch(BaseModel):
+    userId: Annotated[int, Field(ge=1)]
+    password: Annotated[str, Field(min_length=1)]
+    operations: Annotated[List[DT_BatchOperation], Field(min_length=1, max_length=MAX_BATCH_OPERATIONS)]
+    # Roll the whole batch back on the first failing operation, instead of skipping just that one
+    atomic: bool = False
@@ -0,0 +1,117 @@
+import csv
+import io
+import json
+from datetime import datetime, timezone
+
+from src.modules.database import database as defaultDatabase
+from src.modules.queries import archivedSql, hasArchive
+
+
+# Table name -> (columns, FROM clause, column filtered by postId, column filtered by since, whether rows are archived with posts)
+EXPORT_TABLES = {
+    'posts': (
+        ('id', 'userId', 'imageName', 'created_at', 'likes', 'topCaptionId', 'captionCount'),
+        "LivePost t",
+        "t.id",
+        "t.created_at",
+        True,
+    ),
+    'captions': (
+        ('id', 'postId', 'userId', 'text', 'created_at', 'likes', 'commentCount'),
+        "LiveCaption t",
+        "t.postId",
+        "t.created_at",
+        True,
+    ),
+    'comments': (
+        ('id', 'captionId', 'userId', 'text', 'created_at', 'parentId'),
+        "CaptionComments t JOIN LiveCaption c ON c.id = t.captionId",
+        "c.postId",
+        "t.created_at",
+        True,
+    ),
+    'users': (
+        ('id', 'username', 'name', 'profilePicture', 'created_at'),
+        "LiveUser t",
+        None,
+        "t.created_at",
+        False,
+    ),
+}
+
+EXPORT_FORMATS = {
+    'ndjson': 'application/x-ndjson',
+    'csv': 'text/csv',
+}
+
+
+def exportQuery(table: str, since: str = None, postId: int = None, afterId: int = None, withArchive: bool = False):
+    """SQL and parameters selecting table's rows in id order, filtered by the options given, archived rows included if withArchive."""
+
+    columns, source, postColumn, sinceColumn, archived = EXPORT_TABLES[table]
+
+    conditions = []
+    parameters = []
+    if since is not None:
+        conditions.append(f"{sinceColumn} >= ?")
+        parameters.append(since)
+    if postId is not None:
+        if postColumn is None:
+            raise ValueError(f"{table} can't be filtered by postId")
+        conditions.append(f"{postColumn} = ?")
+        parameters.append(postId)
+    if afterId is not None:
+        conditions.append("t.id > ?")
+        parameters.append(afterId)
+
+    where = f"WHERE {' AND '.join(conditions)}" if conditions else ""
+    select = f"""
+        SELECT {', '.join(f't.{column} AS {column}' for column in columns)}
+        FROM {source}
+        {where}
+    """
+
+    # Archived rows left the hot tables, so the two halves never share an id
+    if withArchive and archived:
+        return f"{select} UNION ALL {archivedSql(select)} ORDER BY id", parameters + parameters
+    return f"{select} ORDER BY t.id", parameters
+
+
+def normalizeSince(since: str) -> str:
+    """An ISO date or time as the created_at text both backends store, so they compare in order."""
+
+    moment = datetime.fromisoformat(since.replace('Z', '+00:00'))
+    # Stored times are UTC, so an offset is converted rather than dropped
+    if moment.tzinfo is not None:
+        moment = moment.astimezone(timezone.utc)
+    return moment.strftime('%Y-%m-%d %H:%M:%S')
+
+
+async def exportRows(table: str, format: str, since: str = None, postId: int = None, afterId: int = None,
+                     database=defaultDatabase):
+    """
+    Yield a table as NDJSON or CSV, one encoded chunk per batch of rows fetched, so memory
+    stays flat however many rows there are.
+    """
+
+    columns = EXPORT_TABLES[table][0]
+    sql, parameters = exportQuery(table, since, postId, afterId, await database.read(hasArchive))
+
+    if format == 'csv':
+        buffer = io.StringIO()
+        writer = csv.writer(buffer)
+        writer.writerow(columns)
+
+    async for rows in database.stream(sql, parameters):
+        if format == 'csv':
+            writer.writerows(rows)
+            chunk = buffer.getvalue()
+            buffer.seek(0)
+            buffer.truncate()
+        else:
+            chunk = ''.join(json.dumps(dict(zip(columns, row)), ensure_ascii=False) + '\n' for row in rows)
+        yield chunk.encode()
+
+    # The header of an empty CSV export
+    if format == 'csv' and buffer.tell():
+        yield buffer.getvalue().encode()
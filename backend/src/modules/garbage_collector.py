@@ -0,0 +1,300 @@
+import asyncio
+import itertools
+import json
+import os
+import time
+from datetime import timedelta
+
+from src.modules.database import database as defaultDatabase
+from src.modules.queries import hasArchive
+from src.routes.post import postImageFolder
+
+
+# Progress of an interrupted run, so the next one carries on where it stopped
+GC_STATE_PATH = os.environ.get('CAPRANK_GC_STATE', 'CapRank.gc.json')
+
+# Files or rows looked at per step; memory use is bounded by this, not by the data size
+GC_CHUNK_SIZE = 1000
+
+# createPost writes the image before inserting its Post row, so young files are left alone
+GC_IMAGE_GRACE_PERIOD = timedelta(hours=1)
+
+# (table, key columns, condition on alias t that makes a row dangling), children after parents
+DANGLING_ROW_CHECKS = [
+    ('Caption', ['id'], """
+        NOT EXISTS (SELECT 1 FROM Post WHERE id = t.postId)
+        OR NOT EXISTS (SELECT 1 FROM User WHERE id = t.userId)
+    """),
+    ('UserLikedPosts', ['userId', 'postId'], """
+        NOT EXISTS (SELECT 1 FROM Post WHERE id = t.postId)
+        OR NOT EXISTS (SELECT 1 FROM User WHERE id = t.userId)
+    """),
+    ('UserLikedCaptions', ['userId', 'captionId'], """
+        NOT EXISTS (SELECT 1 FROM Caption WHERE id = t.captionId)
+        OR NOT EXISTS (SELECT 1 FROM User WHERE id = t.userId)
+    """),
+    ('CaptionComments', ['id'], """
+        NOT EXISTS (SELECT 1 FROM Caption WHERE id = t.captionId)
+        OR NOT EXISTS (SELECT 1 FROM User WHERE id = t.userId)
+    """),
+]
+
+
+class PhaseStats:
+    def __init__(self, name: str):
+        self.name = name
+        self.scanned = 0
+        self.garbage = 0
+        self.removed = 0
+        self.seconds = 0.0
+
+
+    def __str__(self) -> str:
+        rate = self.scanned / self.seconds if self.seconds else 0
+        return f"{self.name:<18} scanned {self.scanned:>10}  garbage {self.garbage:>8}  removed {self.removed:>8}  {self.seconds:8.2f}s  {rate:>10.0f}/s"
+
+
+
+class GarbageCollector:
+    """
+    Reconciles the image folder with Post.imageName and removes rows whose parent is gone.
+
+    Work happens in chunks of chunkSize: the image folder is streamed with os.scandir and
+    each chunk of names is checked against the Post.imageName index, and tables are walked
+    in primary key order. After every chunk the position is saved to statePath, so a run
+    stopped by maxSeconds or a crash resumes from there. A dry run reports without
+    removing anything and leaves the saved position alone.
+    """
+
+    def __init__(self, database=defaultDatabase, imageFolder: str = postImageFolder, chunkSize: int = GC_CHUNK_SIZE,
+                 dryRun: bool = False, statePath: str = GC_STATE_PATH, gracePeriod: timedelta = GC_IMAGE_GRACE_PERIOD):
+        self.database = database
+        self.imageFolder = imageFolder
+        self.chunkSize = chunkSize
+        self.dryRun = dryRun
+        self.statePath = statePath
+        self.gracePeriod = gracePeriod
+        self.state = {}
+        self.deadline = None
+
+
+    def _loadState(self):
+        if self.dryRun or not os.path.exists(self.statePath):
+            return {}
+        with open(self.statePath) as stateFile:
+            return json.load(stateFile)
+
+
+    def _saveState(self):
+        if self.dryRun:
+            return
+        temporaryPath = f"{self.statePath}.tmp"
+        with open(temporaryPath, 'w') as stateFile:
+            json.dump(self.state, stateFile)
+        os.replace(temporaryPath, self.statePath)
+
+
+    def reset(self):
+        """Forget the progress of an interrupted run."""
+
+        self.state = {}
+        if os.path.exists(self.statePath):
+            os.remove(self.statePath)
+
+
+    def _outOfTime(self) -> bool:
+        return self.deadline is not None and time.monotonic() >= self.deadline
+
+
+    async def run(self, maxSeconds: float = None, progress=None) -> list:
+        """Run every phase, or until maxSeconds is up; returns a PhaseStats per phase touched."""
+
+        self.state = self._loadState()
+        self.deadline = time.monotonic() + maxSeconds if maxSeconds else None
+        allStats = []
+
+        phases = [('images', self._collectImages)]
+        phases += [(table, self._collectDanglingRows) for table, _, _ in DANGLING_ROW_CHECKS]
+
+        for phase, collect in phases:
+            if phase in self.state.get('finished', []):
+                continue
+
+            stats = PhaseStats(phase)
+            allStats.append(stats)
+            started = time.monotonic()
+
+            finished = await collect(phase, stats, progress)
+
+            stats.seconds = time.monotonic() - started
+            if not finished:
+                return allStats
+
+            self.state.setdefault('finished', []).append(phase)
+            self.state.pop(phase, None)
+            self._saveState()
+
+        # A complete pass: the next run starts from the beginning
+        if self.dryRun:
+            self.state = {}
+        else:
+            self.reset()
+
+        return allStats
+
+
+    async def _collectImages(self, phase: str, stats: PhaseStats, progress) -> bool:
+        if not os.path.isdir(self.imageFolder):
+            return True
+
+        # Position counts the entries before the checkpoint that are still there, so removing
+        # orphans doesn't shift it. Files other processes add or remove meanwhile can, which
+        # the next full pass makes up for.
+        position = self.state.get(phase, {}).get('position', 0)
+        youngestAllowed = time.time() - self.gracePeriod.total_seconds()
+
+        with os.scandir(self.imageFolder) as directory:
+            entries = iter(directory)
+            for _ in itertools.islice(entries, position):
+                pass
+
+            exhausted = False
+            while not exhausted:
+                chunk = []
+                while len(chunk) < self.chunkSize:
+                    entry = next(entries, None)
+                    if entry is None:
+                        exhausted = True
+                        break
+                    position += 1
+                    if entry.is_file(follow_symlinks=False) and not entry.name.startswith('.'):
+                        chunk.append(entry)
+
+                if chunk:
+                    position -= await self._removeOrphanedImages(chunk, youngestAllowed, stats, progress)
+
+                self.state[phase] = {'position': position}
+                self._saveState()
+
+                if not exhausted and self._outOfTime():
+                    return False
+
+                # Let other tasks on the loop run between chunks
+                await asyncio.sleep(0)
+
+        return True
+
+
+    async def _removeOrphanedImages(self, chunk: list, youngestAllowed: float, stats: PhaseStats, progress) -> int:
+        def fetchReferenced(cursor):
+            placeholders = ', '.join('?' for _ in chunk)
+            cursor.execute(f"""
+                SELECT imageName
+                FROM Post
+                WHERE imageName IN ({placeholders})
+            """, [entry.name for entry in chunk])
+            referenced = {row[0] for row in cursor.fetchall()}
+
+            # Archived posts still show their images
+            if hasArchive(cursor):
+                cursor.execute(f"""
+                    SELECT imageName
+                    FROM archive.Post
+                    WHERE imageName IN ({placeholders})
+                """, [entry.name for entry in chunk])
+                referenced.update(row[0] for row in cursor.fetchall())
+
+            return referenced
+
+        referenced = await self.database.read(fetchReferenced)
+
+        orphans = [
+            entry for entry in chunk
+            if entry.name not in referenced and entry.stat(follow_symlinks=False).st_mtime < youngestAllowed
+        ]
+
+        stats.scanned += len(chunk)
+        stats.garbage += len(orphans)
+
+        removed = 0
+        for entry in orphans:
+            if progress:
+                progress(f"orphaned image: {entry.name}")
+            if not self.dryRun:
+                try:
+                    os.remove(entry.path)
+                    removed += 1
+                except FileNotFoundError:
+                    pass
+
+        stats.removed += removed
+        return removed
+
+
+    async def _collectDanglingRows(self, table: str, stats: PhaseStats, progress) -> bool:
+        _, keyColumns, condition = next(check for check in DANGLING_ROW_CHECKS if check[0] == table)
+
+        keys = ', '.join(keyColumns)
+        key = f"({keys})" if len(keyColumns) > 1 else keys
+        keyPlaceholders = f"({', '.join('?' for _ in keyColumns)})" if len(keyColumns) > 1 else '?'
+
+        after = self.state.get(table, {}).get('after')
+
+        while True:
+            def fetchChunk(cursor):
+                # The chunk's key range first, then the dangling rows within it
+                afterFilter = f"WHERE {key} > {keyPlaceholders}" if after is not None else ""
+                cursor.execute(f"""
+                    SELECT {keys}
+                    FROM {table}
+                    {afterFilter}
+                    ORDER BY {keys}
+                    LIMIT ?
+                """, (*(after or []), self.chunkSize))
+                chunkKeys = cursor.fetchall()
+
+                if not chunkKeys:
+                    return 0, None, []
+
+                last = list(chunkKeys[-1])
+                lowerFilter = f"{key} > {keyPlaceholders} AND" if after is not None else ""
+                cursor.execute(f"""
+                    SELECT {keys}
+                    FROM {table} t
+                    WHERE {lowerFilter} {key} <= {keyPlaceholders}
+                        AND ({condition})
+                """, (*(after or []), *last))
+
+                return len(chunkKeys), last, cursor.fetchall()
+
+            scanned, last, dangling = await self.database.read(fetchChunk)
+            if not scanned:
+                return True
+
+            stats.scanned += scanned
+            stats.garbage += len(dangling)
+
+            if progress:
+                for row in dangling:
+                    progress(f"dangling {table} row: {dict(zip(keyColumns, row))}")
+
+            if dangling and not self.dryRun:
+                def deleteDangling(cursor):
+                    # Checked again, the read above ran outside this transaction
+                    cursor.executemany(f"""
+                        DELETE FROM {table} AS t
+                        WHERE {key} = {keyPlaceholders}
+                            AND ({condition})
+                    """, dangling)
+                    return len(dangling)
+
+                stats.removed += await self.database.write(deleteDangling)
+
+            after = last
+            self.state[table] = {'after': after}
+            self._saveState()
+
+            if scanned < self.chunkSize:
+                return True
+            if self._outOfTime():
+                return False
@@ -0,0 +1,39 @@
+import json
+
+from litestar import status_codes
+from litestar.exceptions import HTTPException
+
+
+def storedResponse(cursor, userId: int, key: str, operation: str, targetId: int):
+    """
+    The response stored for an operation a user already ran under key, or None if there is
+    none yet. Check the user's credentials first. A key reused for a different operation or
+    target is refused rather than answered with the other request's response.
+    """
+
+    cursor.execute("""
+        SELECT response, kind, targetId
+        FROM IdempotencyKey
+        WHERE userId = ? AND key = ?
+    """, (userId, key))
+
+    storedRow = cursor.fetchone()
+    if storedRow is None:
+        return None
+
+    response, storedOperation, storedTargetId = storedRow
+    # Keys stored before the operation was recorded with them match any request
+    if storedOperation is not None and (storedOperation != operation or storedTargetId != targetId):
+        raise HTTPException(
+            status_code=status_codes.HTTP_422_UNPROCESSABLE_ENTITY,
+            detail=f"Idempotency key {key} was already used for {storedOperation} of {storedTargetId}"
+        )
+
+    return json.loads(response)
+
+
+def storeResponse(cursor, userId: int, key: str, operation: str, targetId: int, response: dict):
+    cursor.execute("""
+        INSERT INTO IdempotencyKey (userId, key, kind, targetId, response)
+        VALUES (?, ?, ?, ?, ?)
+    """, (userId, key, operation, targetId, json.dumps(response)))
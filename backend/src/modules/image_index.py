@@ -0,0 +1,243 @@
+import asyncio
+import importlib.util
+import io
+import os
+import time
+from concurrent.futures import ProcessPoolExecutor
+
+from src.modules.database import database as defaultDatabase
+
+
+# Posts whose image hashes differ from an upload's in at most this many of 64 bits count as near duplicates
+DUPLICATE_IMAGE_MAX_DISTANCE = int(os.environ.get('CAPRANK_DUPLICATE_IMAGE_DISTANCE', '6'))
+
+# Near duplicates returned per upload, closest first
+MAX_SIMILAR_POSTS = 10
+
+# How often the index picks up hashes other workers stored
+IMAGE_INDEX_REFRESH_SECONDS = float(os.environ.get('CAPRANK_IMAGE_INDEX_REFRESH', '30'))
+
+# Processes decoding and hashing uploads, so large images don't hold up the event loop
+IMAGE_HASH_WORKERS = int(os.environ.get('CAPRANK_IMAGE_HASH_WORKERS', '2'))
+
+# Each 64 bit hash is split into this many 16 bit chunks, one lookup table per chunk
+HASH_CHUNKS = 4
+HASH_CHUNK_BITS = 64 // HASH_CHUNKS
+HASH_CHUNK_MASK = (1 << HASH_CHUNK_BITS) - 1
+
+# Only needed for duplicate detection, so Pillow isn't a hard dependency
+PILLOW_AVAILABLE = importlib.util.find_spec('PIL') is not None
+
+
+def imageHash(imageBytes: bytes):
+    """
+    64 bit difference hash (dHash) of an image, or None if it can't be decoded.
+
+    The image is shrunk to 9x8 greyscale and each bit records whether a pixel is brighter
+    than its right neighbour, so re-encoding, resizing and small edits flip only a few bits.
+    """
+
+    if not PILLOW_AVAILABLE:
+        return None
+    from PIL import Image
+
+    try:
+        with Image.open(io.BytesIO(imageBytes)) as image:
+            pixels = list(image.convert('L').resize((9, 8), Image.BILINEAR).getdata())
+    except Exception:
+        return None
+
+    hashValue = 0
+    for row in range(8):
+        for column in range(8):
+            hashValue = (hashValue << 1) | (pixels[row * 9 + column] > pixels[row * 9 + column + 1])
+    return hashValue
+
+
+def toStoredHash(hashValue: int) -> int:
+    # INTEGER and BIGINT columns are signed 64 bit
+    return hashValue - (1 << 64) if hashValue >= 1 << 63 else hashValue
+
+
+def fromStoredHash(storedHash: int) -> int:
+    return storedHash + (1 << 64) if storedHash < 0 else storedHash
+
+
+def _chunkNeighbours(value: int, radius: int) -> list:
+    """Every HASH_CHUNK_BITS wide value within radius bits of value."""
+
+    neighbours = [value]
+    frontier = [(value, -1)]
+    for _ in range(radius):
+        nextFrontier = []
+        for current, lastBit in frontier:
+            for bit in range(lastBit + 1, HASH_CHUNK_BITS):
+                flipped = current ^ (1 << bit)
+                neighbours.append(flipped)
+                nextFrontier.append((flipped, bit))
+        frontier = nextFrontier
+    return neighbours
+
+
+
+class MultiIndexHashes:
+    """
+    Image hashes of posts, searchable by Hamming distance.
+
+    Multi-index hashing: each hash is split into HASH_CHUNKS chunks and filed under every
+    chunk's value. Two hashes within maxDistance bits must agree to within
+    maxDistance // HASH_CHUNKS bits on at least one chunk, so a search only probes the few
+    chunk values that close to the query's and checks the hashes filed under them, rather
+    than comparing against every hash.
+    """
+
+    def __init__(self):
+        # Chunk value -> hashes filed under it, per chunk; the posts of each hash
+        self.tables = [{} for _ in range(HASH_CHUNKS)]
+        self.postsByHash = {}
+        self.postCount = 0
+
+
+    def __len__(self):
+        return self.postCount
+
+
+    def add(self, postId: int, hashValue: int):
+        postIds = self.postsByHash.get(hashValue)
+        if postIds is not None:
+            if postId not in postIds:
+                postIds.append(postId)
+                self.postCount += 1
+            return
+
+        self.postsByHash[hashValue] = [postId]
+        self.postCount += 1
+        for chunk, table in enumerate(self.tables):
+            key = (hashValue >> (chunk * HASH_CHUNK_BITS)) & HASH_CHUNK_MASK
+            bucket = table.get(key)
+            if bucket is None:
+                table[key] = [hashValue]
+            else:
+                bucket.append(hashValue)
+
+
+    def search(self, hashValue: int, maxDistance: int = DUPLICATE_IMAGE_MAX_DISTANCE, limit: int = MAX_SIMILAR_POSTS) -> list:
+        """(postId, distance) pairs within maxDistance bits of hashValue, closest first."""
+
+        radius = maxDistance // HASH_CHUNKS
+        matches = {}
+
+        for chunk, table in enumerate(self.tables):
+            key = (hashValue >> (chunk * HASH_CHUNK_BITS)) & HASH_CHUNK_MASK
+            for neighbour in _chunkNeighbours(key, radius):
+                bucket = table.get(neighbour)
+                if bucket:
+                    for candidate in bucket:
+                        distance = (candidate ^ hashValue).bit_count()
+                        if distance <= maxDistance:
+                            matches[candidate] = distance
+
+        similar = [(postId, distance) for candidate, distance in matches.items() for postId in self.postsByHash[candidate]]
+        similar.sort(key=lambda item: (item[1], item[0]))
+        return similar[:limit]
+
+
+
+class ImageIndex:
+    """
+    Finds existing posts whose image looks like an upload's.
+
+    Hashes are stored in PostImageHash alongside each post, so the index survives restarts:
+    each process loads them once, then every IMAGE_INDEX_REFRESH_SECONDS reads the hashes of
+    the posts logged in the ChangeLog since, to pick up other workers' uploads. Hashes are
+    stored in the same write that logs their post, by uploads and by the hash_post_images
+    backfill alike, so a hash stored for an old post shows up as well as a new post's.
+    Posts deleted since are dropped from the results by the caller's LivePost lookup.
+    """
+
+    def __init__(self, database=defaultDatabase, refreshSeconds: float = IMAGE_INDEX_REFRESH_SECONDS):
+        self.database = database
+        self.refreshSeconds = refreshSeconds
+        self.hashes = MultiIndexHashes()
+        # ChangeLog seq the index is up to date with, None until the first load
+        self.lastSeq = None
+        self.refreshedAt = None
+        self.refreshLock = None
+        self.executor = None
+
+
+    async def hash(self, imageBytes: bytes):
+        """The upload's imageHash, computed in a worker process."""
+
+        if not PILLOW_AVAILABLE:
+            return None
+        if self.executor is None:
+            self.executor = ProcessPoolExecutor(max_workers=IMAGE_HASH_WORKERS)
+        return await asyncio.get_running_loop().run_in_executor(self.executor, imageHash, imageBytes)
+
+
+    async def refresh(self):
+        if self.refreshLock is None:
+            self.refreshLock = asyncio.Lock()
+
+        async with self.refreshLock:
+            def fetchNewHashes(cursor):
+                if self.lastSeq is None:
+                    # Read before the hashes, so one stored in between is caught up next time rather than missed
+                    cursor.execute("SELECT COALESCE(MAX(seq), 0) FROM ChangeLog")
+                    lastSeq = cursor.fetchone()[0]
+                    cursor.execute("""
+                        SELECT postId, hash
+                        FROM PostImageHash
+                    """)
+                    return lastSeq, cursor.fetchall()
+
+                cursor.execute("""
+                    SELECT c.seq, h.postId, h.hash
+                    FROM ChangeLog c
+                    LEFT JOIN PostImageHash h ON h.postId = c.entityId
+                    WHERE c.entity = 'post' AND c.seq > ?
+                    ORDER BY c.seq
+                """, (self.lastSeq,))
+                changes = cursor.fetchall()
+
+                lastSeq = changes[-1][0] if changes else self.lastSeq
+                return lastSeq, [(postId, storedHash) for _, postId, storedHash in changes if postId is not None]
+
+            lastSeq, newHashes = await self.database.read(fetchNewHashes)
+            for postId, storedHash in newHashes:
+                self.hashes.add(postId, fromStoredHash(storedHash))
+            self.lastSeq = lastSeq
+            self.refreshedAt = time.monotonic()
+
+
+    def add(self, postId: int, hashValue: int):
+        # lastSeq is left to refresh, which would otherwise skip other workers' posts logged before this one
+        self.hashes.add(postId, hashValue)
+
+
+    async def similar(self, hashValue: int) -> list:
+        """(postId, distance) pairs of indexed posts near hashValue, closest first."""
+
+        if self.refreshedAt is None or time.monotonic() - self.refreshedAt > self.refreshSeconds:
+            await self.refresh()
+        return self.hashes.search(hashValue)
+
+
+    def recordHash(self, cursor, postId: int, hashValue: int):
+        """Store a post's image hash inside a write operation that also logs a change to the post."""
+
+        cursor.execute("""
+            INSERT INTO PostImageHash (postId, hash)
+            VALUES (?, ?)
+        """, (postId, toStoredHash(hashValue)))
+
+
+    def close(self):
+        if self.executor is not None:
+            self.executor.shutdown(cancel_futures=True)
+            self.executor = None
+
+
+
+imageIndex = ImageIndex()
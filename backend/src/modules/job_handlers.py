@@ -0,0 +1,356 @@
+import asyncio
+import os
+
+from src.modules.database import database
+from src.modules.change_log import recordChange
+from src.modules.job_queue import jobHandler
+from src.modules.like_counters import likeCounters
+from src.modules.queries import hasArchive
+from src.routes.post import postImageFolder
+
+
+# Rows touched per write, so a job never holds the write lock for long
+JOB_CHUNK_SIZE = 200
+
+
+def _chunks(ids: list):
+    for start in range(0, len(ids), JOB_CHUNK_SIZE):
+        yield ids[start:start + JOB_CHUNK_SIZE]
+
+
+@jobHandler('removeImages')
+async def removeImages(payload: dict):
+    def removeFiles():
+        for imageName in payload['imageNames']:
+            # Names come from Post.imageName, never from a path supplied by a client
+            imagePath = os.path.join(postImageFolder, os.path.basename(imageName))
+            if os.path.exists(imagePath):
+                os.remove(imagePath)
+
+    await asyncio.to_thread(removeFiles)
+
+
+@jobHandler('recountStats')
+async def recountStats(payload: dict):
+    """Recompute Post.likes, Post.captionCount, Caption.likes and Caption.commentCount from the rows they summarise."""
+
+    # Counts are recomputed from committed likes, so buffered deltas must be in first
+    await likeCounters.flush()
+
+    for postIds in _chunks(payload.get('postIds', [])):
+        def recountPosts(cursor):
+            placeholders = ', '.join('?' for _ in postIds)
+            cursor.execute(f"""
+                UPDATE Post
+                SET likes = (SELECT COUNT(*) FROM UserLikedPosts WHERE postId = Post.id),
+                    captionCount = (SELECT COUNT(*) FROM Caption WHERE postId = Post.id)
+                WHERE id IN ({placeholders})
+            """, postIds)
+
+            recordChange(cursor, 'post', postIds)
+
+        await database.write(recountPosts)
+
+    for captionIds in _chunks(payload.get('captionIds', [])):
+        def recountCaptions(cursor):
+            placeholders = ', '.join('?' for _ in captionIds)
+            cursor.execute(f"""
+                UPDATE Caption
+                SET likes = (SELECT COUNT(*) FROM UserLikedCaptions WHERE captionId = Caption.id),
+                    commentCount = (SELECT COUNT(*) FROM CaptionComments WHERE captionId = Caption.id)
+                WHERE id IN ({placeholders})
+            """, captionIds)
+
+            # Caption likes decide which caption a post shows on top
+            cursor.execute(f"""
+                UPDATE Post
+                SET topCaptionId = (
+                    SELECT id
+                    FROM LiveCaption
+                    WHERE postId = Post.id
+                    ORDER BY likes DESC, created_at ASC
+                    LIMIT 1
+                )
+                WHERE id IN (SELECT postId FROM Caption WHERE id IN ({placeholders}))
+                RETURNING id
+            """, captionIds)
+
+            recordChange(cursor, 'post', [row[0] for row in cursor.fetchall()])
+            recordChange(cursor, 'caption', captionIds)
+
+        await database.write(recountCaptions)
+
+
+@jobHandler('refreshTopCaptions')
+async def refreshTopCaptions(payload: dict):
+    for postIds in _chunks(payload['postIds']):
+        def refreshPosts(cursor):
+            placeholders = ', '.join('?' for _ in postIds)
+            cursor.execute(f"""
+                UPDATE Post
+                SET topCaptionId = (
+                    SELECT id
+                    FROM LiveCaption
+                    WHERE postId = Post.id
+                    ORDER BY likes DESC, created_at ASC
+                    LIMIT 1
+                )
+                WHERE id IN ({placeholders})
+            """, postIds)
+
+            recordChange(cursor, 'post', postIds)
+
+        await database.write(refreshPosts)
+
+
+async def _deleteInChunks(table: str, keyColumns: list, condition: str, parameters: tuple) -> int:
+    """Delete the rows of table matching condition JOB_CHUNK_SIZE at a time, each chunk in its own write."""
+
+    keys = ', '.join(keyColumns)
+    key = f"({keys})" if len(keyColumns) > 1 else keys
+
+    def deleteChunk(cursor):
+        cursor.execute(f"""
+            DELETE FROM {table}
+            WHERE {key} IN (
+                SELECT {keys}
+                FROM {table}
+                WHERE {condition}
+                LIMIT ?
+            )
+        """, (*parameters, JOB_CHUNK_SIZE))
+        return cursor.rowcount
+
+    deleted = 0
+    while True:
+        deletedInChunk = await database.write(deleteChunk)
+        deleted += deletedInChunk
+        if deletedInChunk < JOB_CHUNK_SIZE:
+            return deleted
+
+
+async def _purgeCaptions(condition: str, parameters: tuple):
+    # Children first, so deleting the captions themselves has nothing left to cascade to
+    captionIds = f"captionId IN (SELECT id FROM Caption WHERE {condition})"
+    await _deleteInChunks('UserLikedCaptions', ['userId', 'captionId'], captionIds, parameters)
+    await _deleteInChunks('CaptionComments', ['id'], captionIds, parameters)
+    await _deleteInChunks('Caption', ['id'], condition, parameters)
+
+
+async def _purgePost(postId: int):
+    await _purgeCaptions("postId = ?", (postId,))
+    await _deleteInChunks('UserLikedPosts', ['userId', 'postId'], "postId = ?", (postId,))
+
+    def deletePostRow(cursor):
+        cursor.execute("""
+            DELETE FROM Post
+            WHERE id = ?
+            RETURNING imageName
+        """, (postId,))
+        return [row[0] for row in cursor.fetchall()]
+
+    await removeImages({'imageNames': await database.write(deletePostRow)})
+
+
+async def _purgeArchivedPosts(condition: str, parameters: tuple):
+    """Remove the archived posts matching condition on archive.Post, with everything archived along with them."""
+
+    # The archive has no foreign keys to cascade, so every table is cleared explicitly
+    captionIds = f"captionId IN (SELECT id FROM archive.Caption WHERE postId IN (SELECT id FROM archive.Post WHERE {condition}))"
+    postIds = f"postId IN (SELECT id FROM archive.Post WHERE {condition})"
+    await _deleteInChunks('archive.UserLikedCaptions', ['userId', 'captionId'], captionIds, parameters)
+    await _deleteInChunks('archive.CaptionComments', ['id'], captionIds, parameters)
+    await _deleteInChunks('archive.Caption', ['id'], postIds, parameters)
+    await _deleteInChunks('archive.UserLikedPosts', ['userId', 'postId'], postIds, parameters)
+    await _deleteInChunks('archive.PostImageHash', ['postId'], postIds, parameters)
+
+    def deletePostRows(cursor):
+        cursor.execute(f"""
+            DELETE FROM archive.Post
+            WHERE id IN (
+                SELECT id
+                FROM archive.Post
+                WHERE {condition}
+                LIMIT ?
+            )
+            RETURNING imageName
+        """, (*parameters, JOB_CHUNK_SIZE))
+        return [row[0] for row in cursor.fetchall()]
+
+    while True:
+        imageNames = await database.write(deletePostRows)
+        if imageNames:
+            await removeImages({'imageNames': imageNames})
+        if len(imageNames) < JOB_CHUNK_SIZE:
+            return
+
+
+async def _purgeArchivedUser(userId: int):
+    """Remove a purged user's archived posts, and their captions, likes and comments on other archived posts."""
+
+    def fetchArchivedAffected(cursor):
+        cursor.execute("""
+            SELECT postId FROM archive.UserLikedPosts WHERE userId = ?
+            UNION
+            SELECT postId FROM archive.Caption WHERE userId = ?
+        """, (userId, userId))
+        postIds = [row[0] for row in cursor.fetchall()]
+
+        cursor.execute("""
+            SELECT captionId FROM archive.UserLikedCaptions WHERE userId = ?
+            UNION
+            SELECT captionId FROM archive.CaptionComments WHERE userId = ?
+        """, (userId, userId))
+        captionIds = [row[0] for row in cursor.fetchall()]
+
+        return postIds, captionIds
+
+    postIds, captionIds = await database.read(fetchArchivedAffected)
+
+    await _purgeArchivedPosts("userId = ?", (userId,))
+
+    captionIdsOfUser = "captionId IN (SELECT id FROM archive.Caption WHERE userId = ?)"
+    await _deleteInChunks('archive.UserLikedCaptions', ['userId', 'captionId'], captionIdsOfUser, (userId,))
+    await _deleteInChunks('archive.CaptionComments', ['id'], captionIdsOfUser, (userId,))
+    await _deleteInChunks('archive.Caption', ['id'], "userId = ?", (userId,))
+    await _deleteInChunks('archive.UserLikedPosts', ['userId', 'postId'], "userId = ?", (userId,))
+    await _deleteInChunks('archive.UserLikedCaptions', ['userId', 'captionId'], "userId = ?", (userId,))
+    await _deleteInChunks('archive.CaptionComments', ['id'], "userId = ?", (userId,))
+
+    # Archived rows never change otherwise, so their counters are recounted here rather than by recountStats
+    for captionIdsChunk in _chunks(captionIds):
+        def recountArchivedCaptions(cursor):
+            placeholders = ', '.join('?' for _ in captionIdsChunk)
+            cursor.execute(f"""
+                UPDATE archive.Caption
+                SET likes = (SELECT COUNT(*) FROM archive.UserLikedCaptions l WHERE l.captionId = archive.Caption.id),
+                    commentCount = (SELECT COUNT(*) FROM archive.CaptionComments m WHERE m.captionId = archive.Caption.id)
+                WHERE id IN ({placeholders})
+                RETURNING id
+            """, captionIdsChunk)
+
+            recordChange(cursor, 'caption', [row[0] for row in cursor.fetchall()])
+
+        await database.write(recountArchivedCaptions)
+
+    for postIdsChunk in _chunks(postIds):
+        def recountArchivedPosts(cursor):
+            placeholders = ', '.join('?' for _ in postIdsChunk)
+            cursor.execute(f"""
+                UPDATE archive.Post
+                SET likes = (SELECT COUNT(*) FROM archive.UserLikedPosts l WHERE l.postId = archive.Post.id),
+                    captionCount = (SELECT COUNT(*) FROM archive.Caption c WHERE c.postId = archive.Post.id),
+                    topCaptionId = (
+                        SELECT c.id
+                        FROM archive.Caption c
+                        WHERE c.postId = archive.Post.id
+                        ORDER BY c.likes DESC, c.created_at ASC
+                        LIMIT 1
+                    )
+                WHERE id IN ({placeholders})
+                RETURNING id
+            """, postIdsChunk)
+
+            recordChange(cursor, 'post', [row[0] for row in cursor.fetchall()])
+
+        await database.write(recountArchivedPosts)
+
+
+@jobHandler('purgePost')
+async def purgePost(payload: dict):
+    """Remove a soft deleted post with everything hanging off it, from the archive if it was archived."""
+
+    postId = payload['postId']
+
+    def fetchDeletedIn(cursor):
+        deletedIn = []
+        if cursor.execute("SELECT 1 FROM Post WHERE id = ? AND deleted_at IS NOT NULL", (postId,)).fetchone():
+            deletedIn.append('hot')
+        if hasArchive(cursor) and cursor.execute("SELECT 1 FROM archive.Post WHERE id = ? AND deleted_at IS NOT NULL", (postId,)).fetchone():
+            deletedIn.append('archive')
+        return deletedIn
+
+    deletedIn = await database.read(fetchDeletedIn)
+
+    if 'hot' in deletedIn:
+        await _purgePost(postId)
+    if 'archive' in deletedIn:
+        await _purgeArchivedPosts("id = ?", (postId,))
+
+
+@jobHandler('purgeUser')
+async def purgeUser(payload: dict):
+    """Remove a soft deleted user: their posts, captions, likes and comments, archived ones included, then the user."""
+
+    userId = payload['userId']
+
+    def fetchAffected(cursor):
+        cursor.execute("""
+            SELECT 1
+            FROM User
+            WHERE id = ? AND deleted_at IS NOT NULL
+        """, (userId,))
+        if cursor.fetchone() is None:
+            return None
+
+        # Other users' posts and captions whose counters and rankings include this user
+        cursor.execute("""
+            SELECT postId FROM UserLikedPosts WHERE userId = ?
+            UNION
+            SELECT postId FROM Caption WHERE userId = ?
+        """, (userId, userId))
+        postIds = [row[0] for row in cursor.fetchall()]
+
+        cursor.execute("""
+            SELECT captionId FROM UserLikedCaptions WHERE userId = ?
+            UNION
+            SELECT captionId FROM CaptionComments WHERE userId = ?
+        """, (userId, userId))
+        captionIds = [row[0] for row in cursor.fetchall()]
+
+        return postIds, captionIds
+
+    affected = await database.read(fetchAffected)
+    if affected is None:
+        return
+    postIds, captionIds = affected
+
+    # The user's captions are hidden already, so take them off the top of other posts straight away
+    await refreshTopCaptions({'postIds': postIds})
+
+    def nextPostIds(cursor):
+        cursor.execute("""
+            SELECT id
+            FROM Post
+            WHERE userId = ?
+            ORDER BY id
+            LIMIT ?
+        """, (userId, JOB_CHUNK_SIZE))
+        return [row[0] for row in cursor.fetchall()]
+
+    while True:
+        userPostIds = await database.read(nextPostIds)
+        if not userPostIds:
+            break
+        for postId in userPostIds:
+            await _purgePost(postId)
+
+    await _purgeCaptions("userId = ?", (userId,))
+    await _deleteInChunks('UserLikedPosts', ['userId', 'postId'], "userId = ?", (userId,))
+    await _deleteInChunks('UserLikedCaptions', ['userId', 'captionId'], "userId = ?", (userId,))
+    await _deleteInChunks('CaptionComments', ['id'], "userId = ?", (userId,))
+    await _deleteInChunks('IdempotencyKey', ['userId', 'key'], "userId = ?", (userId,))
+
+    if await database.read(hasArchive):
+        await _purgeArchivedUser(userId)
+
+    def deleteUserRow(cursor):
+        cursor.execute("""
+            DELETE FROM User
+            WHERE id = ?
+        """, (userId,))
+
+    await database.write(deleteUserRow)
+
+    # Their likes and captions are gone now, so bring the counters of what remains in line
+    await recountStats({'postIds': postIds, 'captionIds': captionIds})
@@ -0,0 +1,223 @@
+import asyncio
+import json
+import logging
+import os
+import traceback
+from datetime import timedelta
+
+from src.modules.database import database as defaultDatabase, timestampIn
+
+
+logger = logging.getLogger(__name__)
+
+
+# Background workers started in every API process
+JOB_WORKERS = int(os.environ.get('CAPRANK_JOB_WORKERS', '1'))
+
+# How often idle workers look for due jobs queued by other processes
+JOB_POLL_INTERVAL_SECONDS = float(os.environ.get('CAPRANK_JOB_POLL_INTERVAL', '1'))
+
+# A running job not finished within this long is assumed lost with its process and run again
+JOB_LEASE_SECONDS = 300
+
+# Retry delay doubles with every failed attempt, starting here
+JOB_RETRY_BASE_SECONDS = 5
+
+DEFAULT_MAX_ATTEMPTS = 5
+
+# How long shutdown waits for running jobs before leaving them to their lease
+JOB_STOP_TIMEOUT_SECONDS = 10
+
+# Higher runs first
+PRIORITY_LOW = 0
+PRIORITY_NORMAL = 5
+PRIORITY_HIGH = 10
+
+# kind -> async function taking the decoded payload
+jobHandlers = {}
+
+
+def jobHandler(kind: str):
+    def register(handler):
+        jobHandlers[kind] = handler
+        return handler
+    return register
+
+
+def enqueue(cursor, kind: str, payload: dict, priority: int = PRIORITY_NORMAL, maxAttempts: int = DEFAULT_MAX_ATTEMPTS, delay: timedelta = timedelta()) -> int:
+    """
+    Queue a job from inside a write operation, so it is stored if and only if that write commits.
+    Call jobQueue.wake() once the write returned to have a local worker pick it up straight away.
+    """
+
+    cursor.execute("""
+        INSERT INTO Job (kind, payload, priority, maxAttempts, runAfter)
+        VALUES (?, ?, ?, ?, ?)
+        RETURNING id
+    """, (kind, json.dumps(payload), priority, maxAttempts, timestampIn(delay)))
+
+    return cursor.fetchone()[0]
+
+
+
+class JobQueue:
+    """
+    Durable queue of deferred work kept in the Job table.
+
+    Workers claim the highest priority due job by leasing it: the claim moves runAfter
+    to the end of the lease, so a job whose process died becomes due again on its own.
+    Failed jobs are retried with exponential backoff until maxAttempts, then parked as
+    'failed' for the jobs CLI.
+    """
+
+    def __init__(self, database=defaultDatabase, retryBaseSeconds: float = JOB_RETRY_BASE_SECONDS):
+        self.database = database
+        self.retryBaseSeconds = retryBaseSeconds
+        self.workerTasks = []
+        self.wakeEvent = None
+        self.stopping = False
+
+
+    def _nextDueJob(self, cursor):
+        cursor.execute("""
+            SELECT id
+            FROM Job
+            WHERE status IN ('queued', 'running') AND runAfter <= ?
+            LIMIT 1
+        """, (timestampIn(timedelta()),))
+
+        return cursor.fetchone()
+
+
+    def _claimJob(self, cursor):
+        now = timestampIn(timedelta())
+
+        # The outer conditions make a concurrent claim of the same row find nothing
+        cursor.execute("""
+            UPDATE Job
+            SET status = 'running', attempts = attempts + 1, runAfter = ?
+            WHERE id = (
+                SELECT id
+                FROM Job
+                WHERE status IN ('queued', 'running') AND runAfter <= ?
+                ORDER BY priority DESC, runAfter, id
+                LIMIT 1
+            )
+                AND status IN ('queued', 'running') AND runAfter <= ?
+            RETURNING id, kind, payload, attempts, maxAttempts
+        """, (timestampIn(timedelta(seconds=JOB_LEASE_SECONDS)), now, now))
+
+        return cursor.fetchone()
+
+
+    async def runNext(self) -> bool:
+        """Claim and run one due job, returning False when there was nothing to do."""
+
+        if await self.database.read(self._nextDueJob) is None:
+            return False
+
+        job = await self.database.write(self._claimJob)
+        if job is None:
+            # Another worker got there first
+            return True
+
+        jobId, kind, payload, attempts, maxAttempts = job
+
+        try:
+            handler = jobHandlers.get(kind)
+            if handler is None:
+                raise LookupError(f"No handler for job kind: {kind}")
+            await handler(json.loads(payload))
+
+        except Exception as e:
+            error = ''.join(traceback.format_exception_only(type(e), e)).strip()
+            retryAt = timestampIn(timedelta(seconds=self.retryBaseSeconds * 2 ** (attempts - 1)))
+
+            def recordFailure(cursor):
+                cursor.execute("""
+                    UPDATE Job
+                    SET status = CASE WHEN attempts >= maxAttempts THEN 'failed' ELSE 'queued' END,
+                        runAfter = ?,
+                        lastError = ?
+                    WHERE id = ?
+                """, (retryAt, error, jobId))
+
+            await self.database.write(recordFailure)
+            logger.warning("Job %s (%s) failed on attempt %s/%s", jobId, kind, attempts, maxAttempts, exc_info=e)
+            return True
+
+        def recordSuccess(cursor):
+            cursor.execute("""
+                UPDATE Job
+                SET status = 'done', lastError = NULL
+                WHERE id = ?
+            """, (jobId,))
+
+        await self.database.write(recordSuccess)
+        return True
+
+
+    async def drain(self) -> int:
+        """Run due jobs until none are left, returning how many were attempted."""
+
+        attempted = 0
+        while await self.runNext():
+            attempted += 1
+        return attempted
+
+
+    def wake(self):
+        if self.wakeEvent is not None:
+            self.wakeEvent.set()
+
+
+    async def _work(self):
+        while not self.stopping:
+            try:
+                if await self.runNext():
+                    continue
+            except Exception:
+                # Usually a busy database; the job itself stays leased and will be retried
+                logger.exception("Job worker error")
+
+            self.wakeEvent.clear()
+            try:
+                await asyncio.wait_for(self.wakeEvent.wait(), JOB_POLL_INTERVAL_SECONDS)
+            except asyncio.TimeoutError:
+                pass
+
+
+    def start(self, workers: int = JOB_WORKERS):
+        self.stopping = False
+        self.wakeEvent = asyncio.Event()
+        self.workerTasks = [asyncio.create_task(self._work()) for _ in range(workers)]
+
+
+    async def stop(self):
+        """Let running jobs finish, then stop the workers."""
+
+        self.stopping = True
+        self.wake()
+
+        if self.workerTasks:
+            _, unfinished = await asyncio.wait(self.workerTasks, timeout=JOB_STOP_TIMEOUT_SECONDS)
+            for task in unfinished:
+                task.cancel()
+        self.workerTasks = []
+
+
+    async def stats(self) -> list:
+        def countJobs(cursor):
+            cursor.execute("""
+                SELECT kind, status, COUNT(*), MIN(created_at)
+                FROM Job
+                GROUP BY kind, status
+                ORDER BY kind, status
+            """)
+            return cursor.fetchall()
+
+        return await self.database.read(countJobs)
+
+
+
+jobQueue = JobQueue()
@@ -0,0 +1,106 @@
+import asyncio
+import logging
+import os
+
+from src.modules.database import database as defaultDatabase
+from src.modules.change_log import recordChange
+
+
+logger = logging.getLogger(__name__)
+
+
+# 'direct' updates Post.likes / Caption.likes inside every like request,
+# 'buffered' accumulates deltas in memory and folds them in periodically
+LIKE_COUNTER_MODE = os.environ.get('CAPRANK_LIKE_COUNTER_MODE', 'direct')
+LIKE_FLUSH_INTERVAL_SECONDS = float(os.environ.get('CAPRANK_LIKE_FLUSH_INTERVAL', '2'))
+
+# Table and position of the likes column in SELECT * rows for each kind of target
+LIKE_COUNTER_TABLES = {
+    'post': ('Post', 4),
+    'caption': ('Caption', 5),
+}
+
+
+class LikeCounters:
+    """
+    Like counters for posts and captions.
+    In buffered mode a burst of likes on one target becomes a single UPDATE per flush
+    instead of one write of the same hot row per like.
+    """
+
+    def __init__(self, mode: str = LIKE_COUNTER_MODE, database=defaultDatabase):
+        self.mode = mode
+        self.database = database
+        self.pending = {kind: {} for kind in LIKE_COUNTER_TABLES}
+
+
+    @property
+    def buffered(self) -> bool:
+        return self.mode == 'buffered'
+
+
+    def increment(self, cursor, kind: str, targetId: int, delta: int):
+        """
+        Apply a like delta, either straight to the row through cursor or to the in-memory buffer.
+        Buffered increments must come from the event loop thread, after the like itself committed.
+        """
+
+        if not self.buffered:
+            table = LIKE_COUNTER_TABLES[kind][0]
+            cursor.execute(f"""
+                UPDATE {table}
+                SET likes = likes + ?
+                WHERE id = ?
+            """, (delta, targetId))
+            return
+
+        targetId = int(targetId)
+        pendingForKind = self.pending[kind]
+        pendingForKind[targetId] = pendingForKind.get(targetId, 0) + delta
+
+
+    async def flush(self) -> int:
+        """Fold buffered deltas into Post.likes / Caption.likes in one write, returning rows touched."""
+
+        if not any(self.pending.values()):
+            return 0
+
+        flushing = self.pending
+        self.pending = {kind: {} for kind in LIKE_COUNTER_TABLES}
+
+        def applyDeltas(cursor):
+            updatedRows = 0
+            for kind, deltas in flushing.items():
+                table = LIKE_COUNTER_TABLES[kind][0]
+                cursor.executemany(f"""
+                    UPDATE {table}
+                    SET likes = likes + ?
+                    WHERE id = ?
+                """, [(delta, targetId) for targetId, delta in deltas.items() if delta])
+                recordChange(cursor, kind, [targetId for targetId, delta in deltas.items() if delta])
+                updatedRows += len(deltas)
+            return updatedRows
+
+        try:
+            return await self.database.write(applyDeltas)
+
+        except Exception:
+            # Put the deltas back so the next flush retries them
+            for kind, deltas in flushing.items():
+                for targetId, delta in deltas.items():
+                    self.pending[kind][targetId] = self.pending[kind].get(targetId, 0) + delta
+            raise
+
+
+    async def runFlushLoop(self, interval: float = LIKE_FLUSH_INTERVAL_SECONDS):
+        while True:
+            await asyncio.sleep(interval)
+            try:
+                await self.flush()
+            except Exception:
+                # Whatever the backend raised, the deltas are back in pending and the next interval retries them
+                logger.exception("Like counter flush failed, retrying next interval")
+
+
+
+likeCounters = LikeCounters()
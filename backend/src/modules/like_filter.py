@@ -0,0 +1,173 @@
+import threading
+import time
+
+from src.modules.bloom_filter import BloomFilter
+
+
+# Table and column holding each user's likes for a given kind of target
+LIKE_TABLES = {
+    'post': ('UserLikedPosts', 'postId'),
+    'caption': ('UserLikedCaptions', 'captionId'),
+    # Likes of posts and captions moved to the archive database
+    'archivedPost': ('archive.UserLikedPosts', 'postId'),
+    'archivedCaption': ('archive.UserLikedCaptions', 'captionId'),
+}
+
+# Users with more likes than this are always answered straight from SQLite
+MAX_FILTERED_LIKES = 100_000
+
+# Oldest filters are evicted once this many are cached
+MAX_CACHED_FILTERS = 10_000
+
+# Filters are rebuilt after this long, which also bounds how long a change is remembered for
+FILTER_TTL_SECONDS = 60
+
+FALSE_POSITIVE_RATE = 0.01
+
+# Ids per IN (...) lookup, well under SQLite's bound parameter limit
+LOOKUP_CHUNK_SIZE = 500
+
+# Fewest ids a filter is sized for, so users with a handful of likes still get a useful filter
+MIN_FILTER_CAPACITY = 64
+
+
+def _idKey(targetId) -> bytes:
+    return int(targetId).to_bytes(8, 'little', signed=True)
+
+
+
+class ViewerLikeFilters:
+    """
+    Lazily built per-user, per-kind Bloom filters used to skip like lookups for
+    pages where the viewer cannot have liked anything.
+
+    A filter only holds the likes committed when it was built, plus those this process makes.
+    Likes made through other processes are caught up from the ChangeLog, which records the
+    liked post or caption but not who liked it: ids changed after a filter was built are
+    always looked up rather than trusted to the filter. With buffered like counters the
+    change is logged when the counters are flushed, so another process's like can take
+    until that flush to show.
+    """
+
+    def __init__(self):
+        # (kind, userId) -> (BloomFilter or None when the user has too many likes, builtAt)
+        self.filters = {}
+        # kind -> {targetId: when this process saw it change}, oldest first, kept for FILTER_TTL_SECONDS
+        self.recentChanges = {'post': {}, 'caption': {}}
+        self.lastSeq = None
+        self.catchUpLock = threading.Lock()
+
+
+    def _catchUp(self, cursor):
+        with self.catchUpLock:
+            if self.lastSeq is None:
+                # Every filter is built after this, so earlier changes are in them already
+                cursor.execute("SELECT COALESCE(MAX(seq), 0) FROM ChangeLog")
+                self.lastSeq = cursor.fetchone()[0]
+                return
+
+            cursor.execute("""
+                SELECT seq, entity, entityId
+                FROM ChangeLog
+                WHERE seq > ?
+                ORDER BY seq
+            """, (self.lastSeq,))
+
+            changes = cursor.fetchall()
+            seenAt = time.monotonic()
+            for _, entity, entityId in changes:
+                changedIds = self.recentChanges.get(entity)
+                if changedIds is not None:
+                    changedIds.pop(entityId, None)
+                    changedIds[entityId] = seenAt
+            if changes:
+                self.lastSeq = changes[-1][0]
+
+            # Filters built before a change are rebuilt within FILTER_TTL_SECONDS of it
+            for changedIds in self.recentChanges.values():
+                while changedIds and next(iter(changedIds.values())) < seenAt - FILTER_TTL_SECONDS:
+                    del changedIds[next(iter(changedIds))]
+
+
+    def _filterFor(self, cursor, kind: str, userId: int):
+        cached = self.filters.get((kind, userId))
+        if cached is not None and time.monotonic() - cached[1] < FILTER_TTL_SECONDS:
+            return cached
+
+        table, column = LIKE_TABLES[kind]
+        cursor.execute(f"""
+            SELECT {column}
+            FROM {table}
+            WHERE userId = ?
+            LIMIT ?
+        """, (userId, MAX_FILTERED_LIKES + 1))
+
+        likedIds = [row[0] for row in cursor.fetchall()]
+
+        likeFilter = None
+        if len(likedIds) <= MAX_FILTERED_LIKES:
+            likeFilter = BloomFilter(max(len(likedIds) * 2, MIN_FILTER_CAPACITY), FALSE_POSITIVE_RATE)
+            for likedId in likedIds:
+                likeFilter.add(_idKey(likedId))
+
+        self.filters.pop((kind, userId), None)
+        if len(self.filters) >= MAX_CACHED_FILTERS:
+            del self.filters[next(iter(self.filters))]
+
+        self.filters[(kind, userId)] = (likeFilter, time.monotonic())
+        return self.filters[(kind, userId)]
+
+
+    def recordLike(self, kind: str, userId: int, targetId: int):
+        cached = self.filters.get((kind, userId))
+        if cached is not None and cached[0] is not None:
+            cached[0].add(_idKey(targetId))
+
+
+    def likedByViewer(self, cursor, kind: str, viewerId: int, targetIds) -> set:
+        """Return the subset of targetIds the viewer has liked with one set-based lookup per page."""
+
+        targetIds = list(dict.fromkeys(targetIds))
+        if not targetIds:
+            return set()
+
+        self._catchUp(cursor)
+        likeFilter, builtAt = self._filterFor(cursor, kind, viewerId)
+        if likeFilter is not None:
+            changedIds = self.recentChanges.get(kind, {})
+            targetIds = [
+                targetId for targetId in targetIds
+                if _idKey(targetId) in likeFilter or changedIds.get(targetId, 0) >= builtAt
+            ]
+            if not targetIds:
+                return set()
+
+        table, column = LIKE_TABLES[kind]
+        likedIds = set()
+
+        for start in range(0, len(targetIds), LOOKUP_CHUNK_SIZE):
+            chunk = targetIds[start:start + LOOKUP_CHUNK_SIZE]
+            placeholders = ', '.join('?' for _ in chunk)
+            cursor.execute(f"""
+                SELECT {column}
+                FROM {table}
+                WHERE userId = ? AND {column} IN ({placeholders})
+            """, (viewerId, *chunk))
+
+            likedIds.update(row[0] for row in cursor.fetchall())
+
+        return likedIds
+
+
+    def withLikedFlag(self, cursor, kind: str, viewerId, rows, idIndex: int = 0) -> list:
+        """Append a likedByViewer flag to every row, or return the rows unchanged without a viewer."""
+
+        if viewerId is None:
+            return rows
+
+        likedIds = self.likedByViewer(cursor, kind, viewerId, [row[idIndex] for row in rows])
+        return [(*row, row[idIndex] in likedIds) for row in rows]
+
+
+
+viewerLikeFilters = ViewerLikeFilters()
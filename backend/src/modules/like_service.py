@@ -0,0 +1,164 @@
+import sqlite3
+
+from litestar import status_codes
+from litestar.exceptions import HTTPException
+
+from src.modules.database import database, isDatabaseLocked
+from src.modules.like_counters import likeCounters
+from src.modules.like_filter import LIKE_TABLES, viewerLikeFilters
+from src.modules.trending import trendingPosts
+from src.modules.change_log import recordChange
+from src.modules.idempotency import storedResponse, storeResponse
+
+
+# Table each kind of like points at
+LIKE_TARGET_TABLES = {
+    'post': 'LivePost',
+    'caption': 'LiveCaption',
+}
+
+# (kind, liked) -> the operation an idempotency key is recorded against, named as batch operations are
+LIKE_OPERATIONS = {
+    ('post', True): 'likePost',
+    ('post', False): 'unlikePost',
+    ('post', None): 'togglePostLike',
+    ('caption', True): 'likeCaption',
+    ('caption', False): 'unlikeCaption',
+    ('caption', None): 'toggleCaptionLike',
+}
+
+
+def applyLike(cursor, kind: str, userId: int, password: str, targetId: int, liked=None, idempotencyKey=None, refreshTopCaption=False):
+    """
+    Like (liked=True), unlike (liked=False) or toggle (liked=None) a post or caption inside a
+    write operation, returning (result, isReplay). Call likeCommitted once the write returned.
+
+    Credentials and target existence are folded into the INSERT/DELETE themselves, so the
+    common path is one INSERT or DELETE ... RETURNING plus the counter update, run as a
+    single operation on the writer. Because the writer holds the write lock for the whole
+    operation, two concurrent toggles can no longer both see "not liked" and double count.
+    """
+
+    likeTable, likeColumn = LIKE_TABLES[kind]
+    targetTable = LIKE_TARGET_TABLES[kind]
+
+    operation = LIKE_OPERATIONS[(kind, liked)]
+
+    if idempotencyKey:
+        # A stored response is only handed back to the user who made it
+        cursor.execute("""
+            SELECT 1
+            FROM LiveUser
+            WHERE id = ? AND password = ?
+        """, (userId, password))
+
+        if not cursor.fetchone():
+            raise HTTPException(status_code=status_codes.HTTP_401_UNAUTHORIZED, detail="Invalid credentials")
+
+        replayed = storedResponse(cursor, userId, idempotencyKey, operation, targetId)
+        if replayed is not None:
+            return replayed, True
+
+    result = None
+
+    if liked is not False:
+        cursor.execute(f"""
+            INSERT INTO {likeTable} (userId, {likeColumn})
+            SELECT ?, ?
+            WHERE EXISTS (SELECT 1 FROM LiveUser WHERE id = ? AND password = ?)
+                AND EXISTS (SELECT 1 FROM {targetTable} WHERE id = ?)
+            ON CONFLICT DO NOTHING
+            RETURNING {likeColumn}
+        """, (userId, targetId, userId, password, targetId))
+
+        if cursor.fetchall():
+            result = {'liked': True, 'changed': True}
+
+    if result is None and liked is not True:
+        cursor.execute(f"""
+            DELETE FROM {likeTable}
+            WHERE userId = ? AND {likeColumn} = ?
+                AND EXISTS (SELECT 1 FROM LiveUser WHERE id = ? AND password = ?)
+            RETURNING {likeColumn}
+        """, (userId, targetId, userId, password))
+
+        if cursor.fetchall():
+            result = {'liked': False, 'changed': True}
+
+    if result is None:
+        # Nothing changed: either the request is invalid or the like is already in the requested state
+        cursor.execute(f"""
+            SELECT
+                EXISTS (SELECT 1 FROM LiveUser WHERE id = ? AND password = ?),
+                EXISTS (SELECT 1 FROM {targetTable} WHERE id = ?)
+        """, (userId, password, targetId))
+
+        validUser, targetExists = cursor.fetchone()
+        if not validUser:
+            raise HTTPException(status_code=status_codes.HTTP_401_UNAUTHORIZED, detail="Invalid credentials")
+        if not targetExists:
+            raise HTTPException(status_code=status_codes.HTTP_404_NOT_FOUND, detail=f"No {kind} with id: {targetId}")
+
+        result = {'liked': liked, 'changed': False}
+
+    if result['changed']:
+        # Buffered counters live on the event loop thread and are updated once the write commits
+        if not likeCounters.buffered:
+            likeCounters.increment(cursor, kind, targetId, 1 if result['liked'] else -1)
+            # Buffered counts are logged when they are flushed
+            recordChange(cursor, kind, targetId)
+
+        if kind == 'post':
+            trendingPosts.recordLike(cursor, targetId, 1 if result['liked'] else -1)
+
+        if refreshTopCaption and kind == 'caption':
+            cursor.execute("""
+                UPDATE Post
+                SET topCaptionId = (
+                    SELECT id
+                    FROM LiveCaption
+                    WHERE postId = Post.id
+                    ORDER BY likes DESC, created_at ASC
+                    LIMIT 1
+                )
+                WHERE id = (SELECT postId FROM Caption WHERE id = ?)
+                RETURNING id
+            """, (targetId,))
+
+            recordChange(cursor, 'post', [row[0] for row in cursor.fetchall()])
+
+    if idempotencyKey:
+        storeResponse(cursor, userId, idempotencyKey, operation, targetId, result)
+
+    return result, False
+
+
+def likeCommitted(kind: str, userId: int, targetId: int, result: dict):
+    """Update this process's buffered counters, leaderboards and like filters after applyLike committed."""
+
+    if result['changed']:
+        if likeCounters.buffered:
+            likeCounters.increment(None, kind, targetId, 1 if result['liked'] else -1)
+        if kind == 'post':
+            trendingPosts.applyLike(targetId, 1 if result['liked'] else -1)
+        if result['liked']:
+            viewerLikeFilters.recordLike(kind, userId, targetId)
+
+
+async def setLike(kind: str, userId: int, password: str, targetId: int, liked=None, idempotencyKey=None, refreshTopCaption=False) -> dict:
+    """Like, unlike or toggle a post or caption as an operation of its own; see applyLike."""
+
+    try:
+        result, isReplay = await database.write(lambda cursor: applyLike(cursor, kind, userId, password, targetId, liked, idempotencyKey, refreshTopCaption))
+    except sqlite3.OperationalError as e:
+        if isDatabaseLocked(e):
+            raise HTTPException(
+                status_code=status_codes.HTTP_503_SERVICE_UNAVAILABLE,
+                detail="Database is temporarily busy, please try again"
+            )
+        raise
+
+    if not isReplay:
+        likeCommitted(kind, userId, targetId, result)
+
+    return result
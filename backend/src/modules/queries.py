@@ -0,0 +1,342 @@
+import re
+import sqlite3
+from functools import lru_cache
+from typing import Optional
+
+import msgspec
+
+from src.modules.like_counters import likeCounters
+from src.modules.like_filter import viewerLikeFilters
+
+
+# Rows are array_like structs: slotted, built straight from the cursor's tuples and
+# encoded as the same positional arrays the Android client has always parsed.
+# A ForViewer variant appends the likedByViewer flag, as withLikedFlag did.
+
+class PostRow(msgspec.Struct, array_like=True):
+    id: int
+    userId: int
+    imageName: str
+    created_at: str
+    likes: int
+    topCaptionId: Optional[int]
+    captionCount: int
+
+
+class PostRowForViewer(PostRow):
+    likedByViewer: bool
+
+
+class PostWithUsernameRow(PostRow):
+    username: str
+
+
+class PostWithUsernameRowForViewer(PostWithUsernameRow):
+    likedByViewer: bool
+
+
+class TrendingPostRow(PostWithUsernameRow):
+    windowLikes: int
+
+
+class CaptionRow(msgspec.Struct, array_like=True):
+    id: int
+    postId: int
+    userId: int
+    text: str
+    created_at: str
+    likes: int
+    commentCount: int
+
+
+class CaptionRowForViewer(CaptionRow):
+    likedByViewer: bool
+
+
+class CaptionWithUsernameRow(msgspec.Struct, array_like=True):
+    id: int
+    postId: int
+    userId: int
+    text: str
+    created_at: str
+    likes: int
+    username: str
+    commentCount: int
+
+
+class CaptionWithUsernameRowForViewer(CaptionWithUsernameRow):
+    likedByViewer: bool
+
+
+class UserRow(msgspec.Struct, array_like=True):
+    id: int
+    username: str
+    name: str
+    profilePicture: Optional[str]
+    created_at: str
+
+
+class UserSuggestionRow(msgspec.Struct, array_like=True):
+    id: int
+    username: str
+    name: str
+    profilePicture: Optional[str]
+    # Live posts plus live captions, which suggestions are ranked by
+    activity: int
+
+
+
+# What a query reads instead to find rows moved to the archive database by src.modules.archive
+ARCHIVED_SOURCES = {
+    'LivePost': 'ArchivedLivePost',
+    'LiveCaption': 'ArchivedLiveCaption',
+    'CaptionComments': 'archive.CaptionComments',
+}
+
+ARCHIVED_LIKE_KINDS = {
+    'post': 'archivedPost',
+    'caption': 'archivedCaption',
+}
+
+_ARCHIVED_SOURCE_PATTERN = re.compile(rf"\b({'|'.join(ARCHIVED_SOURCES)})\b")
+
+
+def archivedSql(sql: str) -> str:
+    return _ARCHIVED_SOURCE_PATTERN.sub(lambda match: ARCHIVED_SOURCES[match.group(1)], sql)
+
+
+def hasArchive(cursor) -> bool:
+    """Whether the archive database is attached to cursor's connection; it only ever is on SQLite."""
+
+    if not isinstance(cursor, sqlite3.Cursor):
+        return False
+    return cursor.execute("SELECT 1 FROM pragma_database_list WHERE name = 'archive'").fetchone() is not None
+
+
+
+class Query:
+    """
+    A statement declared once, with the struct its rows map to.
+
+    The SQL text is a module constant, so every execution hits the connection's prepared
+    statement cache (sqlite3's statement cache, psycopg's automatic prepare). For likeKind
+    queries, buffered like deltas and the viewer's liked flags are applied while mapping.
+    """
+
+    __slots__ = ('sql', 'rowType', 'viewerRowType', 'likeKind', '_archived')
+
+    def __init__(self, sql: str, rowType, viewerRowType=None, likeKind: str = None):
+        self.sql = sql
+        self.rowType = rowType
+        self.viewerRowType = viewerRowType
+        self.likeKind = likeKind
+        self._archived = None
+
+
+    def archived(self) -> 'Query':
+        """The same query over the posts and captions moved to the archive database."""
+
+        if self._archived is None:
+            self._archived = Query(archivedSql(self.sql), self.rowType, self.viewerRowType, ARCHIVED_LIKE_KINDS.get(self.likeKind))
+        return self._archived
+
+
+    def all(self, cursor, parameters=(), viewerId: int = None) -> list:
+        # Fetched before the liked lookup, which reuses the cursor
+        rows = cursor.execute(self.sql, parameters).fetchall()
+
+        if viewerId is None or self.viewerRowType is None:
+            rowType = self.rowType
+            mapped = [rowType(*row) for row in rows]
+        else:
+            likedIds = viewerLikeFilters.likedByViewer(cursor, self.likeKind, viewerId, [row[0] for row in rows])
+            rowType = self.viewerRowType
+            mapped = [rowType(*row, row[0] in likedIds) for row in rows]
+
+        pendingLikes = likeCounters.pending.get(self.likeKind) if self.likeKind else None
+        if pendingLikes:
+            for row in mapped:
+                delta = pendingLikes.get(row.id)
+                if delta:
+                    row.likes = (row.likes or 0) + delta
+
+        return mapped
+
+
+    def one(self, cursor, parameters=(), viewerId: int = None):
+        rows = self.all(cursor, parameters, viewerId)
+        return rows[0] if rows else None
+
+
+    def oneOrArchived(self, cursor, parameters=(), viewerId: int = None):
+        """one(), looked up in the archive only when the hot tables don't have the row."""
+
+        row = self.one(cursor, parameters, viewerId)
+        if row is None and hasArchive(cursor):
+            row = self.archived().one(cursor, parameters, viewerId)
+        return row
+
+
+    def allOrArchived(self, cursor, parameters=(), viewerId: int = None) -> list:
+        """all() of rows that live in one place, such as one post's captions, which are archived together."""
+
+        rows = self.all(cursor, parameters, viewerId)
+        if not rows and hasArchive(cursor):
+            rows = self.archived().all(cursor, parameters, viewerId)
+        return rows
+
+
+    def allWithArchived(self, cursor, parameters=(), viewerId: int = None) -> list:
+        """all(), followed by the matching archived rows, which are older than any hot one."""
+
+        rows = self.all(cursor, parameters, viewerId)
+        if hasArchive(cursor):
+            rows += self.archived().all(cursor, parameters, viewerId)
+        return rows
+
+
+
+POST_BY_ID = Query("""
+    SELECT id, userId, imageName, created_at, likes, topCaptionId, captionCount
+    FROM LivePost
+    WHERE id = ?
+""", PostRow, PostRowForViewer, 'post')
+
+POSTS_WITH_USERNAME = Query("""
+    SELECT p.id, p.userId, p.imageName, p.created_at, p.likes, p.topCaptionId, p.captionCount, u.username
+    FROM LivePost p
+    JOIN User u ON p.userId = u.id
+""", PostWithUsernameRow, PostWithUsernameRowForViewer, 'post')
+
+POSTS_WITH_USERNAME_BY_USER = Query("""
+    SELECT p.id, p.userId, p.imageName, p.created_at, p.likes, p.topCaptionId, p.captionCount, u.username
+    FROM LivePost p
+    JOIN User u ON p.userId = u.id
+    WHERE p.userId = ?
+""", PostWithUsernameRow, PostWithUsernameRowForViewer, 'post')
+
+CAPTION_BY_ID = Query("""
+    SELECT id, postId, userId, text, created_at, likes, commentCount
+    FROM LiveCaption
+    WHERE id = ?
+""", CaptionRow, CaptionRowForViewer, 'caption')
+
+CAPTIONS_BY_POST = Query("""
+    SELECT id, postId, userId, text, created_at, likes, commentCount
+    FROM LiveCaption
+    WHERE postId = ?
+    ORDER BY likes DESC, created_at ASC
+""", CaptionRow, CaptionRowForViewer, 'caption')
+
+CAPTIONS_WITH_USERNAME_BY_POST = Query("""
+    SELECT c.id, c.postId, c.userId, c.text, c.created_at, c.likes, u.username, c.commentCount
+    FROM LiveCaption c
+    JOIN User u ON c.userId = u.id
+    WHERE c.postId = ?
+    ORDER BY c.likes DESC, c.created_at ASC
+""", CaptionWithUsernameRow, CaptionWithUsernameRowForViewer, 'caption')
+
+ALL_CAPTIONS = Query("""
+    SELECT id, postId, userId, text, created_at, likes, commentCount
+    FROM LiveCaption
+    ORDER BY created_at DESC
+""", CaptionRow, CaptionRowForViewer, 'caption')
+
+USER_BY_ID = Query("""
+    SELECT id, username, name, profilePicture, created_at
+    FROM LiveUser
+    WHERE id = ?
+""", UserRow)
+
+ALL_USERS = Query("""
+    SELECT id, username, name, profilePicture, created_at
+    FROM LiveUser
+""", UserRow)
+
+ALL_USER_SUGGESTIONS = Query("""
+    SELECT u.id, u.username, u.name, u.profilePicture,
+        (SELECT COUNT(*) FROM LivePost WHERE userId = u.id) + (SELECT COUNT(*) FROM LiveCaption WHERE userId = u.id)
+    FROM LiveUser u
+""", UserSuggestionRow)
+
+
+@lru_cache(maxsize=512)
+def captionsWithUsernameByPosts(postCount: int, limited: bool) -> Query:
+    """Top captions of postCount posts, ranked per post so a limit applies to each post separately; one Query per shape."""
+
+    placeholders = ', '.join('?' for _ in range(postCount))
+    limitFilter = "WHERE postRank <= ?" if limited else ""
+
+    return Query(f"""
+        SELECT id, postId, userId, text, created_at, likes, username, commentCount
+        FROM (
+            SELECT c.id, c.postId, c.userId, c.text, c.created_at, c.likes, u.username, c.commentCount,
+                ROW_NUMBER() OVER (
+                    PARTITION BY c.postId
+                    ORDER BY c.likes DESC, c.created_at ASC
+                ) AS postRank
+            FROM LiveCaption c
+            JOIN User u ON c.userId = u.id
+            WHERE c.postId IN ({placeholders})
+        )
+        {limitFilter}
+        ORDER BY postId, postRank
+    """, CaptionWithUsernameRow, CaptionWithUsernameRowForViewer, 'caption')
+
+
+@lru_cache(maxsize=128)
+def postsWithUsernameByIds(postCount: int) -> Query:
+    placeholders = ', '.join('?' for _ in range(postCount))
+
+    return Query(f"""
+        SELECT p.id, p.userId, p.imageName, p.created_at, p.likes, p.topCaptionId, p.captionCount, u.username
+        FROM LivePost p
+        JOIN User u ON p.userId = u.id
+        WHERE p.id IN ({placeholders})
+    """, PostWithUsernameRow, PostWithUsernameRowForViewer, 'post')
+
+
+@lru_cache(maxsize=128)
+def captionsWithUsernameByIds(captionCount: int) -> Query:
+    placeholders = ', '.join('?' for _ in range(captionCount))
+
+    return Query(f"""
+        SELECT c.id, c.postId, c.userId, c.text, c.created_at, c.likes, u.username, c.commentCount
+        FROM LiveCaption c
+        JOIN User u ON c.userId = u.id
+        WHERE c.id IN ({placeholders})
+    """, CaptionWithUsernameRow, CaptionWithUsernameRowForViewer, 'caption')
+
+
+@lru_cache(maxsize=128)
+def usersByIds(userCount: int) -> Query:
+    placeholders = ', '.join('?' for _ in range(userCount))
+
+    return Query(f"""
+        SELECT id, username, name, profilePicture, created_at
+        FROM LiveUser
+        WHERE id IN ({placeholders})
+    """, UserRow)
+
+
+@lru_cache(maxsize=128)
+def userSuggestionsByIds(userCount: int) -> Query:
+    placeholders = ', '.join('?' for _ in range(userCount))
+
+    return Query(f"""
+        SELECT u.id, u.username, u.name, u.profilePicture,
+            (SELECT COUNT(*) FROM LivePost WHERE userId = u.id) + (SELECT COUNT(*) FROM LiveCaption WHERE userId = u.id)
+        FROM LiveUser u
+        WHERE u.id IN ({placeholders})
+    """, UserSuggestionRow)
+
+
+def byIdsWithArchived(cursor, queryByIds, ids: list, viewerId: int = None) -> list:
+    """Rows of queryByIds(n) for ids, looking up in the archive the ids the hot tables have no rows for."""
+
+    rows = queryByIds(len(ids)).all(cursor, ids, viewerId) if ids else []
+
+    missingIds = list(set(ids) - {row.id for row in rows})
+    if missingIds and hasArchive(cursor):
+        rows += queryByIds(len(missingIds)).archived().all(cursor, missingIds, viewerId)
+    return rows
@@ -0,0 +1,268 @@
+import hashlib
+import json
+import math
+import os
+import time
+from contextlib import asynccontextmanager
+
+from litestar import Request
+from litestar.enums import ScopeType
+from litestar.exceptions import ServiceUnavailableException, TooManyRequestsException
+from litestar.middleware import AbstractMiddleware
+
+from src.modules.database import database as defaultDatabase
+
+
+# Sustained requests per second and burst allowed for one signed in user
+RATE_LIMIT_USER_PER_SECOND = float(os.environ.get('CAPRANK_RATE_LIMIT_USER_RATE', '5'))
+RATE_LIMIT_USER_BURST = int(os.environ.get('CAPRANK_RATE_LIMIT_USER_BURST', '30'))
+
+# Per client IP; higher than per user, since one address can front many users
+RATE_LIMIT_IP_PER_SECOND = float(os.environ.get('CAPRANK_RATE_LIMIT_IP_RATE', '20'))
+RATE_LIMIT_IP_BURST = int(os.environ.get('CAPRANK_RATE_LIMIT_IP_BURST', '100'))
+
+# 'memory' keeps buckets per process; a redis:// URL shares them between workers
+RATE_LIMIT_STORE = os.environ.get('CAPRANK_RATE_LIMIT_STORE', 'memory')
+
+# Writes are shed with 503 while more than this many wait for the writer
+MAX_QUEUED_WRITES = int(os.environ.get('CAPRANK_MAX_QUEUED_WRITES', '500'))
+
+# Write requests handled at once by one process
+MAX_CONCURRENT_WRITES = int(os.environ.get('CAPRANK_MAX_CONCURRENT_WRITES', '256'))
+
+# Retry-After sent with a 503
+SHED_RETRY_AFTER_SECONDS = 1
+
+# Buckets kept in memory before idle ones are dropped
+MAX_TRACKED_BUCKETS = 100_000
+
+# How long a userId and password found valid are trusted for picking a bucket without asking the database again
+AUTHENTICATED_CACHE_SECONDS = 60
+
+RATE_LIMITED_METHODS = {'POST', 'PUT', 'PATCH', 'DELETE'}
+
+# POST endpoints that never write, so a busy writer is no reason to turn them away
+ADMISSION_EXEMPT_PATHS = {'/login'}
+
+
+class InMemoryTokenBuckets:
+    """Token buckets in this process; with several workers each one enforces the limits on its own."""
+
+    def __init__(self, maxBuckets: int = MAX_TRACKED_BUCKETS):
+        self.maxBuckets = maxBuckets
+        # key -> (tokens, updated at, full again at)
+        self.buckets = {}
+
+
+    async def take(self, key: str, rate: float, burst: int) -> float:
+        """Take a token from key's bucket, returning 0 if there was one or else the seconds until there is."""
+
+        now = time.monotonic()
+        tokens, updatedAt, _ = self.buckets.get(key, (burst, now, now))
+        tokens = min(burst, tokens + (now - updatedAt) * rate)
+
+        retryAfter = 0
+        if tokens >= 1:
+            tokens -= 1
+        else:
+            retryAfter = (1 - tokens) / rate
+
+        self.buckets[key] = (tokens, now, now + (burst - tokens) / rate)
+
+        if len(self.buckets) > self.maxBuckets:
+            # A full bucket is the same as no bucket
+            self.buckets = {key: bucket for key, bucket in self.buckets.items() if bucket[2] > now}
+
+        return retryAfter
+
+
+
+class StoreTokenBuckets:
+    """
+    Token buckets in a Litestar store, such as a RedisStore shared by all workers.
+    Taking a token is a read followed by a write, so workers racing on one key can
+    now and then let a request more through than the limit.
+    """
+
+    def __init__(self, store):
+        self.store = store
+
+
+    async def take(self, key: str, rate: float, burst: int) -> float:
+        now = time.time()
+        stored = await self.store.get(key)
+        tokens, updatedAt = json.loads(stored) if stored else (burst, now)
+        tokens = min(burst, tokens + (now - updatedAt) * rate)
+
+        retryAfter = 0
+        if tokens >= 1:
+            tokens -= 1
+        else:
+            retryAfter = (1 - tokens) / rate
+
+        # Expires once it would be full again
+        await self.store.set(key, json.dumps([tokens, now]), expires_in=math.ceil((burst - tokens) / rate) + 1)
+        return retryAfter
+
+
+def createTokenBuckets(storeUrl: str = RATE_LIMIT_STORE):
+    if storeUrl == 'memory':
+        return InMemoryTokenBuckets()
+
+    if storeUrl.startswith(('redis://', 'rediss://')):
+        # Only needed when the buckets are shared, so redis isn't a hard dependency
+        from litestar.stores.redis import RedisStore
+        return StoreTokenBuckets(RedisStore.with_client(url=storeUrl, namespace='CapRankRateLimit'))
+
+    raise ValueError(f"Unsupported rate limit store: {storeUrl}")
+
+
+async def requestCredentials(request: Request):
+    """The (userId, password) a write comes with: from the JSON or form body, or an id_userId_password path."""
+
+    for name, value in request.path_params.items():
+        if name.endswith('UserIdPassword'):
+            parts = str(value).split('_')
+            return (parts[1], parts[2]) if len(parts) > 2 else (None, None)
+
+    contentType = request.content_type[0]
+    try:
+        if contentType == 'application/json':
+            body = await request.json()
+            return (body.get('userId'), body.get('password')) if isinstance(body, dict) else (None, None)
+        if contentType in ('multipart/form-data', 'application/x-www-form-urlencoded'):
+            # Parsed once; the handler reuses the parsed form
+            form = await request.form()
+            return form.get('userId'), form.get('password')
+    except Exception:
+        # Malformed bodies are the handler's to reject
+        return None, None
+
+    return None, None
+
+
+
+class RateLimiter:
+    """
+    Per user and per client IP token buckets, plus admission control in front of the single writer.
+
+    A write only draws on a user's bucket once its password checks out, so nobody can use up
+    another user's allowance by sending their userId. Anything else is limited by IP alone.
+
+    A client over its rate gets 429. When the write queue is longer than maxQueuedWrites, or
+    maxConcurrentWrites write requests are in progress already, new writes get 503 instead of
+    waiting in line, which keeps latency steady for the writes that are let in.
+    """
+
+    def __init__(self, buckets=None, database=defaultDatabase,
+                 userRate: float = RATE_LIMIT_USER_PER_SECOND, userBurst: int = RATE_LIMIT_USER_BURST,
+                 ipRate: float = RATE_LIMIT_IP_PER_SECOND, ipBurst: int = RATE_LIMIT_IP_BURST,
+                 maxQueuedWrites: int = MAX_QUEUED_WRITES, maxConcurrentWrites: int = MAX_CONCURRENT_WRITES):
+        self.buckets = buckets
+        self.database = database
+        self.userRate = userRate
+        self.userBurst = userBurst
+        self.ipRate = ipRate
+        self.ipBurst = ipBurst
+        self.maxQueuedWrites = maxQueuedWrites
+        self.maxConcurrentWrites = maxConcurrentWrites
+        self.writesInProgress = 0
+        # (userId, password digest) -> trusted until
+        self.authenticated = {}
+
+
+    async def authenticatedUserId(self, userId, password):
+        """userId if password is that user's, else None."""
+
+        try:
+            userId = int(userId)
+        except (TypeError, ValueError):
+            return None
+        if password is None:
+            return None
+
+        key = (userId, hashlib.sha256(str(password).encode()).hexdigest())
+        now = time.monotonic()
+        if self.authenticated.get(key, 0) > now:
+            return userId
+
+        def checkPassword(cursor):
+            cursor.execute("""
+                SELECT 1
+                FROM LiveUser
+                WHERE id = ? AND password = ?
+            """, (userId, str(password)))
+            return cursor.fetchone() is not None
+
+        if not await self.database.read(checkPassword):
+            return None
+
+        if len(self.authenticated) >= MAX_TRACKED_BUCKETS:
+            self.authenticated = {key: trustedUntil for key, trustedUntil in self.authenticated.items() if trustedUntil > now}
+        self.authenticated[key] = now + AUTHENTICATED_CACHE_SECONDS
+        return userId
+
+
+    async def checkRate(self, request: Request):
+        if self.buckets is None:
+            self.buckets = createTokenBuckets()
+
+        clientIp = request.client.host if request.client else 'unknown'
+        retryAfter = await self.buckets.take(f"ip:{clientIp}", self.ipRate, self.ipBurst)
+
+        # The IP bucket goes first, so guessing passwords costs tokens before it costs a database read
+        if not retryAfter:
+            userId = await self.authenticatedUserId(*await requestCredentials(request))
+            if userId is not None:
+                retryAfter = await self.buckets.take(f"user:{userId}", self.userRate, self.userBurst)
+
+        if retryAfter:
+            raise TooManyRequestsException(
+                detail="Too many requests, slow down",
+                headers={'Retry-After': str(math.ceil(retryAfter))}
+            )
+
+
+    @asynccontextmanager
+    async def admitWrite(self):
+        if self.writesInProgress >= self.maxConcurrentWrites or self.database.queuedWrites() >= self.maxQueuedWrites:
+            raise ServiceUnavailableException(
+                detail="Server is busy, try again shortly",
+                headers={'Retry-After': str(SHED_RETRY_AFTER_SECONDS)}
+            )
+
+        self.writesInProgress += 1
+        try:
+            yield
+        finally:
+            self.writesInProgress -= 1
+
+
+
+rateLimiter = RateLimiter()
+
+
+
+class RateLimitMiddleware(AbstractMiddleware):
+    """Applies a RateLimiter, the shared one unless given another, to write requests."""
+
+    scopes = {ScopeType.HTTP}
+
+    def __init__(self, app, limiter: RateLimiter = None, **kwargs):
+        super().__init__(app, **kwargs)
+        self.limiter = limiter or rateLimiter
+
+
+    async def __call__(self, scope, receive, send):
+        if scope['method'] not in RATE_LIMITED_METHODS:
+            await self.app(scope, receive, send)
+            return
+
+        await self.limiter.checkRate(Request(scope, receive, send))
+
+        if scope['path'] in ADMISSION_EXEMPT_PATHS:
+            await self.app(scope, receive, send)
+            return
+
+        async with self.limiter.admitWrite():
+            await self.app(scope, receive, send)
@@ -0,0 +1,104 @@
+import asyncio
+import gzip
+import os
+import time
+
+from litestar.response import Response
+from litestar.serialization import encode_json
+
+
+# How long a cached list is served before it is recomputed
+RESPONSE_CACHE_TTL_SECONDS = float(os.environ.get('CAPRANK_RESPONSE_CACHE_TTL', '2'))
+
+# How long past its TTL an entry may still be served while one request recomputes it
+RESPONSE_CACHE_STALE_SECONDS = float(os.environ.get('CAPRANK_RESPONSE_CACHE_STALE', '30'))
+
+# Distinct keys kept, such as GET /post?userId=... for many users; the oldest goes first
+RESPONSE_CACHE_MAX_ENTRIES = 1000
+
+RESPONSE_CACHE_COMPRESS_LEVEL = 6
+
+
+class CachedBody:
+    __slots__ = ('plain', 'compressed', 'expiresAt')
+
+    def __init__(self, plain: bytes, compressed: bytes, expiresAt: float):
+        self.plain = plain
+        self.compressed = compressed
+        self.expiresAt = expiresAt
+
+
+
+class ResponseCache:
+    """
+    Short lived cache of JSON bodies that are the same for every caller, kept encoded and gzipped.
+
+    Requests are single flight per key: when an entry expires, the first request recomputes
+    it and the rest share that result, or get the stale body for up to staleSeconds instead
+    of waiting, so a burst of requests costs one query rather than one each.
+    """
+
+    def __init__(self, ttlSeconds: float = RESPONSE_CACHE_TTL_SECONDS, staleSeconds: float = RESPONSE_CACHE_STALE_SECONDS,
+                 maxEntries: int = RESPONSE_CACHE_MAX_ENTRIES):
+        self.ttlSeconds = ttlSeconds
+        self.staleSeconds = staleSeconds
+        self.maxEntries = maxEntries
+        self.entries = {}
+        self.refreshing = {}
+
+
+    async def _refresh(self, key, compute) -> CachedBody:
+        try:
+            plain = encode_json(await compute())
+            # Compressing a large list takes a while, so keep it off the event loop
+            compressed = await asyncio.to_thread(gzip.compress, plain, RESPONSE_CACHE_COMPRESS_LEVEL)
+
+            entry = CachedBody(plain, compressed, time.monotonic() + self.ttlSeconds)
+            self.entries.pop(key, None)
+            self.entries[key] = entry
+            if len(self.entries) > self.maxEntries:
+                del self.entries[next(iter(self.entries))]
+
+            return entry
+
+        finally:
+            del self.refreshing[key]
+
+
+    async def fetch(self, key, compute) -> CachedBody:
+        """The cached body for key, calling the async compute for a fresh one when it has expired."""
+
+        now = time.monotonic()
+        entry = self.entries.get(key)
+        if entry is not None and now < entry.expiresAt:
+            return entry
+
+        refresh = self.refreshing.get(key)
+        if refresh is None:
+            refresh = self.refreshing[key] = asyncio.ensure_future(self._refresh(key, compute))
+        elif entry is not None and now < entry.expiresAt + self.staleSeconds:
+            return entry
+
+        # Shielded, so a client hanging up doesn't cancel the refresh others are waiting on
+        return await asyncio.shield(refresh)
+
+
+    async def respond(self, key, compute, acceptEncoding: str = None) -> Response:
+        entry = await self.fetch(key, compute)
+
+        headers = {
+            'Cache-Control': f"public, max-age={int(self.ttlSeconds)}",
+            'Vary': 'Accept-Encoding'
+        }
+        if acceptEncoding and 'gzip' in acceptEncoding:
+            return Response(content=entry.compressed, media_type='application/json', headers={**headers, 'Content-Encoding': 'gzip'})
+
+        return Response(content=entry.plain, media_type='application/json', headers=headers)
+
+
+    def clear(self):
+        self.entries.clear()
+
+
+
+responseCache = ResponseCache()
@@ -0,0 +1,156 @@
+import asyncio
+import logging
+import os
+import time
+
+from src.modules.database import database as defaultDatabase
+
+
+logger = logging.getLogger(__name__)
+
+
+# Likes are counted per post per bucket of this many seconds
+TRENDING_BUCKET_SECONDS = 3600
+
+# Window name -> buckets it spans
+TRENDING_WINDOWS = {
+    'day': 24,
+    'week': 24 * 7,
+}
+
+# Posts ranked per window; pages past this are empty
+TRENDING_TOP_K = 1000
+
+# How often the leaderboards are rebuilt from PostLikeBucket, picking up other workers' likes
+TRENDING_REFRESH_SECONDS = float(os.environ.get('CAPRANK_TRENDING_REFRESH', '30'))
+
+
+def currentBucket() -> int:
+    return int(time.time() // TRENDING_BUCKET_SECONDS)
+
+
+
+class Leaderboard:
+    """Like counts of the top posts in one window, ranked on demand."""
+
+    def __init__(self):
+        self.counts = {}
+        self.ranking = []
+
+
+    def replace(self, counts: dict):
+        self.counts = counts
+        self.ranking = None
+
+
+    def add(self, postId: int, delta: int):
+        # A post outside the top K only starts from this delta; the next rebuild has its full count
+        self.counts[postId] = self.counts.get(postId, 0) + delta
+        self.ranking = None
+
+
+    def page(self, offset: int, limit: int) -> list:
+        if self.ranking is None:
+            ranked = sorted(self.counts.items(), key=lambda item: (-item[1], item[0]))
+            self.ranking = [item for item in ranked[:TRENDING_TOP_K] if item[1] > 0]
+        return self.ranking[offset:offset + limit]
+
+
+
+class TrendingPosts:
+    """
+    Rolling "top posts today / this week" leaderboards.
+
+    Every post like or unlike adds to the post's PostLikeBucket row for the current hour,
+    in the same write as the like. Each process keeps a top-K leaderboard per window in
+    memory: it is rebuilt from the buckets every TRENDING_REFRESH_SECONDS in the
+    background, and this process's own likes are added to it as they happen. Reading a
+    page only slices the ranking, so it costs the same however many posts and likes exist.
+    """
+
+    def __init__(self, database=defaultDatabase, refreshSeconds: float = TRENDING_REFRESH_SECONDS):
+        self.database = database
+        self.refreshSeconds = refreshSeconds
+        self.leaderboards = {window: Leaderboard() for window in TRENDING_WINDOWS}
+        self.refreshedAt = None
+        self.refreshTask = None
+        self.prunedBucket = None
+
+
+    def recordLike(self, cursor, postId: int, delta: int):
+        """Count a like (delta 1) or unlike (-1) inside the write operation that changed it."""
+
+        cursor.execute("""
+            INSERT INTO PostLikeBucket (postId, bucket, likes)
+            VALUES (?, ?, ?)
+            ON CONFLICT (postId, bucket) DO UPDATE SET likes = PostLikeBucket.likes + excluded.likes
+        """, (postId, currentBucket(), delta))
+
+
+    def applyLike(self, postId: int, delta: int):
+        """Add a committed like to this process's leaderboards straight away."""
+
+        for leaderboard in self.leaderboards.values():
+            leaderboard.add(int(postId), delta)
+
+
+    async def refresh(self):
+        bucket = currentBucket()
+
+        def fetchTopPosts(cursor):
+            topPosts = {}
+            for window, bucketCount in TRENDING_WINDOWS.items():
+                cursor.execute("""
+                    SELECT b.postId, SUM(b.likes) AS windowLikes
+                    FROM PostLikeBucket b
+                    JOIN LivePost p ON p.id = b.postId
+                    WHERE b.bucket > ?
+                    GROUP BY b.postId
+                    HAVING SUM(b.likes) > 0
+                    ORDER BY windowLikes DESC, b.postId
+                    LIMIT ?
+                """, (bucket - bucketCount, TRENDING_TOP_K))
+                topPosts[window] = dict(cursor.fetchall())
+            return topPosts
+
+        for window, counts in (await self.database.read(fetchTopPosts)).items():
+            self.leaderboards[window].replace(counts)
+        self.refreshedAt = time.monotonic()
+
+        # Buckets older than the longest window are no longer read
+        if self.prunedBucket != bucket:
+            def pruneBuckets(cursor):
+                cursor.execute("""
+                    DELETE FROM PostLikeBucket
+                    WHERE bucket <= ?
+                """, (bucket - max(TRENDING_WINDOWS.values()),))
+
+            await self.database.write(pruneBuckets)
+            self.prunedBucket = bucket
+
+
+    async def _refreshInBackground(self):
+        try:
+            await self.refresh()
+        except Exception:
+            logger.exception("Trending refresh failed, serving the previous leaderboards")
+        finally:
+            self.refreshTask = None
+
+
+    async def page(self, window: str, offset: int, limit: int) -> list:
+        """(postId, likes in window) pairs ranked offset to offset + limit."""
+
+        stale = self.refreshedAt is None or time.monotonic() - self.refreshedAt > self.refreshSeconds
+        if stale and self.refreshTask is None:
+            self.refreshTask = asyncio.create_task(self._refreshInBackground())
+
+        # Only the very first page waits; later ones are served from the previous leaderboards meanwhile
+        if self.refreshedAt is None:
+            await asyncio.shield(self.refreshTask)
+
+        return self.leaderboards[window].page(offset, limit)
+
+
+
+trendingPosts = TrendingPosts()
@@ -0,0 +1,25 @@
+from src.modules.change_log import recordChange
+
+
+def insertUser(cursor, username: str, name: str, password: str, profilePicture: str = None):
+    """
+    Register a user inside a write operation, returning the new id, or None if the username is taken.
+
+    The unique index on username decides, in the INSERT itself, so two registrations racing
+    for one name can't both get it.
+    """
+
+    cursor.execute("""
+        INSERT INTO
+        User (username, name, password, profilePicture)
+            VALUES(?,?,?,?)
+        ON CONFLICT (username) DO NOTHING
+        RETURNING id
+    """, (username, name, password, profilePicture))
+
+    row = cursor.fetchone()
+    if row is None:
+        return None
+
+    recordChange(cursor, 'user', row[0])
+    return row[0]
@@ -0,0 +1,215 @@
+import asyncio
+import bisect
+import heapq
+import logging
+import os
+import time
+
+from src.modules.database import database as defaultDatabase
+from src.modules import queries
+
+
+logger = logging.getLogger(__name__)
+
+
+# How often user changes are read from ChangeLog, picking up other workers' registrations
+USER_SUGGEST_REFRESH_SECONDS = float(os.environ.get('CAPRANK_USER_SUGGEST_REFRESH', '2'))
+
+# How often the whole index is rebuilt, which refreshes every user's activity count
+USER_SUGGEST_REBUILD_SECONDS = float(os.environ.get('CAPRANK_USER_SUGGEST_REBUILD', '600'))
+
+# Prefixes whose ranked suggestions are kept until a matching user changes
+MAX_CACHED_PREFIXES = 4096
+
+# Suggestions a request may ask for, and so how many are cached per prefix
+MAX_USER_SUGGESTIONS = 50
+
+# Users read per query while catching up
+USER_SUGGEST_CHUNK_SIZE = 500
+
+
+def _rank(user) -> tuple:
+    # Most active first, then alphabetically
+    return (-user.activity, user.username)
+
+
+def _prefixKeys(username: str, name: str) -> set:
+    """Lowercased strings a prefix can match a user by: the username, the full name and each word of it."""
+
+    keys = {username.casefold(), name.casefold()}
+    keys.update(word.casefold() for word in name.split())
+    return keys
+
+
+
+class UserSuggestions:
+    """
+    As-you-type user suggestions, served from memory.
+
+    Every user's username, name and name words are kept in one sorted list, so the users
+    matching a prefix are one contiguous slice found by binary search. Ranked results are
+    cached per prefix and patched when a user changes, so short, busy prefixes stay warm.
+    Registrations, renames and deletions arrive by reading ChangeLog past the last seq seen,
+    in the background; a request never waits on the database, except before the first load.
+    """
+
+    def __init__(self, database=defaultDatabase, refreshSeconds: float = USER_SUGGEST_REFRESH_SECONDS,
+                 rebuildSeconds: float = USER_SUGGEST_REBUILD_SECONDS):
+        self.database = database
+        self.refreshSeconds = refreshSeconds
+        self.rebuildSeconds = rebuildSeconds
+
+        self.users = {}
+        self.userKeys = {}
+        self.keys = []
+        self.cache = {}
+
+        self.lastSeq = None
+        self.refreshedAt = None
+        self.rebuiltAt = None
+        self.refreshTask = None
+
+
+    def _updateCached(self, userId: int, keys, user=None):
+        """Fold a changed user into the cached rankings of prefixes it matches, or drop those that can't be patched."""
+
+        for prefix in [prefix for prefix in self.cache if any(key.startswith(prefix) for key in keys)]:
+            ranked = self.cache[prefix]
+            if any(ranked_user.id == userId for ranked_user in ranked):
+                # Whoever ranks next isn't cached, so work the ranking out again
+                del self.cache[prefix]
+            elif user is not None and user.id in self.users and any(key.startswith(prefix) for key in self.userKeys[user.id]):
+                # A full ranking holds the top users only; a shorter one holds every match
+                if len(ranked) < MAX_USER_SUGGESTIONS or _rank(user) < _rank(ranked[-1]):
+                    bisect.insort(ranked, user, key=_rank)
+                    del ranked[MAX_USER_SUGGESTIONS:]
+
+
+    def upsert(self, user: queries.UserSuggestionRow):
+        oldKeys = self._removeKeys(user.id)
+
+        keys = _prefixKeys(user.username, user.name)
+        self.users[user.id] = user
+        self.userKeys[user.id] = keys
+        for key in keys:
+            bisect.insort(self.keys, (key, user.id))
+        self._updateCached(user.id, keys | oldKeys, user)
+
+
+    def _removeKeys(self, userId: int) -> set:
+        keys = self.userKeys.pop(userId, None)
+        if keys is None:
+            return set()
+
+        del self.users[userId]
+        for key in keys:
+            index = bisect.bisect_left(self.keys, (key, userId))
+            if index < len(self.keys) and self.keys[index] == (key, userId):
+                del self.keys[index]
+        return keys
+
+
+    def remove(self, userId: int):
+        self._updateCached(userId, self._removeKeys(userId))
+
+
+    async def rebuild(self):
+        def fetchUsers(cursor):
+            # Read first, so changes made while the users are read are caught up on afterwards
+            cursor.execute("SELECT COALESCE(MAX(seq), 0) FROM ChangeLog")
+            lastSeq = cursor.fetchone()[0]
+            return lastSeq, queries.ALL_USER_SUGGESTIONS.all(cursor)
+
+        lastSeq, users = await self.database.read(fetchUsers)
+
+        self.users = {user.id: user for user in users}
+        self.userKeys = {user.id: _prefixKeys(user.username, user.name) for user in users}
+        self.keys = sorted((key, userId) for userId, keys in self.userKeys.items() for key in keys)
+        self.cache = {}
+        self.lastSeq = lastSeq
+        self.rebuiltAt = self.refreshedAt = time.monotonic()
+
+
+    async def catchUp(self):
+        def fetchChangedUsers(cursor):
+            cursor.execute("""
+                SELECT entityId, seq
+                FROM ChangeLog
+                WHERE entity = 'user' AND seq > ?
+                ORDER BY seq
+            """, (self.lastSeq,))
+            changes = cursor.fetchall()
+            lastSeq = changes[-1][1] if changes else self.lastSeq
+
+            userIds = list({userId for userId, _ in changes})
+            users = []
+            for start in range(0, len(userIds), USER_SUGGEST_CHUNK_SIZE):
+                chunk = userIds[start:start + USER_SUGGEST_CHUNK_SIZE]
+                users.extend(queries.userSuggestionsByIds(len(chunk)).all(cursor, chunk))
+            return lastSeq, userIds, users
+
+        lastSeq, userIds, users = await self.database.read(fetchChangedUsers)
+
+        # Users gone from LiveUser were deleted
+        for userId in set(userIds) - {user.id for user in users}:
+            self.remove(userId)
+        for user in users:
+            self.upsert(user)
+
+        self.lastSeq = lastSeq
+        self.refreshedAt = time.monotonic()
+
+
+    async def refresh(self):
+        if self.rebuiltAt is None or time.monotonic() - self.rebuiltAt > self.rebuildSeconds:
+            await self.rebuild()
+        else:
+            await self.catchUp()
+
+
+    async def _refreshInBackground(self):
+        try:
+            await self.refresh()
+        except Exception:
+            logger.exception("User suggestion refresh failed, serving the previous index")
+        finally:
+            self.refreshTask = None
+
+
+    def refreshSoon(self):
+        """Pick up a change this process just committed without waiting for the next refresh."""
+
+        self.refreshedAt = None
+        if self.refreshTask is None and self.lastSeq is not None:
+            self.refreshTask = asyncio.create_task(self._refreshInBackground())
+
+
+    async def suggest(self, prefix: str, limit: int) -> list:
+        """Users whose username, name or a word of their name starts with prefix, most active first."""
+
+        stale = self.refreshedAt is None or time.monotonic() - self.refreshedAt > self.refreshSeconds
+        if stale and self.refreshTask is None:
+            self.refreshTask = asyncio.create_task(self._refreshInBackground())
+
+        if self.lastSeq is None:
+            await asyncio.shield(self.refreshTask)
+
+        prefix = prefix.casefold()
+        ranked = self.cache.get(prefix)
+        if ranked is None:
+            start = bisect.bisect_left(self.keys, (prefix,))
+            end = bisect.bisect_left(self.keys, (prefix + '\U0010ffff',), start)
+            userIds = {userId for _, userId in self.keys[start:end]}
+
+            users = self.users
+            ranked = heapq.nsmallest(MAX_USER_SUGGESTIONS, (users[userId] for userId in userIds), key=_rank)
+
+            self.cache[prefix] = ranked
+            if len(self.cache) > MAX_CACHED_PREFIXES:
+                del self.cache[next(iter(self.cache))]
+
+        return ranked[:limit]
+
+
+
+userSuggestions = UserSuggestions()
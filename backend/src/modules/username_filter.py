@@ -0,0 +1,115 @@
+import asyncio
+import os
+import time
+
+from src.modules.bloom_filter import BloomFilter
+from src.modules.database import database as defaultDatabase
+
+
+# Share of unused usernames the filter wrongly reports as possibly taken, sending them to the index
+USERNAME_FILTER_FALSE_POSITIVE_RATE = 0.01
+
+# Usernames the first filter is sized for; it is rebuilt twice as large once it fills up
+USERNAME_FILTER_MIN_CAPACITY = 100_000
+
+# How often usernames registered or changed by other workers are read from ChangeLog
+USERNAME_FILTER_REFRESH_SECONDS = float(os.environ.get('CAPRANK_USERNAME_FILTER_REFRESH', '2'))
+
+
+
+class UsernameFilter:
+    """
+    Answers "is this username free?" mostly from memory.
+
+    A Bloom filter holds every username ever taken. A name it has never seen is free, which
+    is the common answer while someone types a new name, so most checks never reach the
+    database; only names that may be taken are looked up in User's unique index. Other
+    workers' registrations and renames are read from ChangeLog every
+    USERNAME_FILTER_REFRESH_SECONDS, so for that long a name just taken elsewhere can still
+    be reported free. Registration itself is decided by the unique index.
+    """
+
+    def __init__(self, database=defaultDatabase, refreshSeconds: float = USERNAME_FILTER_REFRESH_SECONDS):
+        self.database = database
+        self.refreshSeconds = refreshSeconds
+        self.bloom = None
+        self.lastSeq = None
+        self.refreshedAt = None
+        self.refreshLock = None
+
+
+    async def rebuild(self):
+        def fetchUsernames(cursor):
+            cursor.execute("SELECT COALESCE(MAX(seq), 0) FROM ChangeLog")
+            lastSeq = cursor.fetchone()[0]
+            cursor.execute("SELECT username FROM User")
+            return lastSeq, [row[0] for row in cursor.fetchall()]
+
+        lastSeq, usernames = await self.database.read(fetchUsernames)
+
+        bloom = BloomFilter(max(USERNAME_FILTER_MIN_CAPACITY, 2 * len(usernames)), USERNAME_FILTER_FALSE_POSITIVE_RATE)
+        for username in usernames:
+            bloom.add(username.encode())
+
+        self.bloom = bloom
+        self.lastSeq = lastSeq
+        self.refreshedAt = time.monotonic()
+
+
+    async def catchUp(self):
+        def fetchChangedUsernames(cursor):
+            cursor.execute("""
+                SELECT c.seq, u.username
+                FROM ChangeLog c
+                JOIN User u ON u.id = c.entityId
+                WHERE c.entity = 'user' AND c.seq > ?
+                ORDER BY c.seq
+            """, (self.lastSeq,))
+            return cursor.fetchall()
+
+        changes = await self.database.read(fetchChangedUsernames)
+        for _, username in changes:
+            self.add(username)
+        if changes:
+            self.lastSeq = changes[-1][0]
+        self.refreshedAt = time.monotonic()
+
+
+    async def refresh(self):
+        if self.refreshLock is None:
+            self.refreshLock = asyncio.Lock()
+
+        async with self.refreshLock:
+            if self.bloom is None or self.bloom.count > self.bloom.capacity:
+                await self.rebuild()
+            elif time.monotonic() - self.refreshedAt > self.refreshSeconds:
+                await self.catchUp()
+
+
+    def add(self, username: str):
+        """Record a username this process just took."""
+
+        if self.bloom is not None:
+            self.bloom.add(username.encode())
+
+
+    async def isAvailable(self, username: str) -> bool:
+        if self.bloom is None or time.monotonic() - self.refreshedAt > self.refreshSeconds:
+            await self.refresh()
+
+        if username.encode() not in self.bloom:
+            return True
+
+        def lookUpUsername(cursor):
+            cursor.execute("""
+                SELECT 1
+                FROM User
+                WHERE username = ?
+            """, (username,))
+            return cursor.fetchone() is None
+
+        return await self.database.read(lookUpUsername)
+
+
+
+usernameFilter = UsernameFilter()
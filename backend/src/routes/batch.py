@@ -0,0 +1,141 @@
+from litestar import Controller, post, status_codes
+from litestar.exceptions import HTTPException
+
+import sqlite3
+
+from src.modules.data_types import DT_Batch, DT_BatchOperation, BATCH_OPERATION_TARGETS
+from src.modules.database import database, isDatabaseLocked
+from src.modules.like_service import applyLike, likeCommitted
+from src.modules.caption_service import insertCaption, insertComment
+from src.modules.idempotency import storedResponse, storeResponse
+
+
+# Like operations -> (kind, liked)
+BATCH_LIKE_OPERATIONS = {
+    'likePost': ('post', True),
+    'unlikePost': ('post', False),
+    'likeCaption': ('caption', True),
+    'unlikeCaption': ('caption', False),
+}
+
+
+def runOperation(cursor, userId: int, password: str, operation: DT_BatchOperation) -> dict:
+    if operation.op in BATCH_LIKE_OPERATIONS:
+        kind, liked = BATCH_LIKE_OPERATIONS[operation.op]
+        targetId = operation.postId if kind == 'post' else operation.captionId
+        result, _ = applyLike(cursor, kind, userId, password, targetId, liked=liked)
+        return result
+
+    if operation.op == 'createCaption':
+        return insertCaption(cursor, operation.postId, userId, password, operation.text)
+
+    return {'commentId': insertComment(cursor, operation.captionId, userId, password, operation.text, operation.parentId)}
+
+
+
+class Controller_Batch(Controller):
+    """
+    Replays a client's offline queue of likes, captions and comments in one request.
+
+    The operations run in order as a single write operation, so a batch costs one round
+    trip and one commit however many actions it carries. Each operation runs in its own
+    savepoint: a failing one is rolled back and reported in its result while the rest go
+    through, or with atomic set the whole batch is rolled back. An operation with an
+    idempotencyKey that already succeeded returns its stored result instead of running
+    again, so a client can resend a batch whose response it never got; a key reused for
+    another operation or target fails that operation with 422.
+    """
+
+    path = '/batch'
+
+
+    @post('/', status_code=status_codes.HTTP_200_OK)
+    async def runBatch(self, data: DT_Batch) -> dict:
+        try:
+
+            def applyOperations(cursor):
+                cursor.execute("""
+                    SELECT 1
+                    FROM LiveUser
+                    WHERE id = ? AND password = ?
+                """, (data.userId, data.password))
+
+                if not cursor.fetchone():
+                    raise HTTPException(status_code=status_codes.HTTP_401_UNAUTHORIZED, detail="Invalid credentials")
+
+                results = []
+                changedLikes = []
+
+                for index, operation in enumerate(data.operations):
+                    targetId = getattr(operation, BATCH_OPERATION_TARGETS[operation.op])
+                    replayed = None
+
+                    cursor.execute("SAVEPOINT batchOperation")
+                    try:
+                        if operation.idempotencyKey:
+                            replayed = storedResponse(cursor, data.userId, operation.idempotencyKey, operation.op, targetId)
+
+                        if replayed is None:
+                            result = runOperation(cursor, data.userId, data.password, operation)
+
+                            if operation.idempotencyKey:
+                                storeResponse(cursor, data.userId, operation.idempotencyKey, operation.op, targetId, result)
+
+                        cursor.execute("RELEASE batchOperation")
+
+                    except Exception as e:
+                        # Lock errors abort the whole batch, which the writer then reports as busy
+                        if isinstance(e, sqlite3.OperationalError) and isDatabaseLocked(e):
+                            raise
+
+                        cursor.execute("ROLLBACK TO batchOperation")
+                        cursor.execute("RELEASE batchOperation")
+
+                        statusCode = e.status_code if isinstance(e, HTTPException) else status_codes.HTTP_400_BAD_REQUEST
+                        detail = e.detail if isinstance(e, HTTPException) else f"ERROR: {e}"
+                        if data.atomic:
+                            raise HTTPException(status_code=statusCode, detail=f"Operation {index} ({operation.op}) failed: {detail}")
+
+                        results.append({'index': index, 'op': operation.op, 'status': 'error', 'statusCode': statusCode, 'error': detail})
+                        continue
+
+                    if replayed is not None:
+                        results.append({'index': index, 'op': operation.op, 'status': 'ok', 'replayed': True, 'data': replayed})
+                        continue
+
+                    if operation.op in BATCH_LIKE_OPERATIONS:
+                        kind = BATCH_LIKE_OPERATIONS[operation.op][0]
+                        changedLikes.append((kind, operation.postId if kind == 'post' else operation.captionId, result))
+
+                    results.append({'index': index, 'op': operation.op, 'status': 'ok', 'replayed': False, 'data': result})
+
+                return results, changedLikes
+
+            results, changedLikes = await database.write(applyOperations)
+
+            for kind, targetId, result in changedLikes:
+                likeCommitted(kind, data.userId, targetId, result)
+
+            failed = sum(1 for result in results if result['status'] == 'error')
+
+            return {
+                'status': 'green',
+                'message': f"Batch applied, {len(results) - failed} succeeded and {failed} failed",
+                'data': {
+                    'results': results,
+                    'succeeded': len(results) - failed,
+                    'failed': failed
+                }
+            }
+
+        except HTTPException:
+            raise
+        except sqlite3.OperationalError as e:
+            if isDatabaseLocked(e):
+                raise HTTPException(
+                    status_code=status_codes.HTTP_503_SERVICE_UNAVAILABLE,
+                    detail="Database is temporarily busy, please try again"
+                )
+            raise HTTPException(status_code=status_codes.HTTP_400_BAD_REQUEST, detail=f"Database error: {e}")
+        except Exception as e:
+            raise HTTPException(status_code=status_codes.HTTP_400_BAD_REQUEST, detail=f"ERROR: {e}")
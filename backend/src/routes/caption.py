@@ -1,11 +1,53 @@
-from litestar import Controller, get, status_codes, post, patch, delete
+from litestar import Controller, get, status_codes, post, put, patch, delete
+from litestar.params import Parameter
 from litestar.exceptions import HTTPException
+from litestar.response import Response
 
-from src.modules.data_types import DT_CaptionCreate, DT_CommentCreate
+from src.modules.data_types import DT_CaptionCreate, DT_CommentCreate, DT_LikeSet
+from src.modules.database import database, isDatabaseLocked
+from src.modules.like_service import setLike
+from src.modules.caption_service import insertCaption, insertComment
+from src.modules.response_cache import responseCache
+from src.modules import queries
+from src.modules.change_log import recordChange
 
 import sqlite3
+from typing import List, Optional
 
+# Keeps the IN (...) list well under SQLite's bound parameter limit
+MAX_BATCH_POST_IDS = 100
 
+DEFAULT_COMMENT_PAGE_SIZE = 50
+MAX_COMMENT_PAGE_SIZE = 200
+
+# Bounds on the recursive reply lookup, so a deep or busy thread can't blow up one request
+MAX_REPLY_DEPTH = 5
+MAX_REPLIES_PER_PAGE = 500
+
+
+
+def deleteArchivedCaption(cursor, captionId: int, postId: int):
+    """Delete a caption of an archived post; the archive has no foreign keys, so its likes and comments go explicitly."""
+
+    cursor.execute("DELETE FROM archive.UserLikedCaptions WHERE captionId = ?", (captionId,))
+    cursor.execute("DELETE FROM archive.CaptionComments WHERE captionId = ?", (captionId,))
+    cursor.execute("DELETE FROM archive.Caption WHERE id = ?", (captionId,))
+
+    cursor.execute("""
+        UPDATE archive.Post
+        SET captionCount = captionCount - 1,
+            topCaptionId = (
+                SELECT id
+                FROM archive.Caption
+                WHERE postId = archive.Post.id
+                ORDER BY likes DESC, created_at ASC
+                LIMIT 1
+            )
+        WHERE id = ?
+    """, (postId,))
+
+    recordChange(cursor, 'caption', captionId)
+    recordChange(cursor, 'post', postId)
 
 
 
@@ -16,24 +58,18 @@ class Controller_Caption(Controller):
 
 
     @get("/{captionId:int}", status_code=status_codes.HTTP_200_OK)
-    async def getCaption(self, captionId: int) -> dict:
+    async def getCaption(self, captionId: int, viewerId: Optional[int] = None) -> dict:
         try:
 
-            connection = sqlite3.connect('CapRank.db')
-            cursor = connection.cursor()
-
-            cursor.execute("""
-                SELECT *
-                FROM Caption
-                WHERE id = ?
-            """, (captionId,))
+            def fetchCaption(cursor):
+                queriedCaption = queries.CAPTION_BY_ID.oneOrArchived(cursor, (captionId,), viewerId)
 
+                if queriedCaption == None:
+                    raise HTTPException(status_code=status_codes.HTTP_404_NOT_FOUND, detail=f"No caption with id: {captionId}")
 
-            queriedCaption = cursor.fetchone()
-            connection.close()
+                return queriedCaption
 
-            if queriedCaption == None:
-                raise HTTPException(status_code=status_codes.HTTP_404_NOT_FOUND, detail=f"No caption with id: {captionId}")
+            queriedCaption = await database.read(fetchCaption)
             
             return {
                 'status': 'green',
@@ -47,21 +83,12 @@ class Controller_Caption(Controller):
 
 
     @get("/post/{postId:int}", status_code=status_codes.HTTP_200_OK)
-    async def getCaptionsByPost(self, postId: int) -> dict:
+    async def getCaptionsByPost(self, postId: int, viewerId: Optional[int] = None) -> dict:
         try:
-            connection = sqlite3.connect('CapRank.db')
-            cursor = connection.cursor()
-
-            cursor.execute("""
-                SELECT c.*, u.username
-                FROM Caption c
-                JOIN User u ON c.userId = u.id
-                WHERE c.postId = ?
-                ORDER BY c.likes DESC, c.created_at ASC
-            """, (postId,))
-
-            queriedCaptions = cursor.fetchall()
-            connection.close()
+            def fetchCaptionsByPost(cursor):
+                return queries.CAPTIONS_WITH_USERNAME_BY_POST.allOrArchived(cursor, (postId,), viewerId)
+
+            queriedCaptions = await database.read(fetchCaptionsByPost)
             
             return {
                 'status': 'green',
@@ -73,27 +100,70 @@ class Controller_Caption(Controller):
             raise HTTPException(status_code=status_codes.HTTP_404_NOT_FOUND, detail=f'ERROR: {e}')
 
 
-    @get("/", status_code=status_codes.HTTP_200_OK)
-    async def getAllCaptions(self) -> dict:
+    # /captions/batch?postIds=1&postIds=2&limit=3
+    @get("/batch", status_code=status_codes.HTTP_200_OK)
+    async def getCaptionsByPosts(self, postIds: List[int], limit: Optional[int] = None, viewerId: Optional[int] = None) -> dict:
         try:
+            postIds = list(dict.fromkeys(postIds))
 
-            connection = sqlite3.connect('CapRank.db')
-            cursor = connection.cursor()
+            if len(postIds) > MAX_BATCH_POST_IDS:
+                raise HTTPException(status_code=status_codes.HTTP_400_BAD_REQUEST, detail=f"At most {MAX_BATCH_POST_IDS} post ids per request")
 
-            cursor.execute("""
-                SELECT *
-                FROM Caption
-                ORDER BY created_at DESC
-            """)
+            if limit is not None and limit < 1:
+                raise HTTPException(status_code=status_codes.HTTP_400_BAD_REQUEST, detail="limit must be at least 1")
+
+            def fetchCaptionsByPosts(cursor):
+                # One query for every post
+                query = queries.captionsWithUsernameByPosts(len(postIds), limit is not None)
+                captions = query.all(cursor, (*postIds, *([limit] if limit is not None else [])), viewerId)
+
+                # Posts without hot captions may have been archived with them
+                missingPostIds = list(set(postIds) - {caption.postId for caption in captions})
+                if missingPostIds and queries.hasArchive(cursor):
+                    query = queries.captionsWithUsernameByPosts(len(missingPostIds), limit is not None).archived()
+                    captions += query.all(cursor, (*missingPostIds, *([limit] if limit is not None else [])), viewerId)
+
+                return captions
+
+            queriedCaptions = await database.read(fetchCaptionsByPosts)
+
+            captionsByPost = {postId: [] for postId in postIds}
+            for caption in queriedCaptions:
+                captionsByPost[caption.postId].append(caption)
 
-            queriedCaptions = cursor.fetchall()
-            connection.close()
-            
             return {
                 'status': 'green',
-                'message': 'All captions queried successfully',
-                'data': queriedCaptions
+                'message': 'Captions for posts queried successfully',
+                'data': captionsByPost
             }
+
+        except HTTPException:
+            raise
+        except Exception as e:
+            raise HTTPException(status_code=status_codes.HTTP_404_NOT_FOUND, detail=f'ERROR: {e}')
+
+
+    @get("/", status_code=status_codes.HTTP_200_OK)
+    async def getAllCaptions(self, viewerId: Optional[int] = None,
+        acceptEncoding: Optional[str] = Parameter(header='Accept-Encoding', default=None)
+    ) -> Response:
+        try:
+
+            def fetchCaptions(cursor):
+                return queries.ALL_CAPTIONS.allWithArchived(cursor, viewerId=viewerId)
+
+            async def queryCaptions() -> dict:
+                return {
+                    'status': 'green',
+                    'message': 'All captions queried successfully',
+                    'data': await database.read(fetchCaptions)
+                }
+
+            # Without a viewer's liked flags the list is the same for every caller
+            if viewerId is None:
+                return await responseCache.respond('captions', queryCaptions, acceptEncoding)
+
+            return Response(content=await queryCaptions())
         
 
         except Exception as e:
@@ -104,159 +174,76 @@ class Controller_Caption(Controller):
 
     @post("/", status_code=status_codes.HTTP_201_CREATED)
     async def createCaption(self, data: DT_CaptionCreate) -> dict:
-        connection = None
         try:
-            # Establish connection with timeout and immediate mode
-            connection = sqlite3.connect('CapRank.db', timeout=20)
-            connection.execute('PRAGMA journal_mode=WAL')  # Write-Ahead Logging for better concurrency
-            cursor = connection.cursor()
-
-            # Check if captionCount column exists in Post table
-            cursor.execute("""
-                SELECT COUNT(*) 
-                FROM pragma_table_info('Post') 
-                WHERE name='captionCount'
-            """)
-            has_caption_count = cursor.fetchone()[0] > 0
-
-            if not has_caption_count:
-                # Add captionCount column if it doesn't exist
-                cursor.execute("""
-                    ALTER TABLE Post
-                    ADD COLUMN captionCount INTEGER DEFAULT 0
-                """)
-                connection.commit()
-
-            # Verify user credentials
-            cursor.execute("""
-                SELECT *
-                FROM User
-                WHERE id = ? AND password = ?
-            """, (data.userId, data.password))
-
-            user = cursor.fetchone()
-            if not user:
-                if connection:
-                    connection.close()
-                raise HTTPException(status_code=status_codes.HTTP_401_UNAUTHORIZED, detail="Invalid credentials")
-
-            # Verify post exists
-            cursor.execute("""
-                SELECT *
-                FROM Post
-                WHERE id = ?
-            """, (data.postId,))
-
-            post = cursor.fetchone()
-            if not post:
-                if connection:
-                    connection.close()
-                raise HTTPException(status_code=status_codes.HTTP_404_NOT_FOUND, detail="Post not found")
-
-            # Create caption
-            cursor.execute("""
-                INSERT INTO Caption (postId, userId, text)
-                VALUES (?, ?, ?)
-            """, (data.postId, data.userId, data.text))
-
-            caption_id = cursor.lastrowid
-
-            # Update post's caption count if the column exists
-            if has_caption_count:
-                cursor.execute("""
-                    UPDATE Post
-                    SET captionCount = captionCount + 1
-                    WHERE id = ?
-                """, (data.postId,))
-
-            connection.commit()
-            connection.close()
+            caption = await database.write(lambda cursor: insertCaption(cursor, data.postId, data.userId, data.password, data.text))
 
             return {
                 'status': 'green',
                 'message': 'Caption created successfully',
-                'data': {
-                    'captionId': caption_id
-                }
+                'data': caption
             }
 
+        except HTTPException:
+            raise
         except sqlite3.OperationalError as e:
-            if connection:
-                connection.rollback()
-                connection.close()
-            if "database is locked" in str(e):
+            if isDatabaseLocked(e):
                 raise HTTPException(
                     status_code=status_codes.HTTP_503_SERVICE_UNAVAILABLE,
                     detail="Database is temporarily busy, please try again"
                 )
             raise HTTPException(status_code=status_codes.HTTP_400_BAD_REQUEST, detail=f"Database error: {e}")
         except Exception as e:
-            if connection:
-                connection.rollback()
-                connection.close()
             raise HTTPException(status_code=status_codes.HTTP_400_BAD_REQUEST, detail=f"ERROR: {e}")
 
 
 
     @post("/like", status_code=status_codes.HTTP_200_OK)
-    async def likeCaption(self, data: dict) -> dict:
+    async def likeCaption(self, data: dict, idempotencyKey: Optional[str] = Parameter(header='Idempotency-Key', default=None)) -> dict:
         try:
-            connection = sqlite3.connect('CapRank.db')
-            cursor = connection.cursor()
-
-            # Verify user credentials
-            cursor.execute("""
-                SELECT *
-                FROM User
-                WHERE id = ? AND password = ?
-            """, (data['userId'], data['password']))
-
-            user = cursor.fetchone()
-            if not user:
-                raise HTTPException(status_code=status_codes.HTTP_401_UNAUTHORIZED, detail="Invalid credentials")
-
-            # Check if user already liked the caption
-            cursor.execute("""
-                SELECT *
-                FROM UserLikedCaptions
-                WHERE userId = ? AND captionId = ?
-            """, (data['userId'], data['captionId']))
-
-            existing_like = cursor.fetchone()
-
-            if existing_like:
-                # Unlike
-                cursor.execute("""
-                    DELETE FROM UserLikedCaptions
-                    WHERE userId = ? AND captionId = ?
-                """, (data['userId'], data['captionId']))
+            result = await setLike('caption', int(data['userId']), data['password'], int(data['captionId']), idempotencyKey=idempotencyKey)
 
-                cursor.execute("""
-                    UPDATE Caption
-                    SET likes = likes - 1
-                    WHERE id = ?
-                """, (data['captionId'],))
-            else:
-                # Like
-                cursor.execute("""
-                    INSERT INTO UserLikedCaptions (userId, captionId)
-                    VALUES (?, ?)
-                """, (data['userId'], data['captionId']))
+            return {
+                'status': 'green',
+                'message': 'Caption like updated successfully',
+                'data': result
+            }
 
-                cursor.execute("""
-                    UPDATE Caption
-                    SET likes = likes + 1
-                    WHERE id = ?
-                """, (data['captionId'],))
+        except HTTPException:
+            raise
+        except Exception as e:
+            raise HTTPException(status_code=status_codes.HTTP_400_BAD_REQUEST, detail=f"ERROR: {e}")
 
-            connection.commit()
-            connection.close()
+
+    @put("/{captionId:int}/like", status_code=status_codes.HTTP_200_OK)
+    async def putCaptionLike(self, captionId: int, data: DT_LikeSet, idempotencyKey: Optional[str] = Parameter(header='Idempotency-Key', default=None)) -> dict:
+        try:
+            result = await setLike('caption', data.userId, data.password, captionId, liked=True, idempotencyKey=idempotencyKey)
 
             return {
                 'status': 'green',
-                'message': 'Caption like updated successfully'
+                'message': 'Caption liked',
+                'data': result
             }
 
+        except HTTPException:
+            raise
+        except Exception as e:
+            raise HTTPException(status_code=status_codes.HTTP_400_BAD_REQUEST, detail=f"ERROR: {e}")
+
+
+    @delete("/{captionId:int}/like", status_code=status_codes.HTTP_200_OK)
+    async def deleteCaptionLike(self, captionId: int, data: DT_LikeSet, idempotencyKey: Optional[str] = Parameter(header='Idempotency-Key', default=None)) -> dict:
+        try:
+            result = await setLike('caption', data.userId, data.password, captionId, liked=False, idempotencyKey=idempotencyKey)
+
+            return {
+                'status': 'green',
+                'message': 'Caption unliked',
+                'data': result
+            }
+
+        except HTTPException:
+            raise
         except Exception as e:
             raise HTTPException(status_code=status_codes.HTTP_400_BAD_REQUEST, detail=f"ERROR: {e}")
 
@@ -273,84 +260,95 @@ class Controller_Caption(Controller):
             userId = captionIdUserIdPassword[1]
             password = captionIdUserIdPassword[2]
 
-            connection = sqlite3.connect('CapRank.db')
-            cursor = connection.cursor()
-            cursor.execute("PRAGMA foreign_keys = ON;")
-
-
-            cursor.execute("""
-                SELECT * 
-                FROM User 
-                WHERE id = ? AND password = ? 
-            """, (userId, password))
+            def deleteCaptionRow(cursor):
+                cursor.execute("""
+                    SELECT * 
+                    FROM LiveUser 
+                    WHERE id = ? AND password = ? 
+                """, (userId, password))
             
-            queriedUser = cursor.fetchone()
+                queriedUser = cursor.fetchone()
 
-            if queriedUser == None:
-                raise HTTPException(status_code=status_codes.HTTP_404_NOT_FOUND, detail="Unauthorized to delete caption")
+                if queriedUser == None:
+                    raise HTTPException(status_code=status_codes.HTTP_404_NOT_FOUND, detail="Unauthorized to delete caption")
             
             
-            cursor.execute("""
-                SELECT * 
-                FROM Caption 
-                WHERE id = ? AND userId = ? 
-            """, (captionId, userId))
+                cursor.execute("""
+                    SELECT * 
+                    FROM LiveCaption 
+                    WHERE id = ? AND userId = ? 
+                """, (captionId, userId))
             
-            queriedCaption = cursor.fetchone()
+                queriedCaption = cursor.fetchone()
 
-            if queriedCaption is None:
-                raise HTTPException(status_code=status_codes.HTTP_404_NOT_FOUND, detail="Unable to delete someone else caption")
+                if queriedCaption is None and queries.hasArchive(cursor):
+                    cursor.execute("""
+                        SELECT c.postId
+                        FROM archive.Caption c
+                        JOIN archive.Post p ON p.id = c.postId
+                        WHERE c.id = ? AND c.userId = ? AND p.deleted_at IS NULL
+                    """, (captionId, userId))
+
+                    archivedCaption = cursor.fetchone()
+                    if archivedCaption is not None:
+                        deleteArchivedCaption(cursor, int(captionId), archivedCaption[0])
+                        return
+
+                if queriedCaption is None:
+                    raise HTTPException(status_code=status_codes.HTTP_404_NOT_FOUND, detail="Unable to delete someone else caption")
             
-            cursor.execute("""
-                SELECT postId 
-                FROM Caption 
-                WHERE id = ?
-            """, (captionId,))
+                cursor.execute("""
+                    SELECT postId 
+                    FROM Caption 
+                    WHERE id = ?
+                """, (captionId,))
             
-            postId = cursor.fetchone()[0]
+                postId = cursor.fetchone()[0]
             
-            cursor.execute("""
-                SELECT topCaptionId 
-                FROM Post 
-                WHERE id = ?
-            """, (postId,))
+                cursor.execute("""
+                    SELECT topCaptionId 
+                    FROM Post 
+                    WHERE id = ?
+                """, (postId,))
             
-            topCaptionId = cursor.fetchone()[0]
+                topCaptionId = cursor.fetchone()[0]
 
-            cursor.execute("""
-                DELETE FROM Caption 
-                WHERE id = ?
-            """, (captionId,))
-            
-            if str(topCaptionId) == captionId:
+                cursor.execute("""
+                    DELETE FROM Caption 
+                    WHERE id = ?
+                """, (captionId,))
 
+                recordChange(cursor, 'caption', captionId)
+                recordChange(cursor, 'post', postId)
+            
+                if str(topCaptionId) == captionId:
 
-                cursor.execute("""
-                    SELECT id 
-                    FROM Caption 
-                    WHERE postId = ? 
-                    ORDER BY likes DESC 
-                    LIMIT 1
-                """, (postId,))
-                
-                newTopCaption = cursor.fetchone()
 
-                
-                if newTopCaption is None:
                     cursor.execute("""
-                        UPDATE Post 
-                        SET topCaptionId = NULL 
-                        WHERE id = ?
+                        SELECT id 
+                        FROM LiveCaption 
+                        WHERE postId = ? 
+                        ORDER BY likes DESC 
+                        LIMIT 1
                     """, (postId,))
-                else:
-                    cursor.execute("""
-                        UPDATE Post 
-                        SET topCaptionId = ? 
-                        WHERE id = ?
-                    """, (newTopCaption[0], postId))
+                
+                    newTopCaption = cursor.fetchone()
 
-            connection.commit()
-            connection.close()
+                
+                    if newTopCaption is None:
+                        cursor.execute("""
+                            UPDATE Post 
+                            SET topCaptionId = NULL 
+                            WHERE id = ?
+                        """, (postId,))
+                    else:
+                        cursor.execute("""
+                            UPDATE Post 
+                            SET topCaptionId = ? 
+                            WHERE id = ?
+                        """, (newTopCaption[0], postId))
+
+            await database.write(deleteCaptionRow)
 
             return {
                 'status': 'green',
@@ -368,97 +366,15 @@ class Controller_Caption(Controller):
     async def updateCaptionLikes(self, captionIdUserIdPassword: str) -> dict:
 
         try:
-            captionIdUserIdPassword = captionIdUserIdPassword.split('_')
-
-            connection = sqlite3.connect('CapRank.db')
-            cursor = connection.cursor()
-            cursor.execute("PRAGMA foreign_keys = ON;")
-
-
-
-            cursor.execute("""
-                SELECT *
-                FROM User
-                WHERE id = ? and password = ?
-            """, (captionIdUserIdPassword[1], captionIdUserIdPassword[2]))
-
-            queriedUser = cursor.fetchone()
-
-            if queriedUser == None:
-                raise HTTPException(status_code=status_codes.HTTP_404_NOT_FOUND, detail="Unauthorized to delete caption")
-                
-            
-            cursor.execute("""
-                SELECT *
-                FROM Caption
-                WHERE id = ?
-            """, (captionIdUserIdPassword[0],))
-
-            queriedCaption = cursor.fetchone()
-
-            if queriedCaption == None:
-                raise HTTPException(status_code=status_codes.HTTP_404_NOT_FOUND, detail="no caption with that id")
-                
-
-            cursor.execute("""
-                SELECT *
-                FROM UserLikedCaptions
-                WHERE userId = ? and captionId = ?
-            """, (captionIdUserIdPassword[1], captionIdUserIdPassword[0]))
-
-
-
-            queriedLikedCaptions = cursor.fetchone()
-
-            if queriedLikedCaptions == None:
-                
-                cursor.execute("""
-                    UPDATE Caption
-                    SET likes = likes + 1
-                    WHERE id = ?
-                """, (captionIdUserIdPassword[0],))
-
-                cursor.execute("""
-                    INSERT INTO
-                    UserLikedCaptions (userId, captionId)
-                        Values(?,?)
-                """, (captionIdUserIdPassword[1], captionIdUserIdPassword[0]))
-
-
-            else:
-                cursor.execute("""
-                    UPDATE Caption
-                    SET likes = likes - 1
-                    WHERE id = ?
-                """, (captionIdUserIdPassword[0],))
-
-                cursor.execute("""
-                    DELETE FROM UserLikedCaptions
-                    WHERE userId = ? and postId = ?
-                """, (captionIdUserIdPassword[1], captionIdUserIdPassword[0]))
-
-
-            cursor.execute("SELECT *  FROM Caption where postId = ?", (queriedCaption[1],))
-            queriedPost = cursor.fetchone()
-
-
-            cursor.execute("SELECT id FROM Caption WHERE postId + ? Order by likes DESC LIMIT 1", (queriedCaption[1]))
-
-            highestLikedCaptionId = cursor.fetchone()
-
-            if highestLikedCaptionId == captionIdUserIdPassword[0] and queriedPost[5] != highestLikedCaptionId:
-                cursor.execute("Update Post SET topCaptionId = ? Where id = ?", (queriedCaption[0], queriedCaption[1]))
-
-
-            connection.commit()
-            connection.close()
+            captionId, userId, password = captionIdUserIdPassword.split('_', 2)
 
+            await setLike('caption', int(userId), password, int(captionId), refreshTopCaption=True)
 
             return {
                 'status': 'green',
                 'message': 'Caption updated successfully'
             }
-        
+
 
         except Exception as e:
             raise HTTPException(status_code=status_codes.HTTP_404_NOT_FOUND, detail=f"ERROR: {e}")
@@ -467,40 +383,7 @@ class Controller_Caption(Controller):
     @post("/comment", status_code=status_codes.HTTP_201_CREATED)
     async def addComment(self, data: DT_CommentCreate) -> dict:
         try:
-            connection = sqlite3.connect('CapRank.db')
-            cursor = connection.cursor()
-
-            # Verify user credentials
-            cursor.execute("""
-                SELECT *
-                FROM User
-                WHERE id = ? AND password = ?
-            """, (data.userId, data.password))
-
-            user = cursor.fetchone()
-            if not user:
-                raise HTTPException(status_code=status_codes.HTTP_401_UNAUTHORIZED, detail="Invalid credentials")
-
-            # Verify caption exists
-            cursor.execute("""
-                SELECT *
-                FROM Caption
-                WHERE id = ?
-            """, (data.captionId,))
-
-            caption = cursor.fetchone()
-            if not caption:
-                raise HTTPException(status_code=status_codes.HTTP_404_NOT_FOUND, detail="Caption not found")
-
-            # Create comment
-            cursor.execute("""
-                INSERT INTO CaptionComments (captionId, userId, text)
-                VALUES (?, ?, ?)
-            """, (data.captionId, data.userId, data.text))
-
-            comment_id = cursor.lastrowid
-            connection.commit()
-            connection.close()
+            comment_id = await database.write(lambda cursor: insertComment(cursor, data.captionId, data.userId, data.password, data.text, data.parentId))
 
             return {
                 'status': 'green',
@@ -510,46 +393,106 @@ class Controller_Caption(Controller):
                 }
             }
 
+        except HTTPException:
+            raise
         except Exception as e:
             raise HTTPException(status_code=status_codes.HTTP_400_BAD_REQUEST, detail=f"ERROR: {e}")
-            
+
+
+    # /captions/comments/captionId?limit=50&after=lastCommentId&withReplies=true
     @get("/comments/{captionId:int}", status_code=status_codes.HTTP_200_OK)
-    async def getComments(self, captionId: int) -> dict:
+    async def getComments(self, captionId: int, limit: int = DEFAULT_COMMENT_PAGE_SIZE, after: Optional[int] = None,
+                          withReplies: bool = False, replyDepth: int = 1) -> dict:
         try:
-            connection = sqlite3.connect('CapRank.db')
-            cursor = connection.cursor()
-
-            # Verify caption exists
-            cursor.execute("""
-                SELECT *
-                FROM Caption
-                WHERE id = ?
-            """, (captionId,))
-
-            caption = cursor.fetchone()
-            if not caption:
-                raise HTTPException(status_code=status_codes.HTTP_404_NOT_FOUND, detail="Caption not found")
-
-            # Get comments
-            cursor.execute("""
-                SELECT cc.id, cc.captionId, cc.userId, u.username, cc.text, cc.created_at
-                FROM CaptionComments cc
-                JOIN User u ON cc.userId = u.id
-                WHERE cc.captionId = ?
-                ORDER BY cc.created_at ASC
-            """, (captionId,))
-
-            comments = cursor.fetchall()
-            connection.close()
+            if not 1 <= limit <= MAX_COMMENT_PAGE_SIZE:
+                raise HTTPException(status_code=status_codes.HTTP_400_BAD_REQUEST, detail=f"limit must be between 1 and {MAX_COMMENT_PAGE_SIZE}")
+
+            if not 1 <= replyDepth <= MAX_REPLY_DEPTH:
+                raise HTTPException(status_code=status_codes.HTTP_400_BAD_REQUEST, detail=f"replyDepth must be between 1 and {MAX_REPLY_DEPTH}")
+
+            def fetchComments(cursor):
+                # The caption and one page of its top level comments in one query, continuing
+                # after the (created_at, id) of the last comment the client has
+                afterFilter = """
+                    AND (cc.created_at, cc.id) > ((SELECT created_at FROM CaptionComments WHERE id = ?), ?)
+                """ if after is not None else ""
+                pageSql = f"""
+                    SELECT c.commentCount, page.id, page.captionId, page.userId, page.username, page.text, page.created_at, page.parentId
+                    FROM LiveCaption c
+                    LEFT JOIN (
+                        SELECT cc.id, cc.captionId, cc.userId, u.username, cc.text, cc.created_at, cc.parentId
+                        FROM CaptionComments cc
+                        JOIN LiveUser u ON cc.userId = u.id
+                        WHERE cc.captionId = ? AND cc.parentId IS NULL
+                            {afterFilter}
+                        ORDER BY cc.created_at ASC, cc.id ASC
+                        LIMIT ?
+                    ) page ON page.captionId = c.id
+                    WHERE c.id = ?
+                    ORDER BY page.created_at ASC, page.id ASC
+                """
+                pageParameters = (captionId, *([after, after] if after is not None else []), limit + 1, captionId)
+
+                rows = cursor.execute(pageSql, pageParameters).fetchall()
+
+                # A caption of an archived post has its comments in the archive too
+                archived = not rows and queries.hasArchive(cursor)
+                if archived:
+                    rows = cursor.execute(queries.archivedSql(pageSql), pageParameters).fetchall()
+
+                if not rows:
+                    raise HTTPException(status_code=status_codes.HTTP_404_NOT_FOUND, detail="Caption not found")
+
+                commentCount = rows[0][0]
+                comments = [row[1:] for row in rows if row[1] is not None]
+
+                hasMore = len(comments) > limit
+                comments = comments[:limit]
+
+                replies = []
+                if withReplies and comments:
+                    # Replies under this page only, at most replyDepth levels and MAX_REPLIES_PER_PAGE rows
+                    placeholders = ', '.join('?' for _ in comments)
+                    repliesSql = f"""
+                        WITH RECURSIVE thread (id, depth) AS (
+                            SELECT id, 1
+                            FROM CaptionComments
+                            WHERE parentId IN ({placeholders})
+
+                            UNION ALL
+
+                            SELECT cc.id, thread.depth + 1
+                            FROM CaptionComments cc
+                            JOIN thread ON cc.parentId = thread.id
+                            WHERE thread.depth < ?
+                        )
+                        SELECT cc.id, cc.captionId, cc.userId, u.username, cc.text, cc.created_at, cc.parentId
+                        FROM thread
+                        JOIN CaptionComments cc ON cc.id = thread.id
+                        JOIN LiveUser u ON cc.userId = u.id
+                        ORDER BY thread.depth ASC, cc.created_at ASC, cc.id ASC
+                        LIMIT ?
+                    """
+                    if archived:
+                        repliesSql = queries.archivedSql(repliesSql)
+
+                    cursor.execute(repliesSql, (*[comment[0] for comment in comments], replyDepth, MAX_REPLIES_PER_PAGE))
+                    replies = cursor.fetchall()
+
+                return commentCount, comments, hasMore, replies
+
+            commentCount, comments, hasMore, replies = await database.read(fetchComments)
 
             return {
                 'status': 'green',
                 'message': 'Comments retrieved successfully',
-                'data': comments
+                'data': comments,
+                'replies': replies,
+                'commentCount': commentCount,
+                'nextAfter': comments[-1][0] if hasMore else None
             }
 
+        except HTTPException:
+            raise
         except Exception as e:
             raise HTTPException(status_code=status_codes.HTTP_400_BAD_REQUEST, detail=f"ERROR: {e}")
-
-
-
@@ -0,0 +1,42 @@
+from litestar import Controller, get, status_codes
+from litestar.exceptions import HTTPException
+from litestar.response import Stream
+from typing import Optional
+
+from src.modules.export import EXPORT_TABLES, EXPORT_FORMATS, exportRows, normalizeSince
+
+
+class Controller_Export(Controller):
+    """
+    Whole tables as NDJSON or CSV, streamed straight from the cursor.
+
+    Rows are fetched and encoded a batch at a time as the client reads them, so exporting
+    millions of captions costs the server one batch of memory rather than the whole table.
+    """
+
+    path = '/export'
+
+
+    # /export/captions?format=csv&since=2024-01-01&postId=42&afterId=1000
+    @get('/{table:str}', status_code=status_codes.HTTP_200_OK)
+    async def exportTable(self, table: str, format: str = 'ndjson', since: Optional[str] = None,
+                          postId: Optional[int] = None, afterId: Optional[int] = None) -> Stream:
+        if table not in EXPORT_TABLES:
+            raise HTTPException(status_code=status_codes.HTTP_404_NOT_FOUND, detail=f"No export for: {table}, choose one of {', '.join(EXPORT_TABLES)}")
+
+        if format not in EXPORT_FORMATS:
+            raise HTTPException(status_code=status_codes.HTTP_400_BAD_REQUEST, detail=f"format must be one of {', '.join(EXPORT_FORMATS)}")
+
+        if postId is not None and EXPORT_TABLES[table][2] is None:
+            raise HTTPException(status_code=status_codes.HTTP_400_BAD_REQUEST, detail=f"{table} can't be filtered by postId")
+
+        try:
+            since = normalizeSince(since) if since is not None else None
+        except ValueError:
+            raise HTTPException(status_code=status_codes.HTTP_400_BAD_REQUEST, detail="since must be an ISO date or time")
+
+        return Stream(
+            exportRows(table, format, since, postId, afterId),
+            media_type=EXPORT_FORMATS[format],
+            headers={'Content-Disposition': f'attachment; filename="{table}.{format}"'}
+        )
@@ -1,8 +1,11 @@
-from litestar import Controller, post, status_codes
+from litestar import Controller, get, post, status_codes
 from litestar.exceptions import HTTPException
-import sqlite3
 
 from src.modules.data_types import DT_UserRegister, DT_UserLogin
+from src.modules.database import database
+from src.modules.user_service import insertUser
+from src.modules.username_filter import usernameFilter
+from src.modules.user_suggest import userSuggestions
 
 
 class Controller_LoginAndRegister(Controller):
@@ -12,30 +15,13 @@ class Controller_LoginAndRegister(Controller):
     async def register(self, data: DT_UserRegister) -> dict:
         try:
 
-            connection = sqlite3.connect('CapRank.db')
-            cursor = connection.cursor()
+            userId = await database.write(lambda cursor: insertUser(cursor, data.username, data.name, data.password, data.profilePicture))
 
-
-            cursor.execute("""
-                SELECT *
-                FROM User
-                WHERE username = ?
-            """, (data.username,))
-
-
-            userQueried = cursor.fetchone()
-
-            if userQueried != None:
+            if userId is None:
                 raise HTTPException(status_code=status_codes.HTTP_400_BAD_REQUEST, detail="Username already exists, choose a differnet one")
 
-            cursor.execute("""
-                INSERT INTO
-                User (username, name, password, profilePicture)
-                    VALUES(?,?,?,?)
-            """, (data.username, data.name, data.password, data.profilePicture))
-
-            connection.commit()
-            connection.close()
+            usernameFilter.add(data.username)
+            userSuggestions.refreshSoon()
 
             return {
                 'status': 'green',
@@ -46,21 +32,38 @@ class Controller_LoginAndRegister(Controller):
             raise HTTPException(status_code=status_codes.HTTP_400_BAD_REQUEST, detail=f"ERROR: {e}")
 
 
+
+    # /register/available?username=someone
+    @get('/register/available', status_code=status_codes.HTTP_200_OK)
+    async def usernameAvailable(self, username: str) -> dict:
+        try:
+            return {
+                'status': 'green',
+                'message': 'Username availability checked',
+                'data': {
+                    'username': username,
+                    'available': await usernameFilter.isAvailable(username)
+                }
+            }
+
+        except Exception as e:
+            raise HTTPException(status_code=status_codes.HTTP_400_BAD_REQUEST, detail=f"ERROR: {e}")
+
+
     @post('/login', status_code=status_codes.HTTP_200_OK)
     async def login(self, data: DT_UserLogin) -> dict:
         try:
 
-            connection = sqlite3.connect('CapRank.db')
-            cursor = connection.cursor()
+            def fetchUser(cursor):
+                cursor.execute("""
+                    SELECT *
+                    FROM LiveUser
+                    WHERE username = ? and password = ?
+                """, (data.username, data.password))
 
-            cursor.execute("""
-                SELECT *
-                FROM User
-                WHERE username = ? and password = ?
-            """, (data.username, data.password))
+                return cursor.fetchone()
 
-            userQueried = cursor.fetchone()
-            connection.close()
+            userQueried = await database.read(fetchUser)
 
 
             if userQueried == None:
@@ -1,19 +1,33 @@
-from litestar import Controller, get, status_codes, post, patch, delete
+from litestar import Controller, get, status_codes, post, put, patch, delete
 from litestar.exceptions import HTTPException
-from litestar.params import Body
+from litestar.params import Body, Parameter
 from litestar.datastructures import UploadFile
 from litestar.response import Response
-import sqlite3
 
 import uuid
 import os
+import msgspec
 from pathlib import Path
+from datetime import timedelta
 from typing import Optional
 
-from src.modules.data_types import DT_PostCreate
+from src.modules.data_types import DT_PostCreate, DT_LikeSet
+from src.modules.database import database, timestampIn
+from src.modules.job_queue import enqueue, jobQueue, PRIORITY_LOW
+from src.modules.like_service import setLike
+from src.modules.response_cache import responseCache
+from src.modules import queries
+from src.modules.trending import trendingPosts, TRENDING_WINDOWS
+from src.modules.change_log import recordChange, recordChangesWhere
+from src.modules.image_index import imageIndex
+from src.modules.content_filter import contentFilter
+
 
 postImageFolder = 'src/user_post_images'
 
+DEFAULT_TRENDING_PAGE_SIZE = 20
+MAX_TRENDING_PAGE_SIZE = 100
+
 
 class Controller_Post(Controller):
 
@@ -21,22 +35,18 @@ class Controller_Post(Controller):
 
 
     @get("/{postId:int}", status_code=status_codes.HTTP_200_OK)
-    async def getPost(self, postId: int) -> dict:
+    async def getPost(self, postId: int, viewerId: Optional[int] = None) -> dict:
         try:
 
-            connection = sqlite3.connect('CapRank.db')
-            cursor = connection.cursor()
+            def fetchPost(cursor):
+                queriedPost = queries.POST_BY_ID.oneOrArchived(cursor, (postId,), viewerId)
 
-            cursor.execute("""
-                SELECT *
-                FROM Post
-                WHERE id = ?
-            """, (postId,))
+                if queriedPost == None:
+                    raise HTTPException(status_code=status_codes.HTTP_404_NOT_FOUND, detail=f"No post with id: {postId} found")
 
-            queriedPost = cursor.fetchone()
+                return queriedPost
 
-            if queriedPost == None:
-                raise HTTPException(status_code=status_codes.HTTP_404_NOT_FOUND, detail=f"No post with id: {postId} found")
+            queriedPost = await database.read(fetchPost)
             
             return {
                 'status': 'green',
@@ -49,20 +59,12 @@ class Controller_Post(Controller):
 
 
     @get("/{postId:int}/captions", status_code=status_codes.HTTP_200_OK)
-    async def getPostCaptions(self, postId: int) -> dict:
+    async def getPostCaptions(self, postId: int, viewerId: Optional[int] = None) -> dict:
         try:
-            connection = sqlite3.connect('CapRank.db')
-            cursor = connection.cursor()
-
-            cursor.execute("""
-                SELECT *
-                FROM Caption
-                WHERE postId = ?
-                ORDER BY likes DESC, created_at ASC
-            """, (postId,))
-
-            queriedCaptions = cursor.fetchall()
-            connection.close()
+            def fetchPostCaptions(cursor):
+                return queries.CAPTIONS_BY_POST.allOrArchived(cursor, (postId,), viewerId)
+
+            queriedCaptions = await database.read(fetchPostCaptions)
             
             return {
                 'status': 'green',
@@ -75,33 +77,70 @@ class Controller_Post(Controller):
 
 
     @get("/", status_code=status_codes.HTTP_200_OK)
-    async def getAllPosts(self, userId: Optional[int] = None) -> dict:
+    async def getAllPosts(self, userId: Optional[int] = None, viewerId: Optional[int] = None,
+        acceptEncoding: Optional[str] = Parameter(header='Accept-Encoding', default=None)
+    ) -> Response:
         try:
-            connection = sqlite3.connect('CapRank.db')
-            cursor = connection.cursor()
+            def fetchPosts(cursor):
+                if userId is not None:
+                    return queries.POSTS_WITH_USERNAME_BY_USER.allWithArchived(cursor, (userId,), viewerId)
 
-            if userId is not None:
-                cursor.execute("""
-                    SELECT p.*, u.username
-                    FROM Post p
-                    JOIN User u ON p.userId = u.id
-                    WHERE p.userId = ?
-                """, (userId,))
-            else:
-                cursor.execute("""
-                    SELECT p.*, u.username
-                    FROM Post p
-                    JOIN User u ON p.userId = u.id
-                """)
+                return queries.POSTS_WITH_USERNAME.allWithArchived(cursor, viewerId=viewerId)
+
+            async def queryPosts() -> dict:
+                return {
+                    'status': 'green',
+                    'message': 'Post queried successfully',
+                    'data': await database.read(fetchPosts)
+                }
+
+            # Without a viewer's liked flags the list is the same for every caller
+            if viewerId is None:
+                return await responseCache.respond(('posts', userId), queryPosts, acceptEncoding)
+
+            return Response(content=await queryPosts())
+        
+        except Exception as e:
+            raise HTTPException(status_code=status_codes.HTTP_404_NOT_FOUND, detail=f'ERROR: {e}')
+
+
+    # /post/trending?window=week&offset=20&limit=20
+    @get("/trending", status_code=status_codes.HTTP_200_OK)
+    async def getTrendingPosts(self, window: str = 'day', offset: int = 0, limit: int = DEFAULT_TRENDING_PAGE_SIZE) -> dict:
+        try:
+            if window not in TRENDING_WINDOWS:
+                raise HTTPException(status_code=status_codes.HTTP_400_BAD_REQUEST, detail=f"window must be one of: {', '.join(TRENDING_WINDOWS)}")
+
+            if offset < 0 or not 1 <= limit <= MAX_TRENDING_PAGE_SIZE:
+                raise HTTPException(status_code=status_codes.HTTP_400_BAD_REQUEST, detail=f"offset must be at least 0 and limit between 1 and {MAX_TRENDING_PAGE_SIZE}")
 
-            queriedPosts = cursor.fetchall()
+            ranked = await trendingPosts.page(window, offset, limit)
+
+            def fetchRankedPosts(cursor):
+                if not ranked:
+                    return []
+
+                posts = queries.postsWithUsernameByIds(len(ranked)).all(cursor, [postId for postId, _ in ranked])
+                postsById = {post.id: post for post in posts}
+
+                # Posts deleted since the leaderboard was built are left out
+                return [
+                    queries.TrendingPostRow(*msgspec.structs.astuple(postsById[postId]), windowLikes)
+                    for postId, windowLikes in ranked
+                    if postId in postsById
+                ]
+
+            trending = await database.read(fetchRankedPosts)
 
             return {
                 'status': 'green',
-                'message': 'Post queried successfully',
-                'data': queriedPosts
+                'message': 'Trending posts queried successfully',
+                'data': trending,
+                'nextOffset': offset + limit if len(ranked) == limit else None
             }
-        
+
+        except HTTPException:
+            raise
         except Exception as e:
             raise HTTPException(status_code=status_codes.HTTP_404_NOT_FOUND, detail=f'ERROR: {e}')
 
@@ -111,21 +150,26 @@ class Controller_Post(Controller):
     async def createPost(self, 
         data: DT_PostCreate = Body(media_type="multipart/form-data")
     ) -> dict:
+        image_path = None
         try:
             # Verify user credentials
-            connection = sqlite3.connect('CapRank.db')
-            cursor = connection.cursor()
+            def fetchUser(cursor):
+                cursor.execute("""
+                    SELECT *
+                    FROM LiveUser
+                    WHERE id = ? AND password = ?
+                """, (data.userId, data.password))
 
-            cursor.execute("""
-                SELECT *
-                FROM User
-                WHERE id = ? AND password = ?
-            """, (data.userId, data.password))
+                return cursor.fetchone()
+
+            user = await database.read(fetchUser)
 
-            user = cursor.fetchone()
             if not user:
                 raise HTTPException(status_code=status_codes.HTTP_401_UNAUTHORIZED, detail="Invalid credentials")
 
+            # Checked before the image is saved, as a rejected caption fails the whole post
+            caption_text = contentFilter.check(data.userCaptionText)
+
             # Create image directory if it doesn't exist
             os.makedirs(postImageFolder, exist_ok=True)
 
@@ -135,44 +179,78 @@ class Controller_Post(Controller):
             image_path = os.path.join(postImageFolder, image_name)
 
             # Save the image
+            image_bytes = await data.image.read()
             with open(image_path, 'wb') as f:
-                f.write(await data.image.read())
+                f.write(image_bytes)
 
-            # Insert post into database
-            cursor.execute("""
-                INSERT INTO Post (userId, imageName)
-                VALUES (?, ?)
-            """, (data.userId, image_name))
+            # Posts whose image looks like this one, such as reposts of the same meme
+            image_hash = await imageIndex.hash(image_bytes)
+            similar_posts = await imageIndex.similar(image_hash) if image_hash is not None else []
 
-            post_id = cursor.lastrowid
-
-            # If user provided a caption, create it
-            if data.userCaptionText:
+            def insertPost(cursor):
                 cursor.execute("""
-                    INSERT INTO Caption (postId, userId, text)
-                    VALUES (?, ?, ?)
-                """, (post_id, data.userId, data.userCaptionText))
+                    INSERT INTO Post (userId, imageName)
+                    VALUES (?, ?)
+                    RETURNING id
+                """, (data.userId, image_name))
 
-                caption_id = cursor.lastrowid
-                cursor.execute("""
-                    UPDATE Post
-                    SET topCaptionId = ?
-                    WHERE id = ?
-                """, (caption_id, post_id))
+                post_id = cursor.fetchone()[0]
+
+                # If user provided a caption, create it
+                if caption_text:
+                    cursor.execute("""
+                        INSERT INTO Caption (postId, userId, text)
+                        VALUES (?, ?, ?)
+                        RETURNING id
+                    """, (post_id, data.userId, caption_text))
+
+                    caption_id = cursor.fetchone()[0]
+                    cursor.execute("""
+                        UPDATE Post
+                        SET topCaptionId = ?, captionCount = 1
+                        WHERE id = ?
+                    """, (caption_id, post_id))
 
-            connection.commit()
-            connection.close()
+                    recordChange(cursor, 'caption', caption_id)
+
+                recordChange(cursor, 'post', post_id)
+
+                similar_post_ids = []
+                if image_hash is not None:
+                    imageIndex.recordHash(cursor, post_id, image_hash)
+
+                    if similar_posts:
+                        # The index may still hold posts deleted since it loaded them
+                        placeholders = ', '.join('?' for _ in similar_posts)
+                        cursor.execute(f"""
+                            SELECT id
+                            FROM LivePost
+                            WHERE id IN ({placeholders})
+                        """, [postId for postId, _ in similar_posts])
+                        livePostIds = {row[0] for row in cursor.fetchall()}
+                        similar_post_ids = [postId for postId, _ in similar_posts if postId in livePostIds]
+
+                return post_id, similar_post_ids
+
+            post_id, similar_post_ids = await database.write(insertPost)
+
+            if image_hash is not None:
+                imageIndex.add(post_id, image_hash)
 
             return {
                 'status': 'green',
                 'message': 'Post created successfully',
                 'data': {
                     'postId': post_id,
-                    'imageName': image_name
+                    'imageName': image_name,
+                    'similarPostIds': similar_post_ids
                 }
             }
 
         except Exception as e:
+            # Don't leave an image behind for a post that was never stored
+            if image_path and not isinstance(e, HTTPException) and os.path.exists(image_path):
+                os.remove(image_path)
             raise HTTPException(status_code=status_codes.HTTP_400_BAD_REQUEST, detail=f"ERROR: {e}")
 
 
@@ -185,26 +263,38 @@ class Controller_Post(Controller):
             postIdUserIdPassword = postIdUserIdPassword.split("_")
 
 
-            connection = sqlite3.connect('CapRank.db')
-            cursor = connection.cursor()
+            def deletePostRow(cursor):
+                cursor.execute("SELECT * FROM LiveUser WHERE id = ? and password = ? ", (postIdUserIdPassword[1], postIdUserIdPassword[2]))
+                queriedUser = cursor.fetchone()
 
-            cursor.execute("SELECT * FROM User WHERE id = ? and password = ? ", (postIdUserIdPassword[1], postIdUserIdPassword[2]))
-            queriedUser = cursor.fetchone()
-
-            if queriedUser == None:
-                raise HTTPException(status_code=status_codes.HTTP_404_NOT_FOUND, detail=f"Unathorized to delete")
+                if queriedUser == None:
+                    raise HTTPException(status_code=status_codes.HTTP_404_NOT_FOUND, detail=f"Unathorized to delete")
             
             
-            cursor.execute("SELECT * FROM Post WHERE id = ? and userId = ? ", (postIdUserIdPassword[0], postIdUserIdPassword[1]))
-            queriedPost = cursor.fetchone() 
-
-            if queriedPost == None:
-                raise HTTPException(status_code=status_codes.HTTP_404_NOT_FOUND, detail=f"Unathorized to delete someone else post")
+                cursor.execute("SELECT * FROM LivePost WHERE id = ? and userId = ? ", (postIdUserIdPassword[0], postIdUserIdPassword[1]))
+                queriedPost = cursor.fetchone() 
+
+                # An archived post is soft deleted where it lies, and purged from the archive
+                schema = ''
+                if queriedPost == None and queries.hasArchive(cursor):
+                    cursor.execute("SELECT * FROM archive.Post WHERE id = ? AND userId = ? AND deleted_at IS NULL", (postIdUserIdPassword[0], postIdUserIdPassword[1]))
+                    queriedPost = cursor.fetchone()
+                    schema = 'archive.'
+
+                if queriedPost == None:
+                    raise HTTPException(status_code=status_codes.HTTP_404_NOT_FOUND, detail=f"Unathorized to delete someone else post")
             
 
-            cursor.execute("DELETE FROM Post WHERE id = ?", (postIdUserIdPassword[0],))
-            connection.commit()
-            connection.close()
+                # Hide the post now; its captions, likes, comments and image are purged in the background
+                cursor.execute(f"UPDATE {schema}Post SET deleted_at = ? WHERE id = ?", (timestampIn(timedelta()), postIdUserIdPassword[0]))
+
+                recordChange(cursor, 'post', postIdUserIdPassword[0])
+                recordChangesWhere(cursor, 'caption', f"SELECT id FROM {schema}Caption WHERE postId = ?", (postIdUserIdPassword[0],))
+
+                enqueue(cursor, 'purgePost', {'postId': int(postIdUserIdPassword[0])}, priority=PRIORITY_LOW)
+
+            await database.write(deletePostRow)
+            jobQueue.wake()
             
 
             return {
@@ -219,64 +309,52 @@ class Controller_Post(Controller):
 
 
     @post("/like", status_code=status_codes.HTTP_200_OK)
-    async def likePost(self, data: dict) -> dict:
+    async def likePost(self, data: dict, idempotencyKey: Optional[str] = Parameter(header='Idempotency-Key', default=None)) -> dict:
         try:
-            connection = sqlite3.connect('CapRank.db')
-            cursor = connection.cursor()
+            result = await setLike('post', int(data['userId']), data['password'], int(data['postId']), idempotencyKey=idempotencyKey)
 
-            # Verify user credentials
-            cursor.execute("""
-                SELECT *
-                FROM User
-                WHERE id = ? AND password = ?
-            """, (data['userId'], data['password']))
+            return {
+                'status': 'green',
+                'message': 'Post like updated successfully',
+                'data': result
+            }
 
-            user = cursor.fetchone()
-            if not user:
-                raise HTTPException(status_code=status_codes.HTTP_401_UNAUTHORIZED, detail="Invalid credentials")
+        except HTTPException:
+            raise
+        except Exception as e:
+            raise HTTPException(status_code=status_codes.HTTP_400_BAD_REQUEST, detail=f"ERROR: {e}")
 
-            # Check if user already liked the post
-            cursor.execute("""
-                SELECT *
-                FROM UserLikedPosts
-                WHERE userId = ? AND postId = ?
-            """, (data['userId'], data['postId']))
 
-            existing_like = cursor.fetchone()
+    @put("/{postId:int}/like", status_code=status_codes.HTTP_200_OK)
+    async def putPostLike(self, postId: int, data: DT_LikeSet, idempotencyKey: Optional[str] = Parameter(header='Idempotency-Key', default=None)) -> dict:
+        try:
+            result = await setLike('post', data.userId, data.password, postId, liked=True, idempotencyKey=idempotencyKey)
 
-            if existing_like:
-                # Unlike
-                cursor.execute("""
-                    DELETE FROM UserLikedPosts
-                    WHERE userId = ? AND postId = ?
-                """, (data['userId'], data['postId']))
+            return {
+                'status': 'green',
+                'message': 'Post liked',
+                'data': result
+            }
 
-                cursor.execute("""
-                    UPDATE Post
-                    SET likes = likes - 1
-                    WHERE id = ?
-                """, (data['postId'],))
-            else:
-                # Like
-                cursor.execute("""
-                    INSERT INTO UserLikedPosts (userId, postId)
-                    VALUES (?, ?)
-                """, (data['userId'], data['postId']))
+        except HTTPException:
+            raise
+        except Exception as e:
+            raise HTTPException(status_code=status_codes.HTTP_400_BAD_REQUEST, detail=f"ERROR: {e}")
 
-                cursor.execute("""
-                    UPDATE Post
-                    SET likes = likes + 1
-                    WHERE id = ?
-                """, (data['postId'],))
 
-            connection.commit()
-            connection.close()
+    @delete("/{postId:int}/like", status_code=status_codes.HTTP_200_OK)
+    async def deletePostLike(self, postId: int, data: DT_LikeSet, idempotencyKey: Optional[str] = Parameter(header='Idempotency-Key', default=None)) -> dict:
+        try:
+            result = await setLike('post', data.userId, data.password, postId, liked=False, idempotencyKey=idempotencyKey)
 
             return {
                 'status': 'green',
-                'message': 'Post like updated successfully'
+                'message': 'Post unliked',
+                'data': result
             }
 
+        except HTTPException:
+            raise
         except Exception as e:
             raise HTTPException(status_code=status_codes.HTTP_400_BAD_REQUEST, detail=f"ERROR: {e}")
 
@@ -1,6 +1,9 @@
 from litestar import Controller, get, status_codes
 from litestar.exceptions import HTTPException
-import sqlite3
+from typing import Optional
+
+from src.modules.database import database
+from src.modules import queries
 
 class Controller_Redirect(Controller):
     """
@@ -11,21 +14,13 @@ class Controller_Redirect(Controller):
     path = '/posts'
     
     @get("/{postId:int}/captions", status_code=status_codes.HTTP_200_OK)
-    async def posts_captions(self, postId: int) -> dict:
+    async def posts_captions(self, postId: int, viewerId: Optional[int] = None) -> dict:
         """Handle requests to /posts/{id}/captions directly"""
         try:
-            connection = sqlite3.connect('CapRank.db')
-            cursor = connection.cursor()
-
-            cursor.execute("""
-                SELECT *
-                FROM Caption
-                WHERE postId = ?
-                ORDER BY likes DESC, created_at ASC
-            """, (postId,))
+            def fetchPostCaptions(cursor):
+                return queries.CAPTIONS_BY_POST.all(cursor, (postId,), viewerId)
 
-            queriedCaptions = cursor.fetchall()
-            connection.close()
+            queriedCaptions = await database.read(fetchPostCaptions)
             
             return {
                 'status': 'green',
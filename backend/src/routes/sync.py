@@ -0,0 +1,92 @@
+from litestar import Controller, get, status_codes
+from litestar.exceptions import HTTPException
+from typing import Optional
+
+from src.modules.database import database
+from src.modules import queries
+
+
+DEFAULT_SYNC_PAGE_SIZE = 500
+MAX_SYNC_PAGE_SIZE = 2000
+
+# Entity -> (key in the response, query loading rows of that entity by id)
+SYNC_ENTITIES = {
+    'post': ('posts', queries.postsWithUsernameByIds),
+    'caption': ('captions', queries.captionsWithUsernameByIds),
+    'user': ('users', queries.usersByIds),
+}
+
+
+class Controller_Sync(Controller):
+    """
+    Incremental sync for the client's local cache.
+
+    Every write that changes a post, caption or user appends to ChangeLog. A client passes
+    the nextSince of its last sync and gets every entity changed after it, each once and in
+    its current state: rows that still exist under 'posts', 'captions' and 'users', ids of
+    the ones that are gone under 'deleted'. Without since it is told to resync, meaning to
+    load the full lists once and continue from the nextSince it was given.
+    """
+
+    path = '/sync'
+
+
+    # /sync?since=1234&limit=500
+    @get('/', status_code=status_codes.HTTP_200_OK)
+    async def sync(self, since: Optional[int] = None, limit: int = DEFAULT_SYNC_PAGE_SIZE) -> dict:
+        try:
+            if (since is not None and since < 0) or not 1 <= limit <= MAX_SYNC_PAGE_SIZE:
+                raise HTTPException(status_code=status_codes.HTTP_400_BAD_REQUEST, detail=f"since must be at least 0 and limit between 1 and {MAX_SYNC_PAGE_SIZE}")
+
+            def fetchChanges(cursor):
+                changed = {key: [] for key, _ in SYNC_ENTITIES.values()}
+                deleted = {key: [] for key, _ in SYNC_ENTITIES.values()}
+
+                if since is None:
+                    cursor.execute("""
+                        SELECT COALESCE(MAX(seq), 0)
+                        FROM ChangeLog
+                    """)
+                    return changed, deleted, cursor.fetchone()[0], False
+
+                cursor.execute("""
+                    SELECT seq, entity, entityId
+                    FROM ChangeLog
+                    WHERE seq > ?
+                    ORDER BY seq
+                    LIMIT ?
+                """, (since, limit))
+                changes = cursor.fetchall()
+
+                # Compacted: an entity changed many times in this page is sent once, as it is now
+                for entity, (key, queryByIds) in SYNC_ENTITIES.items():
+                    entityIds = list(dict.fromkeys(entityId for _, changedEntity, entityId in changes if changedEntity == entity))
+                    if not entityIds:
+                        continue
+
+                    if entity == 'user':
+                        changed[key] = queryByIds(len(entityIds)).all(cursor, entityIds)
+                    else:
+                        # Archived posts and captions haven't gone anywhere as far as clients are concerned
+                        changed[key] = queries.byIdsWithArchived(cursor, queryByIds, entityIds)
+                    existingIds = {row.id for row in changed[key]}
+                    deleted[key] = [entityId for entityId in entityIds if entityId not in existingIds]
+
+                nextSince = changes[-1][0] if changes else since
+                return changed, deleted, nextSince, len(changes) == limit
+
+            changed, deleted, nextSince, hasMore = await database.read(fetchChanges)
+
+            return {
+                'status': 'green',
+                'message': 'Changes queried successfully',
+                'data': {**changed, 'deleted': deleted},
+                'nextSince': nextSince,
+                'hasMore': hasMore,
+                'resync': since is None
+            }
+
+        except HTTPException:
+            raise
+        except Exception as e:
+            raise HTTPException(status_code=status_codes.HTTP_404_NOT_FOUND, detail=f'ERROR: {e}')
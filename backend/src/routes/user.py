@@ -1,8 +1,22 @@
 from litestar import Controller, get,patch, status_codes, delete
 from litestar.exceptions import HTTPException
-import  sqlite3
+from litestar.params import Parameter
+from litestar.response import Response
 
 from src.modules.data_types import DT_UserUpdate, DT_UserDelete
+from src.modules.database import database, timestampIn
+from src.modules.job_queue import enqueue, jobQueue, PRIORITY_LOW
+from src.modules.response_cache import responseCache
+from src.modules import queries
+from src.modules.change_log import recordChange, recordChangesWhere
+from src.modules.user_suggest import userSuggestions, MAX_USER_SUGGESTIONS
+from src.modules.username_filter import usernameFilter
+
+from datetime import timedelta
+from typing import Optional
+
+DEFAULT_USER_SUGGESTIONS = 10
+MAX_SUGGEST_PREFIX_LENGTH = 30
 
 
 class Controller_User(Controller):
@@ -12,16 +26,10 @@ class Controller_User(Controller):
     async def getUser(self, userId: int) -> dict:
         try:
 
-            connection = sqlite3.connect('CapRank.db')
-            cursor = connection.cursor()
-            cursor.execute("""
-                SELECT id, username, name, profilePicture, created_at
-                FROM User
-                WHERE id = ?
-            """, (userId,))
+            def fetchUser(cursor):
+                return queries.USER_BY_ID.one(cursor, (userId,))
 
-            queriedUser = cursor.fetchone()
-            connection.close()
+            queriedUser = await database.read(fetchUser)
 
             if queriedUser == None:
                 raise HTTPException(status_code=status_codes.HTTP_404_NOT_FOUND, detail=f"No user with id: {userId} exists")
@@ -37,25 +45,20 @@ class Controller_User(Controller):
     
 
     @get('/', status_code=status_codes.HTTP_200_OK)
-    async def getAllUsers(self) -> dict:
+    async def getAllUsers(self, acceptEncoding: Optional[str] = Parameter(header='Accept-Encoding', default=None)) -> Response:
         try:
 
-            connection = sqlite3.connect('CapRank.db')
-            cursor = connection.cursor()
+            def fetchUsers(cursor):
+                return queries.ALL_USERS.all(cursor)
 
-            cursor.execute("""
-                SELECT id, username, name, profilePicture, created_at
-                FROM User
-            """)
+            async def queryUsers() -> dict:
+                return {
+                    'status': 'green',
+                    'message': 'User exists and queried',
+                    'data': await database.read(fetchUsers)
+                }
 
-            allQueriedUsers = cursor.fetchall()
-            connection.close()
-
-            return {
-                'status': 'green',
-                'message': 'User exists and queried',
-                'data': allQueriedUsers
-            }
+            return await responseCache.respond('users', queryUsers, acceptEncoding)
         
         except Exception as e:
             raise HTTPException(status_code=status_codes.HTTP_404_NOT_FOUND, detail=f"ERROR: {e}")
@@ -63,62 +66,91 @@ class Controller_User(Controller):
 
 
     
+    # /users/suggest?prefix=jo&limit=10
+    @get('/suggest', status_code=status_codes.HTTP_200_OK)
+    async def suggestUsers(self, prefix: str, limit: int = DEFAULT_USER_SUGGESTIONS) -> dict:
+        try:
+            if not 1 <= len(prefix) <= MAX_SUGGEST_PREFIX_LENGTH or not 1 <= limit <= MAX_USER_SUGGESTIONS:
+                raise HTTPException(status_code=status_codes.HTTP_400_BAD_REQUEST,
+                                    detail=f"prefix must be 1 to {MAX_SUGGEST_PREFIX_LENGTH} characters and limit between 1 and {MAX_USER_SUGGESTIONS}")
+
+            return {
+                'status': 'green',
+                'message': 'Users suggested',
+                'data': await userSuggestions.suggest(prefix, limit)
+            }
+
+        except HTTPException:
+            raise
+        except Exception as e:
+            raise HTTPException(status_code=status_codes.HTTP_400_BAD_REQUEST, detail=f"ERROR: {e}")
+
+
+
     @patch('/', status_code=status_codes.HTTP_200_OK)
     async def updateUser(self, data: DT_UserUpdate ) -> dict:
         try:
 
-            connection = sqlite3.connect('CapRank.db')
-            cursor = connection.cursor()
-            cursor.execute("""
-                SELECT *
-                FROM User
-                WHERE id = ? and password = ?
-            """, (data.userId, data.currentPassword))
+            def updateUserFields(cursor):
+                cursor.execute("""
+                    SELECT *
+                    FROM LiveUser
+                    WHERE id = ? and password = ?
+                """, (data.userId, data.currentPassword))
 
-            queriedUser = cursor.fetchone()
+                queriedUser = cursor.fetchone()
 
-            if queriedUser == None:
-                raise HTTPException(status_code=status_codes.HTTP_404_NOT_FOUND, detail="Password is incorrect")
+                if queriedUser == None:
+                    raise HTTPException(status_code=status_codes.HTTP_404_NOT_FOUND, detail="Password is incorrect")
             
 
-            updatValues = []
-            updateFields = []
+                updatValues = []
+                updateFields = []
 
-            if data.newUsername:
-                updatValues.append(data.newUsername)
-                updateFields.append("username = ?")
-            if data.newName:
-                updatValues.append(data.newName)
-                updateFields.append("name = ?")
-            if data.newPassword:
-                updatValues.append(data.newPassword)
-                updateFields.append("password = ?")
-            if data.newProfilePicture:
-                updatValues.append(data.newProfilePicture)
-                updateFields.append("profilePicture = ?")
+                if data.newUsername:
+                    updatValues.append(data.newUsername)
+                    updateFields.append("username = ?")
+                if data.newName:
+                    updatValues.append(data.newName)
+                    updateFields.append("name = ?")
+                if data.newPassword:
+                    updatValues.append(data.newPassword)
+                    updateFields.append("password = ?")
+                if data.newProfilePicture:
+                    updatValues.append(data.newProfilePicture)
+                    updateFields.append("profilePicture = ?")
 
 
-            updatValues.append(data.userId)
+                updatValues.append(data.userId)
 
 
-            commandUpdateUser = f"""
-                Update User
-                SET {', '.join(updateFields)}
-                WHERE id = ?
-            """
+                commandUpdateUser = f"""
+                    Update User
+                    SET {', '.join(updateFields)}
+                    WHERE id = ?
+                """
 
 
-            cursor.execute(commandUpdateUser, updatValues)
+                cursor.execute(commandUpdateUser, updatValues)
 
-            cursor.execute("""
-                SELECT username, name, profilePicture, created_at
-                FROM User
-                WHERE id = ?
-            """, (data.userId,))
-            
-            updatedUser = cursor.fetchone()
-            connection.commit()
-            connection.close()
+                recordChange(cursor, 'user', data.userId)
+                if data.newUsername:
+                    # Post and caption rows carry the username too
+                    recordChangesWhere(cursor, 'post', "SELECT id FROM Post WHERE userId = ?", (data.userId,))
+                    recordChangesWhere(cursor, 'caption', "SELECT id FROM Caption WHERE userId = ?", (data.userId,))
+
+                cursor.execute("""
+                    SELECT username, name, profilePicture, created_at
+                    FROM User
+                    WHERE id = ?
+                """, (data.userId,))
+
+                return cursor.fetchone()
+
+            updatedUser = await database.write(updateUserFields)
+            userSuggestions.refreshSoon()
+            if data.newUsername:
+                usernameFilter.add(data.newUsername)
 
 
             return {
@@ -136,29 +168,47 @@ class Controller_User(Controller):
     @delete('/', status_code=status_codes.HTTP_200_OK)
     async def deleteUser(self, data: DT_UserDelete) -> dict:
         try:
-            
-            connection = sqlite3.connect('CapRank.db')
-            cursor = connection.cursor()
-
-            cursor.execute("""
-                SELECT *
-                FROM User
-                WHERE id = ? and password = ?
-            """, (data.userId, data.password))
-
-            queriedUser = cursor.fetchone()
-
-            if queriedUser == None:
-                raise HTTPException(status_code=status_codes.HTTP_404_NOT_FOUND, detail="Password is incorrect")
-            
-            cursor.execute("""
-                DELETE FROM User
-                WHERE id = ?
-            """, (data.userId,))
-
 
-            connection.commit()
-            connection.close()
+            def deleteUserRow(cursor):
+                cursor.execute("""
+                    SELECT *
+                    FROM LiveUser
+                    WHERE id = ? and password = ?
+                """, (data.userId, data.password))
+
+                queriedUser = cursor.fetchone()
+
+                if queriedUser == None:
+                    raise HTTPException(status_code=status_codes.HTTP_404_NOT_FOUND, detail="Password is incorrect")
+
+                # Hide the user, their posts and captions now; the rows and images are purged in the background
+                cursor.execute("""
+                    UPDATE User
+                    SET deleted_at = ?
+                    WHERE id = ?
+                """, (timestampIn(timedelta()), data.userId))
+
+                # Their posts, the captions on those posts and their own captions all disappear with them
+                recordChange(cursor, 'user', data.userId)
+                recordChangesWhere(cursor, 'post', "SELECT id FROM Post WHERE userId = ?", (data.userId,))
+                recordChangesWhere(cursor, 'caption', """
+                    SELECT id FROM Caption WHERE userId = ?
+                    UNION
+                    SELECT c.id FROM Caption c JOIN Post p ON p.id = c.postId WHERE p.userId = ?
+                """, (data.userId, data.userId))
+                if queries.hasArchive(cursor):
+                    recordChangesWhere(cursor, 'post', "SELECT id FROM archive.Post WHERE userId = ?", (data.userId,))
+                    recordChangesWhere(cursor, 'caption', """
+                        SELECT id FROM archive.Caption WHERE userId = ?
+                        UNION
+                        SELECT c.id FROM archive.Caption c JOIN archive.Post p ON p.id = c.postId WHERE p.userId = ?
+                    """, (data.userId, data.userId))
+
+                enqueue(cursor, 'purgeUser', {'userId': data.userId}, priority=PRIORITY_LOW)
+
+            await database.write(deleteUserRow)
+            jobQueue.wake()
+            userSuggestions.refreshSoon()
 
 
             return {
@@ -0,0 +1,54 @@
+"""
+Production entry point: migrates the database once, then serves the API from several worker processes.
+
+    python -m src.server --workers 4 --port 8000
+"""
+
+import argparse
+import os
+
+
+def parseArguments():
+    parser = argparse.ArgumentParser(description="Run the CapRank API")
+    parser.add_argument('--host', default=os.environ.get('CAPRANK_HOST', '0.0.0.0'))
+    parser.add_argument('--port', type=int, default=int(os.environ.get('CAPRANK_PORT', '8000')))
+    parser.add_argument('--workers', type=int, default=int(os.environ.get('CAPRANK_WORKERS', os.cpu_count() or 1)),
+                        help="worker processes, defaults to one per core")
+    parser.add_argument('--database-url', default=None,
+                        help="overrides CAPRANK_DATABASE_URL for every worker")
+    parser.add_argument('--graceful-timeout', type=int, default=30,
+                        help="seconds in-flight requests get to finish on shutdown")
+    parser.add_argument('--skip-migrations', action='store_true',
+                        help="assume the schema is already up to date")
+    return parser.parse_args()
+
+
+def main():
+    arguments = parseArguments()
+
+    # Workers inherit the environment, so this is how they all get the same configuration
+    if arguments.database_url:
+        os.environ['CAPRANK_DATABASE_URL'] = arguments.database_url
+
+    # Imported only now so the database module picks up the url above
+    import uvicorn
+    from src.setupDatabase import migrateDatabase, MIGRATIONS_DONE_ENV
+
+    if not arguments.skip_migrations:
+        migrateDatabase()
+    os.environ[MIGRATIONS_DONE_ENV] = '1'
+
+    # Uvicorn stops accepting connections on SIGINT/SIGTERM, waits for in-flight requests
+    # and then runs the app's lifespan shutdown, which flushes likes and drains queued writes
+    uvicorn.run(
+        'src.app:app',
+        host=arguments.host,
+        port=arguments.port,
+        workers=max(arguments.workers, 1),
+        lifespan='on',
+        timeout_graceful_shutdown=arguments.graceful_timeout,
+    )
+
+
+if __name__ == '__main__':
+    main()
@@ -1,67 +1,530 @@
-import sqlite3
+import os
+from contextlib import contextmanager
+from datetime import timedelta
+
+from src.modules.database import database, timestampAgo
+
+
+# Held while migrating so only one process on the host runs the DDL
+MIGRATION_LOCK_PATH = os.environ.get('CAPRANK_MIGRATION_LOCK', 'CapRank.migrate.lock')
+
+# Set by the server CLI once it migrated, so the workers it starts skip straight to serving
+MIGRATIONS_DONE_ENV = 'CAPRANK_MIGRATIONS_DONE'
+
+# Arbitrary key for pg_advisory_xact_lock, serialising schema setup across API nodes
+POSTGRES_MIGRATION_LOCK_KEY = 4_711_230
+
+
+SQLITE_SCHEMA = """
+    CREATE TABLE IF NOT EXISTS User (
+        id INTEGER PRIMARY KEY AUTOINCREMENT,
+        username TEXT NOT NULL UNIQUE,
+        name TEXT NOT NULL,
+        password TEXT NOT NULL,
+        profilePicture TEXT,
+        created_at DATETIME DEFAULT CURRENT_TIMESTAMP
+    );
+
+    CREATE TABLE IF NOT EXISTS Post (
+        id INTEGER PRIMARY KEY AUTOINCREMENT,
+        userId INTEGER NOT NULL,
+        imageName TEXT NOT NULL,
+        created_at DATETIME DEFAULT CURRENT_TIMESTAMP,
+        likes INTEGER DEFAULT 0,
+        topCaptionId INTEGER,
+        
+        FOREIGN KEY (userId) REFERENCES User(id) ON DELETE CASCADE,
+        FOREIGN KEY (topCaptionId) REFERENCES Caption(id) ON DELETE SET NULL
+    );
+
+    CREATE TABLE IF NOT EXISTS Caption (
+        id INTEGER PRIMARY KEY AUTOINCREMENT,
+        postId INTEGER NOT NULL,
+        userId INTEGER NOT NULL,
+        text TEXT NOT NULL,
+        created_at DATETIME DEFAULT CURRENT_TIMESTAMP,
+        likes INTEGER DEFAULT 0,
+
+        FOREIGN KEY (postId) REFERENCES Post(id) ON DELETE CASCADE,
+        FOREIGN KEY (userId) REFERENCES User(id) ON DELETE CASCADE
+    );
+
+    CREATE TABLE IF NOT EXISTS UserLikedPosts (
+        userId INTEGER NOT NULL,
+        postId INTEGER NOT NULL,
+        created_at DATETIME DEFAULT CURRENT_TIMESTAMP,
+        
+        PRIMARY KEY (userId, postId),
+        FOREIGN KEY (userId) REFERENCES User(id) ON DELETE CASCADE,
+        FOREIGN KEY (postId) REFERENCES Post(id) ON DELETE CASCADE
+    );
+
+    CREATE TABLE IF NOT EXISTS UserLikedCaptions (
+        userId INTEGER NOT NULL,
+        captionId INTEGER NOT NULL,
+        created_at DATETIME DEFAULT CURRENT_TIMESTAMP,
+        
+        PRIMARY KEY (userId, captionId),
+        FOREIGN KEY (userId) REFERENCES User(id) ON DELETE CASCADE,
+        FOREIGN KEY (captionId) REFERENCES Caption(id) ON DELETE CASCADE
+    );
+
+    CREATE TABLE IF NOT EXISTS CaptionComments (
+        id INTEGER PRIMARY KEY AUTOINCREMENT,
+        captionId INTEGER,
+        userId INTEGER,
+        text TEXT,
+        created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+
+        FOREIGN KEY (captionId) REFERENCES Caption(id) ON DELETE CASCADE,
+        FOREIGN KEY (userId) REFERENCES User(id)
+    );
+
+    CREATE TABLE IF NOT EXISTS IdempotencyKey (
+        userId INTEGER NOT NULL,
+        key TEXT NOT NULL,
+        kind TEXT,
+        targetId INTEGER,
+        response TEXT NOT NULL,
+        created_at DATETIME DEFAULT CURRENT_TIMESTAMP,
+
+        PRIMARY KEY (userId, key)
+    );
+
+    CREATE TABLE IF NOT EXISTS Job (
+        id INTEGER PRIMARY KEY AUTOINCREMENT,
+        kind TEXT NOT NULL,
+        payload TEXT NOT NULL,
+        priority INTEGER NOT NULL DEFAULT 0,
+        status TEXT NOT NULL DEFAULT 'queued',
+        attempts INTEGER NOT NULL DEFAULT 0,
+        maxAttempts INTEGER NOT NULL DEFAULT 5,
+        runAfter DATETIME DEFAULT CURRENT_TIMESTAMP,
+        lastError TEXT,
+        created_at DATETIME DEFAULT CURRENT_TIMESTAMP
+    );
+
+    CREATE INDEX IF NOT EXISTS idx_Job_claim ON Job (status, priority, runAfter);
+
+    -- Likes per post per hour, summed over a window for the trending leaderboards
+    CREATE TABLE IF NOT EXISTS PostLikeBucket (
+        postId INTEGER NOT NULL,
+        bucket INTEGER NOT NULL,
+        likes INTEGER NOT NULL DEFAULT 0,
+
+        PRIMARY KEY (postId, bucket),
+        FOREIGN KEY (postId) REFERENCES Post(id) ON DELETE CASCADE
+    );
+
+    CREATE INDEX IF NOT EXISTS idx_PostLikeBucket_bucket ON PostLikeBucket (bucket, postId, likes);
+
+    -- 64 bit perceptual hash of each post's image, for spotting reposts of the same image
+    CREATE TABLE IF NOT EXISTS PostImageHash (
+        postId INTEGER PRIMARY KEY,
+        hash INTEGER NOT NULL,
+
+        FOREIGN KEY (postId) REFERENCES Post(id) ON DELETE CASCADE
+    );
+
+    -- Posts, captions and users in the order they changed, for GET /sync
+    CREATE TABLE IF NOT EXISTS ChangeLog (
+        seq INTEGER PRIMARY KEY AUTOINCREMENT,
+        entity TEXT NOT NULL,
+        entityId INTEGER NOT NULL,
+        created_at DATETIME DEFAULT CURRENT_TIMESTAMP
+    );
+
+    CREATE INDEX IF NOT EXISTS idx_ChangeLog_entity ON ChangeLog (entity, entityId, seq);
+
+    -- Foreign key lookups, so cascades and purges don't scan whole tables
+    CREATE INDEX IF NOT EXISTS idx_Post_userId ON Post (userId);
+    CREATE INDEX IF NOT EXISTS idx_Post_topCaptionId ON Post (topCaptionId);
+    CREATE INDEX IF NOT EXISTS idx_Caption_postId ON Caption (postId);
+    CREATE INDEX IF NOT EXISTS idx_Caption_userId ON Caption (userId);
+    CREATE INDEX IF NOT EXISTS idx_UserLikedPosts_postId ON UserLikedPosts (postId);
+    CREATE INDEX IF NOT EXISTS idx_UserLikedCaptions_captionId ON UserLikedCaptions (captionId);
+    -- Comment pages are read in (created_at, id) order per caption
+    DROP INDEX IF EXISTS idx_CaptionComments_captionId;
+    CREATE INDEX IF NOT EXISTS idx_CaptionComments_captionId_created ON CaptionComments (captionId, created_at, id);
+    CREATE INDEX IF NOT EXISTS idx_CaptionComments_userId ON CaptionComments (userId);
+
+    -- Lets the garbage collector check image files against posts a chunk at a time
+    CREATE INDEX IF NOT EXISTS idx_Post_imageName ON Post (imageName);
+"""
+
+
+# Same tables for PostgreSQL. Timestamps are kept as UTC text in SQLite's
+# CURRENT_TIMESTAMP format so both backends return identical rows.
+POSTGRES_SCHEMA = """
+    CREATE TABLE IF NOT EXISTS "User" (
+        id BIGINT GENERATED BY DEFAULT AS IDENTITY PRIMARY KEY,
+        username TEXT NOT NULL UNIQUE,
+        name TEXT NOT NULL,
+        password TEXT NOT NULL,
+        profilePicture TEXT,
+        created_at TEXT DEFAULT to_char(now() AT TIME ZONE 'UTC', 'YYYY-MM-DD HH24:MI:SS')
+    );
+
+    CREATE TABLE IF NOT EXISTS Post (
+        id BIGINT GENERATED BY DEFAULT AS IDENTITY PRIMARY KEY,
+        userId BIGINT NOT NULL REFERENCES "User"(id) ON DELETE CASCADE,
+        imageName TEXT NOT NULL,
+        created_at TEXT DEFAULT to_char(now() AT TIME ZONE 'UTC', 'YYYY-MM-DD HH24:MI:SS'),
+        likes INTEGER DEFAULT 0,
+        topCaptionId BIGINT,
+        captionCount INTEGER DEFAULT 0
+    );
+
+    CREATE TABLE IF NOT EXISTS Caption (
+        id BIGINT GENERATED BY DEFAULT AS IDENTITY PRIMARY KEY,
+        postId BIGINT NOT NULL REFERENCES Post(id) ON DELETE CASCADE,
+        userId BIGINT NOT NULL REFERENCES "User"(id) ON DELETE CASCADE,
+        text TEXT NOT NULL,
+        created_at TEXT DEFAULT to_char(now() AT TIME ZONE 'UTC', 'YYYY-MM-DD HH24:MI:SS'),
+        likes INTEGER DEFAULT 0
+    );
+
+    DO $$
+    BEGIN
+        IF NOT EXISTS (SELECT 1 FROM pg_constraint WHERE conname = 'post_topcaptionid_fkey') THEN
+            ALTER TABLE Post
+            ADD CONSTRAINT post_topcaptionid_fkey
+            FOREIGN KEY (topCaptionId) REFERENCES Caption(id) ON DELETE SET NULL;
+        END IF;
+    END $$;
+
+    CREATE TABLE IF NOT EXISTS UserLikedPosts (
+        userId BIGINT NOT NULL REFERENCES "User"(id) ON DELETE CASCADE,
+        postId BIGINT NOT NULL REFERENCES Post(id) ON DELETE CASCADE,
+        created_at TEXT DEFAULT to_char(now() AT TIME ZONE 'UTC', 'YYYY-MM-DD HH24:MI:SS'),
+
+        PRIMARY KEY (userId, postId)
+    );
+
+    CREATE TABLE IF NOT EXISTS UserLikedCaptions (
+        userId BIGINT NOT NULL REFERENCES "User"(id) ON DELETE CASCADE,
+        captionId BIGINT NOT NULL REFERENCES Caption(id) ON DELETE CASCADE,
+        created_at TEXT DEFAULT to_char(now() AT TIME ZONE 'UTC', 'YYYY-MM-DD HH24:MI:SS'),
+
+        PRIMARY KEY (userId, captionId)
+    );
+
+    CREATE TABLE IF NOT EXISTS CaptionComments (
+        id BIGINT GENERATED BY DEFAULT AS IDENTITY PRIMARY KEY,
+        captionId BIGINT REFERENCES Caption(id) ON DELETE CASCADE,
+        userId BIGINT REFERENCES "User"(id),
+        text TEXT,
+        created_at TEXT DEFAULT to_char(now() AT TIME ZONE 'UTC', 'YYYY-MM-DD HH24:MI:SS')
+    );
+
+    CREATE TABLE IF NOT EXISTS IdempotencyKey (
+        userId BIGINT NOT NULL,
+        key TEXT NOT NULL,
+        kind TEXT,
+        targetId BIGINT,
+        response TEXT NOT NULL,
+        created_at TEXT DEFAULT to_char(now() AT TIME ZONE 'UTC', 'YYYY-MM-DD HH24:MI:SS'),
+
+        PRIMARY KEY (userId, key)
+    );
+
+    CREATE TABLE IF NOT EXISTS Job (
+        id BIGINT GENERATED BY DEFAULT AS IDENTITY PRIMARY KEY,
+        kind TEXT NOT NULL,
+        payload TEXT NOT NULL,
+        priority INTEGER NOT NULL DEFAULT 0,
+        status TEXT NOT NULL DEFAULT 'queued',
+        attempts INTEGER NOT NULL DEFAULT 0,
+        maxAttempts INTEGER NOT NULL DEFAULT 5,
+        runAfter TEXT DEFAULT to_char(now() AT TIME ZONE 'UTC', 'YYYY-MM-DD HH24:MI:SS'),
+        lastError TEXT,
+        created_at TEXT DEFAULT to_char(now() AT TIME ZONE 'UTC', 'YYYY-MM-DD HH24:MI:SS')
+    );
+
+    CREATE INDEX IF NOT EXISTS idx_Job_claim ON Job (status, priority, runAfter);
+
+    CREATE TABLE IF NOT EXISTS PostLikeBucket (
+        postId BIGINT NOT NULL REFERENCES Post(id) ON DELETE CASCADE,
+        bucket INTEGER NOT NULL,
+        likes INTEGER NOT NULL DEFAULT 0,
+
+        PRIMARY KEY (postId, bucket)
+    );
+
+    CREATE INDEX IF NOT EXISTS idx_PostLikeBucket_bucket ON PostLikeBucket (bucket, postId, likes);
+
+    CREATE TABLE IF NOT EXISTS PostImageHash (
+        postId BIGINT PRIMARY KEY REFERENCES Post(id) ON DELETE CASCADE,
+        hash BIGINT NOT NULL
+    );
+
+    CREATE TABLE IF NOT EXISTS ChangeLog (
+        seq BIGINT GENERATED BY DEFAULT AS IDENTITY PRIMARY KEY,
+        entity TEXT NOT NULL,
+        entityId BIGINT NOT NULL,
+        created_at TEXT DEFAULT to_char(now() AT TIME ZONE 'UTC', 'YYYY-MM-DD HH24:MI:SS')
+    );
+
+    CREATE INDEX IF NOT EXISTS idx_ChangeLog_entity ON ChangeLog (entity, entityId, seq);
+
+    ALTER TABLE "User" ADD COLUMN IF NOT EXISTS deleted_at TEXT;
+    ALTER TABLE Post ADD COLUMN IF NOT EXISTS deleted_at TEXT;
+    ALTER TABLE CaptionComments ADD COLUMN IF NOT EXISTS parentId BIGINT REFERENCES CaptionComments(id) ON DELETE CASCADE;
+    ALTER TABLE IdempotencyKey ADD COLUMN IF NOT EXISTS kind TEXT;
+    ALTER TABLE IdempotencyKey ADD COLUMN IF NOT EXISTS targetId BIGINT;
+
+    DO $$
+    BEGIN
+        IF NOT EXISTS (SELECT 1 FROM information_schema.columns WHERE table_name = 'caption' AND column_name = 'commentcount') THEN
+            ALTER TABLE Caption ADD COLUMN commentCount INTEGER DEFAULT 0;
+            UPDATE Caption SET commentCount = (SELECT COUNT(*) FROM CaptionComments WHERE captionId = Caption.id);
+        END IF;
+    END $$;
+
+    CREATE INDEX IF NOT EXISTS idx_CaptionComments_parentId ON CaptionComments (parentId, created_at, id);
+
+    -- Foreign key lookups, so cascades and purges don't scan whole tables
+    CREATE INDEX IF NOT EXISTS idx_Post_userId ON Post (userId);
+    CREATE INDEX IF NOT EXISTS idx_Post_topCaptionId ON Post (topCaptionId);
+    CREATE INDEX IF NOT EXISTS idx_Caption_postId ON Caption (postId);
+    CREATE INDEX IF NOT EXISTS idx_Caption_userId ON Caption (userId);
+    CREATE INDEX IF NOT EXISTS idx_UserLikedPosts_postId ON UserLikedPosts (postId);
+    CREATE INDEX IF NOT EXISTS idx_UserLikedCaptions_captionId ON UserLikedCaptions (captionId);
+    -- Comment pages are read in (created_at, id) order per caption
+    DROP INDEX IF EXISTS idx_CaptionComments_captionId;
+    CREATE INDEX IF NOT EXISTS idx_CaptionComments_captionId_created ON CaptionComments (captionId, created_at, id);
+    CREATE INDEX IF NOT EXISTS idx_CaptionComments_userId ON CaptionComments (userId);
+
+    -- Lets the garbage collector check image files against posts a chunk at a time
+    CREATE INDEX IF NOT EXISTS idx_Post_imageName ON Post (imageName);
+"""
+
+
+# Columns added after the first release, appended to existing SQLite tables
+SQLITE_ADDED_COLUMNS = [
+    ('Post', 'captionCount', 'INTEGER DEFAULT 0'),
+    ('Post', 'deleted_at', 'DATETIME'),
+    ('User', 'deleted_at', 'DATETIME'),
+    ('Caption', 'commentCount', 'INTEGER DEFAULT 0'),
+    ('CaptionComments', 'parentId', 'INTEGER REFERENCES CaptionComments(id) ON DELETE CASCADE'),
+    ('IdempotencyKey', 'kind', 'TEXT'),
+    ('IdempotencyKey', 'targetId', 'INTEGER'),
+]
+
+# Fills a newly added column in from existing rows
+SQLITE_COLUMN_BACKFILLS = {
+    ('Caption', 'commentCount'): """
+        UPDATE Caption
+        SET commentCount = (SELECT COUNT(*) FROM CaptionComments WHERE captionId = Caption.id)
+    """,
+}
+
+# Indexes on added columns, created once the columns exist
+SQLITE_ADDED_COLUMN_INDEXES = """
+    CREATE INDEX IF NOT EXISTS idx_CaptionComments_parentId ON CaptionComments (parentId, created_at, id);
+"""
+
+
+# Soft deleted users and posts stay in their tables until the purge job gets to them.
+# Reads go through these views so they never see them, nor anything hanging off them.
+LIVE_VIEWS = """
+    DROP VIEW IF EXISTS LiveCaption;
+    DROP VIEW IF EXISTS LivePost;
+    DROP VIEW IF EXISTS LiveUser;
+
+    CREATE VIEW LiveUser AS
+        SELECT id, username, name, password, profilePicture, created_at
+        FROM User
+        WHERE deleted_at IS NULL;
+
+    CREATE VIEW LivePost AS
+        SELECT p.id, p.userId, p.imageName, p.created_at, p.likes, p.topCaptionId, p.captionCount
+        FROM Post p
+        JOIN User u ON u.id = p.userId
+        WHERE p.deleted_at IS NULL AND u.deleted_at IS NULL;
+
+    CREATE VIEW LiveCaption AS
+        SELECT c.id, c.postId, c.userId, c.text, c.created_at, c.likes, c.commentCount
+        FROM Caption c
+        JOIN LivePost p ON p.id = c.postId
+        JOIN User u ON u.id = c.userId
+        WHERE u.deleted_at IS NULL;
+"""
+
+
+# Posts moved out of the hot tables by src.modules.archive, with everything hanging off them.
+# Columns as in the hot tables; no foreign keys, as the users they refer to stay in the main database.
+SQLITE_ARCHIVE_SCHEMA = """
+    CREATE TABLE IF NOT EXISTS archive.Post (
+        id INTEGER PRIMARY KEY,
+        userId INTEGER NOT NULL,
+        imageName TEXT NOT NULL,
+        created_at DATETIME,
+        likes INTEGER DEFAULT 0,
+        topCaptionId INTEGER,
+        captionCount INTEGER DEFAULT 0,
+        deleted_at DATETIME,
+        archived_at DATETIME DEFAULT CURRENT_TIMESTAMP
+    );
+
+    CREATE TABLE IF NOT EXISTS archive.Caption (
+        id INTEGER PRIMARY KEY,
+        postId INTEGER NOT NULL,
+        userId INTEGER NOT NULL,
+        text TEXT NOT NULL,
+        created_at DATETIME,
+        likes INTEGER DEFAULT 0,
+        commentCount INTEGER DEFAULT 0
+    );
+
+    CREATE TABLE IF NOT EXISTS archive.UserLikedPosts (
+        userId INTEGER NOT NULL,
+        postId INTEGER NOT NULL,
+        created_at DATETIME,
+
+        PRIMARY KEY (userId, postId)
+    );
+
+    CREATE TABLE IF NOT EXISTS archive.UserLikedCaptions (
+        userId INTEGER NOT NULL,
+        captionId INTEGER NOT NULL,
+        created_at DATETIME,
+
+        PRIMARY KEY (userId, captionId)
+    );
+
+    CREATE TABLE IF NOT EXISTS archive.CaptionComments (
+        id INTEGER PRIMARY KEY,
+        captionId INTEGER,
+        userId INTEGER,
+        text TEXT,
+        created_at TIMESTAMP,
+        parentId INTEGER
+    );
+
+    CREATE TABLE IF NOT EXISTS archive.PostImageHash (
+        postId INTEGER PRIMARY KEY,
+        hash INTEGER NOT NULL
+    );
+
+    CREATE INDEX IF NOT EXISTS archive.idx_Post_userId ON Post (userId);
+    CREATE INDEX IF NOT EXISTS archive.idx_Post_imageName ON Post (imageName);
+    CREATE INDEX IF NOT EXISTS archive.idx_Caption_postId ON Caption (postId);
+    CREATE INDEX IF NOT EXISTS archive.idx_UserLikedPosts_postId ON UserLikedPosts (postId);
+    CREATE INDEX IF NOT EXISTS archive.idx_UserLikedCaptions_captionId ON UserLikedCaptions (captionId);
+    CREATE INDEX IF NOT EXISTS archive.idx_CaptionComments_captionId_created ON CaptionComments (captionId, created_at, id);
+    CREATE INDEX IF NOT EXISTS archive.idx_CaptionComments_parentId ON CaptionComments (parentId, created_at, id);
+"""
+
+
+def setupSQLiteSchema(cursor):
+    cursor.execute("PRAGMA foreign_keys = ON;")
+
+    # WAL lets the read pool keep reading while the single writer commits
+    # Fetched so the statement is finished before the DROP INDEX in the schema runs
+    cursor.execute("PRAGMA journal_mode = WAL;").fetchone()
+
+    cursor.executescript(SQLITE_SCHEMA)
+
+    # Older databases get newer columns appended; captionCount used to be added lazily by createCaption
+    for table, column, definition in SQLITE_ADDED_COLUMNS:
+        cursor.execute("""
+            SELECT COUNT(*)
+            FROM pragma_table_info(?)
+            WHERE name = ?
+        """, (table, column))
+        if cursor.fetchone()[0] == 0:
+            cursor.execute(f"""
+                ALTER TABLE {table}
+                ADD COLUMN {column} {definition}
+            """)
+            if (table, column) in SQLITE_COLUMN_BACKFILLS:
+                cursor.execute(SQLITE_COLUMN_BACKFILLS[(table, column)])
+
+    cursor.executescript(SQLITE_ADDED_COLUMN_INDEXES)
+
+    cursor.executescript(LIVE_VIEWS)
+
+
+def setupSQLiteArchive(cursor, archiveName: str):
+    cursor.execute("ATTACH DATABASE ? AS archive", (archiveName,))
+    cursor.execute("PRAGMA archive.journal_mode = WAL;").fetchone()
+    cursor.executescript(SQLITE_ARCHIVE_SCHEMA)
+    cursor.execute("DETACH DATABASE archive")
+
+
+def setupPostgresSchema(cursor):
+    # CREATE ... IF NOT EXISTS is not safe to run concurrently in PostgreSQL
+    cursor.execute("SELECT pg_advisory_xact_lock(?)", (POSTGRES_MIGRATION_LOCK_KEY,))
+    cursor.execute(POSTGRES_SCHEMA)
+    cursor.executescript(LIVE_VIEWS)
+
 
 def setupDatabase():
 
-    databaseName = 'CapRank.db'
-    connection = sqlite3.connect(databaseName)
+    connection = database.connect()
     cursor = connection.cursor()
-    cursor.execute("PRAGMA foreign_keys = ON;")
 
-    schemaCommand = """
-        CREATE TABLE IF NOT EXISTS User (
-            id INTEGER PRIMARY KEY AUTOINCREMENT,
-            username TEXT NOT NULL UNIQUE,
-            name TEXT NOT NULL,
-            password TEXT NOT NULL,
-            profilePicture TEXT,
-            created_at DATETIME DEFAULT CURRENT_TIMESTAMP
-        );
-
-        CREATE TABLE IF NOT EXISTS Post (
-            id INTEGER PRIMARY KEY AUTOINCREMENT,
-            userId INTEGER NOT NULL,
-            imageName TEXT NOT NULL,
-            created_at DATETIME DEFAULT CURRENT_TIMESTAMP,
-            likes INTEGER DEFAULT 0,
-            topCaptionId INTEGER,
-            
-            FOREIGN KEY (userId) REFERENCES User(id) ON DELETE CASCADE,
-            FOREIGN KEY (topCaptionId) REFERENCES Caption(id) ON DELETE SET NULL
-        );
-
-        CREATE TABLE IF NOT EXISTS Caption (
-            id INTEGER PRIMARY KEY AUTOINCREMENT,
-            postId INTEGER NOT NULL,
-            userId INTEGER NOT NULL,
-            text TEXT NOT NULL,
-            created_at DATETIME DEFAULT CURRENT_TIMESTAMP,
-            likes INTEGER DEFAULT 0,
-
-            FOREIGN KEY (postId) REFERENCES Post(id) ON DELETE CASCADE,
-            FOREIGN KEY (userId) REFERENCES User(id) ON DELETE CASCADE
-        );
-
-        CREATE TABLE IF NOT EXISTS UserLikedPosts (
-            userId INTEGER NOT NULL,
-            postId INTEGER NOT NULL,
-            created_at DATETIME DEFAULT CURRENT_TIMESTAMP,
-            
-            PRIMARY KEY (userId, postId),
-            FOREIGN KEY (userId) REFERENCES User(id) ON DELETE CASCADE,
-            FOREIGN KEY (postId) REFERENCES Post(id) ON DELETE CASCADE
-        );
-
-        CREATE TABLE IF NOT EXISTS UserLikedCaptions (
-            userId INTEGER NOT NULL,
-            captionId INTEGER NOT NULL,
-            created_at DATETIME DEFAULT CURRENT_TIMESTAMP,
-            
-            PRIMARY KEY (userId, captionId),
-            FOREIGN KEY (userId) REFERENCES User(id) ON DELETE CASCADE,
-            FOREIGN KEY (captionId) REFERENCES Caption(id) ON DELETE CASCADE
-        );
-    """
-
-    cursor.executescript(schemaCommand)
+    if database.dialect == 'postgresql':
+        setupPostgresSchema(cursor)
+    else:
+        setupSQLiteSchema(cursor)
+        setupSQLiteArchive(cursor, database.archiveName)
+
+    # Clients only retry for a short while, so old idempotency keys can go
+    cursor.execute("""
+        DELETE FROM IdempotencyKey
+        WHERE created_at < ?
+    """, (timestampAgo(timedelta(days=1)),))
+
+    # Finished jobs are only kept around for the jobs CLI
+    cursor.execute("""
+        DELETE FROM Job
+        WHERE status = 'done' AND created_at < ?
+    """, (timestampAgo(timedelta(days=7)),))
+
+    # Sync only needs the latest change of each entity, so older ones can go
+    cursor.execute("""
+        DELETE FROM ChangeLog
+        WHERE seq < (
+            SELECT MAX(seq)
+            FROM ChangeLog newer
+            WHERE newer.entity = ChangeLog.entity AND newer.entityId = ChangeLog.entityId
+        )
+    """)
+
     connection.commit()
-    connection.close()
\ No newline at end of file
+    connection.close()
+
+
+@contextmanager
+def migrationLock(path: str = MIGRATION_LOCK_PATH):
+    """Exclusive lock on path shared by every process on the host, released when the block exits."""
+
+    with open(path, 'a') as lockFile:
+        if os.name == 'nt':
+            import msvcrt
+            lockFile.seek(0)
+            msvcrt.locking(lockFile.fileno(), msvcrt.LK_LOCK, 1)
+        else:
+            import fcntl
+            fcntl.flock(lockFile, fcntl.LOCK_EX)
+
+        try:
+            yield
+        finally:
+            if os.name == 'nt':
+                lockFile.seek(0)
+                msvcrt.locking(lockFile.fileno(), msvcrt.LK_UNLCK, 1)
+            else:
+                fcntl.flock(lockFile, fcntl.LOCK_UN)
+
+
+def migrateDatabase():
+    """Run setupDatabase() once per deployment rather than once per worker process."""
+
+    if os.environ.get(MIGRATIONS_DONE_ENV) == '1':
+        return
+
+    with migrationLock():
+        setupDatabase()
@@ -1,7 +1,7 @@
-import sqlite3
+from src.modules.database import database
 
 def view_db():
-    connection = sqlite3.connect('CapRank.db')
+    connection = database.connect()
     cursor = connection.cursor()
 
     # View all posts
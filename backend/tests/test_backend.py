@@ -1,20 +1,72 @@
-import sqlite3
 import requests
 import os
 import json
+import asyncio
+import functools
+import tempfile
 from pathlib import Path
 import atexit
 import uuid
+import time
 import base64
+import unittest
+import subprocess
+import sys
+from datetime import timedelta
+
+from src.modules.database import database, createDatabase
+from src.setupDatabase import SQLITE_SCHEMA, POSTGRES_SCHEMA, setupSQLiteSchema, setupSQLiteArchive
+from src.modules.job_queue import JobQueue, enqueue, jobHandler
+from src.modules.garbage_collector import GarbageCollector
+from src.modules.rate_limit import RateLimiter, RateLimitMiddleware, InMemoryTokenBuckets
+from src.modules.response_cache import ResponseCache
+from src.modules import queries
+from src.benchmark_queries import seedDatabase, inlinePosts, inlineCaptions
+from src.modules.trending import TrendingPosts, currentBucket
+from src.modules.image_index import ImageIndex, MultiIndexHashes, imageHash, toStoredHash, fromStoredHash
+from src.modules.caption_dedup import CaptionDuplicates, minHash, similarity
+from src.caption_duplicates import duplicateGroups
+from src.modules.content_filter import ContentFilter
+from src.modules.bloom_filter import BloomFilter
+from src.modules.backup import createBackup, verifyBackup, restoreBackup, listBackups, archiveBackupPath
+from src.modules.archive import PostArchiver
+from src.modules.export import exportRows, normalizeSince
+from src.modules.like_filter import ViewerLikeFilters
+from src.modules.change_log import recordChange
+from src.modules.like_counters import likeCounters
+
+from litestar import Litestar, post as postRoute
+from litestar.exceptions import HTTPException
+from litestar.middleware import DefineMiddleware
+from concurrent.futures import ThreadPoolExecutor
+import httpx
+import sqlite3
+from litestar.serialization import encode_json
 
-# Test configuration
-BASE_URL = "http://localhost:8000"
+# Test configuration; the HTTP tests run against a server already listening here
+BASE_URL = os.environ.get("CAPRANK_TEST_BASE_URL", "http://localhost:8000")
 TEST_IMAGE_PATH = "test_image.jpg"
 TEST_IMAGE_DIR = "user_post_images"
 
+# Set to a postgresql:// url to also run the data layer tests against PostgreSQL
+TEST_POSTGRES_URL = os.environ.get("CAPRANK_TEST_POSTGRES_URL")
+
 # Generate unique test username
 TEST_USERNAME = f"testuser_{uuid.uuid4().hex[:8]}"
 
+@functools.lru_cache(maxsize=None)
+def serverReachable() -> bool:
+    try:
+        requests.get(BASE_URL, timeout=2)
+        return True
+    except requests.ConnectionError:
+        return False
+
+def requireServer():
+    """Skip an HTTP test, rather than fail it, when no server is listening at BASE_URL."""
+    if not serverReachable():
+        raise unittest.SkipTest(f"No CapRank server at {BASE_URL}; start one or set CAPRANK_TEST_BASE_URL")
+
 # Cleanup function to remove test files
 def cleanup_test_files():
     if os.path.exists(TEST_IMAGE_PATH):
@@ -40,14 +92,15 @@ atexit.register(cleanup_test_files)
 def test_database_setup():
     print("\n1. Testing Database Setup...")
     try:
-        conn = sqlite3.connect('CapRank.db')
+        conn = database.connect()
         cursor = conn.cursor()
         
         # Check if all tables exist
-        tables = ['User', 'Post', 'Caption', 'UserLikedPosts', 'UserLikedCaptions']
+        tables = ['User', 'Post', 'Caption', 'UserLikedPosts', 'UserLikedCaptions', 'CaptionComments']
         for table in tables:
-            cursor.execute(f"SELECT name FROM sqlite_master WHERE type='table' AND name='{table}'")
-            if not cursor.fetchone():
+            try:
+                cursor.execute(f"SELECT * FROM {table} LIMIT 0")
+            except Exception:
                 print(f"❌ Table {table} not found")
                 return False
             print(f"✅ Table {table} exists")
@@ -60,6 +113,7 @@ def test_database_setup():
 
 def test_user_registration():
     print("\n2. Testing User Registration...")
+    requireServer()
     try:
         # Test data with unique username
         test_user = {
@@ -83,6 +137,7 @@ def test_user_registration():
 
 def test_user_login():
     print("\n3. Testing User Login...")
+    requireServer()
     try:
         # Test data
         login_data = {
@@ -104,6 +159,7 @@ def test_user_login():
 
 def test_post_creation():
     print("\n4. Testing Post Creation...")
+    requireServer()
     try:
         # Create test image directory if it doesn't exist
         os.makedirs(TEST_IMAGE_DIR, exist_ok=True)
@@ -147,6 +203,7 @@ def test_post_creation():
 
 def test_caption_creation():
     print("\n5. Testing Caption Creation...")
+    requireServer()
     try:
         # First create a post to get a valid post ID
         post_response = test_post_creation()
@@ -190,6 +247,7 @@ def test_caption_creation():
 
 def test_like_functionality():
     print("\n6. Testing Like Functionality...")
+    requireServer()
     try:
         # Test liking a post
         like_data = {
@@ -225,6 +283,1122 @@ def test_like_functionality():
         print(f"❌ Like functionality test failed: {e}")
         return False
 
+def test_batch_captions():
+    print("\n7. Testing Batch Caption Fetch...")
+    requireServer()
+    response = requests.get(
+        f"{BASE_URL}/captions/batch",
+        params={"postIds": [1, 2], "limit": 3}
+    )
+
+    assert response.status_code == 200, f"Batch caption fetch failed: {response.text}"
+
+    captionsByPost = response.json()['data']
+    assert set(captionsByPost.keys()) == {"1", "2"}, f"Batch caption fetch returned wrong posts: {captionsByPost.keys()}"
+
+    assert not any(len(captions) > 3 for captions in captionsByPost.values()), "Batch caption fetch ignored the per-post limit"
+
+    print("✅ Batch caption fetch successful")
+
+def test_idempotent_like():
+    print("\n8. Testing Idempotent Like Endpoints...")
+    requireServer()
+    credentials = {"userId": 1, "password": "testpass123"}
+    headers = {"Idempotency-Key": uuid.uuid4().hex}
+
+    first = requests.put(f"{BASE_URL}/post/1/like", json=credentials, headers=headers)
+    retry = requests.put(f"{BASE_URL}/post/1/like", json=credentials, headers=headers)
+
+    assert first.status_code == 200, f"Post like PUT failed: {first.text} {retry.text}"
+    assert retry.status_code == 200, f"Post like PUT failed: {first.text} {retry.text}"
+
+    assert first.json()['data'] == retry.json()['data'], "Retried like with the same idempotency key returned a different result"
+
+    # A key only replays for its owner, and only for the request it was first used with
+    wrongPassword = requests.put(f"{BASE_URL}/post/1/like", json={**credentials, "password": "wrong"}, headers=headers)
+    otherTarget = requests.put(f"{BASE_URL}/post/2/like", json=credentials, headers=headers)
+    otherOperation = requests.delete(f"{BASE_URL}/post/1/like", json=credentials, headers=headers)
+    assert wrongPassword.status_code == 401, f"Idempotency key reuse not refused: {wrongPassword.status_code} {otherTarget.status_code} {otherOperation.status_code}"
+    assert otherTarget.status_code == 422, f"Idempotency key reuse not refused: {wrongPassword.status_code} {otherTarget.status_code} {otherOperation.status_code}"
+    assert otherOperation.status_code == 422, f"Idempotency key reuse not refused: {wrongPassword.status_code} {otherTarget.status_code} {otherOperation.status_code}"
+
+    response = requests.delete(f"{BASE_URL}/post/1/like", json=credentials)
+    assert response.status_code == 200, f"Post like DELETE failed: {response.text}"
+    assert not response.json()['data']['liked'], f"Post like DELETE failed: {response.text}"
+
+    print("✅ Idempotent like endpoints successful")
+
+def check_database_roundtrip(testDatabase, schema):
+    connection = testDatabase.connect()
+    connection.cursor().executescript(schema)
+    connection.commit()
+    connection.close()
+
+    username = f"layer_{uuid.uuid4().hex[:8]}"
+
+    def insertUser(cursor):
+        cursor.execute("""
+            INSERT INTO User (username, name, password)
+            VALUES (?, ?, ?)
+            RETURNING id
+        """, (username, "Layer Test", "pass"))
+        return cursor.fetchone()[0]
+
+    def deleteUser(cursor):
+        cursor.execute("DELETE FROM User WHERE id = ?", (userId,))
+
+    async def roundtrip():
+        nonlocal userId
+        userId = await testDatabase.write(insertUser)
+        row = await testDatabase.read(lambda cursor: cursor.execute("SELECT username FROM User WHERE id = ?", (userId,)).fetchone())
+        await testDatabase.write(deleteUser)
+        await testDatabase.close()
+        return row
+
+    userId = None
+    return asyncio.run(roundtrip()) == (username,)
+
+def test_database_backends():
+    print("\n9. Testing Database Backends...")
+    with tempfile.TemporaryDirectory() as directory:
+        assert check_database_roundtrip(createDatabase(f"sqlite:///{os.path.join(directory, 'layer.db')}"), SQLITE_SCHEMA), "SQLite backend roundtrip failed"
+    print("✅ SQLite backend roundtrip successful")
+
+    if not TEST_POSTGRES_URL:
+        print("⚠️  PostgreSQL backend skipped, CAPRANK_TEST_POSTGRES_URL not set")
+        return
+
+    assert check_database_roundtrip(createDatabase(TEST_POSTGRES_URL), POSTGRES_SCHEMA), "PostgreSQL backend roundtrip failed"
+    print("✅ PostgreSQL backend roundtrip successful")
+
+def test_concurrent_migrations():
+    print("\n10. Testing Concurrent Migrations...")
+    with tempfile.TemporaryDirectory() as directory:
+        environment = {
+            **os.environ,
+            "CAPRANK_DATABASE_URL": f"sqlite:///{os.path.join(directory, 'migrate.db')}",
+            "CAPRANK_MIGRATION_LOCK": os.path.join(directory, 'migrate.lock')
+        }
+        environment.pop("CAPRANK_MIGRATIONS_DONE", None)
+
+        # Several workers starting at once must all come up with the schema in place
+        workers = [
+            subprocess.Popen(
+                [sys.executable, "-c", "from src.setupDatabase import migrateDatabase; migrateDatabase()"],
+                env=environment,
+                stderr=subprocess.PIPE
+            )
+            for _ in range(4)
+        ]
+        for worker in workers:
+            _, errors = worker.communicate(timeout=60)
+            assert worker.returncode == 0, f"Migration worker failed: {errors.decode()}"
+
+    print("✅ Concurrent migrations successful")
+
+def test_job_queue():
+    print("\n11. Testing Job Queue...")
+    with tempfile.TemporaryDirectory() as directory:
+        testDatabase = createDatabase(f"sqlite:///{os.path.join(directory, 'jobs.db')}")
+        connection = testDatabase.connect()
+        connection.cursor().executescript(SQLITE_SCHEMA)
+        connection.commit()
+        connection.close()
+
+        queue = JobQueue(testDatabase, retryBaseSeconds=0)
+        ran = []
+
+        @jobHandler('testFlaky')
+        async def flaky(payload):
+            ran.append(payload['name'])
+            if ran.count('flaky') == 1:
+                raise RuntimeError("first attempt fails")
+
+        @jobHandler('testBroken')
+        async def broken(payload):
+            ran.append(payload['name'])
+            raise RuntimeError("always fails")
+
+        async def work():
+            await testDatabase.write(lambda cursor: enqueue(cursor, 'testFlaky', {'name': 'flaky'}))
+            await testDatabase.write(lambda cursor: enqueue(cursor, 'testBroken', {'name': 'broken'}, priority=10, maxAttempts=2))
+            await queue.drain()
+            jobs = await testDatabase.read(lambda cursor: cursor.execute("SELECT kind, status, attempts FROM Job ORDER BY id").fetchall())
+            await testDatabase.close()
+            return jobs
+
+        jobs = asyncio.run(work())
+
+    # Higher priority first, failures retried until maxAttempts
+    assert ran[0] == 'broken', f"Unexpected job outcome: {ran} {jobs}"
+    assert jobs == [('testFlaky', 'done', 2), ('testBroken', 'failed', 2)], f"Unexpected job outcome: {ran} {jobs}"
+
+    print("✅ Job queue retries and priorities successful")
+
+def test_soft_delete():
+    print("\n12. Testing Soft Delete...")
+    requireServer()
+    with open(TEST_IMAGE_PATH, 'wb') as f:
+        f.write(b'dummy image data')
+
+    with open(TEST_IMAGE_PATH, 'rb') as f:
+        response = requests.post(
+            f"{BASE_URL}/post/create",
+            files={
+                'userId': (None, '1'),
+                'password': (None, 'testpass123'),
+                'userCaptionText': (None, 'Soon deleted'),
+                'image': ('test.jpg', f, 'image/jpeg')
+            }
+        )
+
+    assert response.status_code == 201, f"Post creation failed: {response.text}"
+    postId = response.json()['data']['postId']
+
+    response = requests.delete(f"{BASE_URL}/post/{postId}_1_testpass123")
+    assert response.status_code == 200, f"Post delete failed: {response.text}"
+
+    # Hidden straight away, even before the purge job has run
+    assert requests.get(f"{BASE_URL}/post/{postId}").status_code == 404, "Deleted post is still readable"
+
+    captions = requests.get(f"{BASE_URL}/post/{postId}/captions").json()['data']
+    assert not captions, f"Captions of a deleted post are still readable: {captions}"
+
+    print("✅ Soft delete successful")
+
+def test_garbage_collector():
+    print("\n13. Testing Garbage Collector...")
+    with tempfile.TemporaryDirectory() as directory:
+        testDatabase = createDatabase(f"sqlite:///{os.path.join(directory, 'gc.db')}")
+        connection = testDatabase.connect()
+        connection.cursor().executescript(SQLITE_SCHEMA)
+
+        # Rows left behind by a database that never had foreign keys enforced
+        connection.executescript("""
+            INSERT INTO User (id, username, name, password) VALUES (1, 'gc_user', 'GC', 'pass');
+            INSERT INTO Post (id, userId, imageName) VALUES (1, 1, 'kept.jpg');
+            INSERT INTO Caption (id, postId, userId, text) VALUES (1, 1, 1, 'kept'), (2, 99, 1, 'dangling');
+            INSERT INTO UserLikedCaptions (userId, captionId) VALUES (1, 1), (1, 98), (97, 1);
+            INSERT INTO CaptionComments (captionId, userId, text) VALUES (1, 1, 'kept'), (96, 1, 'dangling');
+        """)
+        connection.commit()
+        connection.close()
+
+        imageFolder = os.path.join(directory, 'images')
+        os.makedirs(imageFolder)
+        for name in ['kept.jpg', 'orphan_1.jpg', 'orphan_2.jpg', 'just_uploaded.jpg']:
+            with open(os.path.join(imageFolder, name), 'wb') as f:
+                f.write(b'image')
+            if name != 'just_uploaded.jpg':
+                os.utime(os.path.join(imageFolder, name), (0, 0))
+
+        def collector(dryRun):
+            return GarbageCollector(testDatabase, imageFolder, chunkSize=2, dryRun=dryRun, statePath=os.path.join(directory, 'gc.json'))
+
+        async def collect():
+            report = {stats.name: stats.garbage for stats in await collector(True).run()}
+            removed = {stats.name: stats.removed for stats in await collector(False).run()}
+            remaining = await testDatabase.read(lambda cursor: [
+                cursor.execute(f"SELECT COUNT(*) FROM {table}").fetchone()[0]
+                for table in ['Caption', 'UserLikedCaptions', 'CaptionComments']
+            ])
+            await testDatabase.close()
+            return report, removed, remaining
+
+        report, removed, remaining = asyncio.run(collect())
+        expected = {'images': 2, 'Caption': 1, 'UserLikedPosts': 0, 'UserLikedCaptions': 2, 'CaptionComments': 1}
+
+        assert report == expected, f"Unexpected garbage: {report} {removed}"
+        assert removed == expected, f"Unexpected garbage: {report} {removed}"
+        assert remaining == [1, 1, 1], f"Wrong rows or files left: {remaining} {os.listdir(imageFolder)}"
+        assert sorted(os.listdir(imageFolder)) == ['just_uploaded.jpg', 'kept.jpg'], f"Wrong rows or files left: {remaining} {os.listdir(imageFolder)}"
+
+    print("✅ Garbage collector successful")
+
+def test_comment_pages():
+    print("\n14. Testing Comment Pages...")
+    requireServer()
+    with open(TEST_IMAGE_PATH, 'wb') as f:
+        f.write(b'dummy image data')
+
+    with open(TEST_IMAGE_PATH, 'rb') as f:
+        response = requests.post(
+            f"{BASE_URL}/post/create",
+            files={
+                'userId': (None, '1'),
+                'password': (None, 'testpass123'),
+                'userCaptionText': (None, 'Commented caption'),
+                'image': ('test.jpg', f, 'image/jpeg')
+            }
+        )
+    postId = response.json()['data']['postId']
+    captionId = requests.get(f"{BASE_URL}/post/{postId}/captions").json()['data'][0][0]
+
+    credentials = {"captionId": captionId, "userId": 1, "password": "testpass123"}
+    commentIds = [
+        requests.post(f"{BASE_URL}/captions/comment", json={**credentials, "text": f"Comment {i}"}).json()['data']['commentId']
+        for i in range(3)
+    ]
+    response = requests.post(f"{BASE_URL}/captions/comment", json={**credentials, "text": "Reply", "parentId": commentIds[0]})
+    assert response.status_code == 201, f"Reply creation failed: {response.text}"
+
+    firstPage = requests.get(f"{BASE_URL}/captions/comments/{captionId}", params={"limit": 2, "withReplies": "true"}).json()
+    secondPage = requests.get(f"{BASE_URL}/captions/comments/{captionId}", params={"limit": 2, "after": firstPage['nextAfter']}).json()
+
+    pagedIds = [comment[0] for comment in firstPage['data'] + secondPage['data']]
+    assert pagedIds == commentIds, f"Comment pages don't line up: {firstPage} {secondPage}"
+    assert secondPage['nextAfter'] is None, f"Comment pages don't line up: {firstPage} {secondPage}"
+
+    assert firstPage['commentCount'] == 4, f"Wrong comment count or replies: {firstPage}"
+    assert [reply[6] for reply in firstPage['replies']] == [commentIds[0]], f"Wrong comment count or replies: {firstPage}"
+
+    print("✅ Comment pages successful")
+
+def test_rate_limiter():
+    print("\n15. Testing Rate Limiter...")
+    with tempfile.TemporaryDirectory() as directory:
+        queued = [0]
+        testDatabase = createDatabase(f"sqlite:///{os.path.join(directory, 'limits.db')}")
+        connection = testDatabase.connect()
+        setupSQLiteSchema(connection.cursor())
+        connection.execute("INSERT INTO User (id, username, name, password) VALUES (1, 'limited', 'Limited', 'pass'), (2, 'other', 'Other', 'pass')")
+        connection.commit()
+        connection.close()
+        testDatabase.queuedWrites = lambda: queued[0]
+
+        limiter = RateLimiter(
+            InMemoryTokenBuckets(), database=testDatabase,
+            userRate=0.01, userBurst=2, ipRate=100, ipBurst=100, maxQueuedWrites=10
+        )
+
+        @postRoute("/write")
+        async def write(data: dict) -> dict:
+            return {'status': 'green'}
+
+        app = Litestar(route_handlers=[write], middleware=[DefineMiddleware(RateLimitMiddleware, limiter=limiter)])
+
+        async def hammer():
+            async with httpx.AsyncClient(transport=httpx.ASGITransport(app=app), base_url="http://testserver") as client:
+                # Claiming someone's userId without their password only counts against the IP
+                impostor = [(await client.post("/write", json={"userId": 1, "password": "guess"})).status_code for _ in range(3)]
+                statuses = [(await client.post("/write", json={"userId": 1, "password": "pass"})).status_code for _ in range(3)]
+                limited = await client.post("/write", json={"userId": 1, "password": "pass"})
+                otherUser = (await client.post("/write", json={"userId": 2, "password": "pass"})).status_code
+
+                # A long write queue turns writes away before they join it
+                queued[0] = 10
+                shed = await client.post("/write", json={"userId": 3})
+                await testDatabase.close()
+                return impostor, statuses, limited, otherUser, shed
+
+        impostor, statuses, limited, otherUser, shed = asyncio.run(hammer())
+
+    assert impostor == [201, 201, 201], f"Unexpected rate limiting: {impostor} {statuses} {otherUser}"
+    assert statuses == [201, 201, 429], f"Unexpected rate limiting: {impostor} {statuses} {otherUser}"
+    assert limited.headers.get('Retry-After') is not None, f"Unexpected rate limiting: {impostor} {statuses} {otherUser}"
+    assert otherUser == 201, f"Unexpected rate limiting: {impostor} {statuses} {otherUser}"
+    assert shed.status_code == 503, f"Write not shed: {shed.status_code}"
+
+    print("✅ Rate limiter successful")
+
+def test_response_cache():
+    print("\n16. Testing Response Cache...")
+    cache = ResponseCache(ttlSeconds=0.05, staleSeconds=10)
+    computed = []
+
+    async def compute():
+        computed.append(len(computed))
+        await asyncio.sleep(0.05)
+        return {'data': len(computed)}
+
+    async def stampede():
+        # A cold key: everyone waits for the one computation
+        first = await asyncio.gather(*[cache.fetch('posts', compute) for _ in range(20)])
+        await asyncio.sleep(0.1)
+        # An expired key: one request recomputes, the others get the stale body straight away
+        second = await asyncio.gather(*[cache.fetch('posts', compute) for _ in range(20)])
+        return first, second
+
+    first, second = asyncio.run(stampede())
+
+    assert len(computed) == 2, f"Requests not coalesced: {len(computed)} computations"
+    assert {entry.plain for entry in first} == {b'{"data":1}'}, f"Requests not coalesced: {len(computed)} computations"
+    assert sorted(entry.plain for entry in second) == [b'{"data":1}'] * 19 + [b'{"data":2}'], f"Stale entry not served during refresh: {[entry.plain for entry in second]}"
+
+    requireServer()
+    response = requests.get(f"{BASE_URL}/users", headers={"Accept-Encoding": "gzip"})
+    assert response.status_code == 200, f"Cached list not served gzipped: {response.status_code} {response.headers}"
+    assert response.headers.get('Content-Encoding') == 'gzip', f"Cached list not served gzipped: {response.status_code} {response.headers}"
+    assert response.json()['status'] == 'green', f"Cached list not served gzipped: {response.status_code} {response.headers}"
+
+    print("✅ Response cache successful")
+
+def test_query_registry():
+    print("\n17. Testing Query Registry...")
+    with tempfile.TemporaryDirectory() as directory:
+        connection = sqlite3.connect(os.path.join(directory, 'queries.db'))
+        seedDatabase(connection, 50, 3)
+        cursor = connection.cursor()
+
+        # The client parses rows by position, so structs must encode exactly like the old tuples
+        for viewerId in [None, 1]:
+            assert encode_json(queries.POSTS_WITH_USERNAME.all(cursor, viewerId=viewerId)) == encode_json(inlinePosts(cursor, viewerId)), f"Post rows differ for viewer {viewerId}"
+            assert encode_json(queries.CAPTIONS_BY_POST.all(cursor, (7,), viewerId)) == encode_json(inlineCaptions(cursor, 7, viewerId)), f"Caption rows differ for viewer {viewerId}"
+
+        post = queries.POST_BY_ID.one(cursor, (8,), 1)
+        missing = queries.POST_BY_ID.one(cursor, (999,))
+        connection.close()
+
+    assert post.id == 8, f"Unexpected single row: {post} {missing}"
+    assert post.likedByViewer is True, f"Unexpected single row: {post} {missing}"
+    assert missing is None, f"Unexpected single row: {post} {missing}"
+
+    print("✅ Query registry successful")
+
+def test_trending_posts():
+    print("\n18. Testing Trending Posts...")
+    with tempfile.TemporaryDirectory() as directory:
+        testDatabase = createDatabase(f"sqlite:///{os.path.join(directory, 'trending.db')}")
+        connection = testDatabase.connect()
+        seedDatabase(connection, 5, 0)
+        connection.close()
+
+        trending = TrendingPosts(testDatabase)
+        now = currentBucket()
+
+        async def rank():
+            def likePosts(cursor):
+                # Post 1 was popular last week, post 2 is popular today
+                for postId, bucket, likes in [(1, now - 30, 9), (2, now, 4), (3, now - 2, 2), (4, now - 200, 50)]:
+                    cursor.execute("INSERT INTO PostLikeBucket (postId, bucket, likes) VALUES (?, ?, ?)", (postId, bucket, likes))
+                trending.recordLike(cursor, 3, 1)
+
+            await testDatabase.write(likePosts)
+            day = await trending.page('day', 0, 10)
+            week = await trending.page('week', 0, 10)
+
+            # Likes handled by this process count before the next rebuild
+            trending.applyLike(3, 5)
+            dayAfterLikes = await trending.page('day', 0, 1)
+            secondPage = await trending.page('week', 1, 1)
+
+            await testDatabase.close()
+            return day, week, dayAfterLikes, secondPage
+
+        day, week, dayAfterLikes, secondPage = asyncio.run(rank())
+
+    assert day == [(2, 4), (3, 3)], f"Wrong leaderboards: {day} {week}"
+    assert week == [(1, 9), (2, 4), (3, 3)], f"Wrong leaderboards: {day} {week}"
+    assert dayAfterLikes == [(3, 8)], f"Local likes not ranked: {dayAfterLikes} {secondPage}"
+    assert secondPage == [(3, 8)], f"Local likes not ranked: {dayAfterLikes} {secondPage}"
+
+    requireServer()
+    response = requests.get(f"{BASE_URL}/post/trending", params={"window": "week", "limit": 5})
+    invalid = requests.get(f"{BASE_URL}/post/trending", params={"window": "year"})
+    assert response.status_code == 200, f"Trending endpoint failed: {response.text} {invalid.text}"
+    assert invalid.status_code == 400, f"Trending endpoint failed: {response.text} {invalid.text}"
+
+    print("✅ Trending posts successful")
+
+def test_delta_sync():
+    print("\n19. Testing Delta Sync...")
+    requireServer()
+    start = requests.get(f"{BASE_URL}/sync").json()
+    assert start['resync'], f"First sync should ask for a resync: {start}"
+
+    with open(TEST_IMAGE_PATH, 'wb') as f:
+        f.write(b'dummy image data')
+
+    with open(TEST_IMAGE_PATH, 'rb') as f:
+        response = requests.post(
+            f"{BASE_URL}/post/create",
+            files={
+                'userId': (None, '1'),
+                'password': (None, 'testpass123'),
+                'userCaptionText': (None, 'Synced caption'),
+                'image': ('test.jpg', f, 'image/jpeg')
+            }
+        )
+    postId = response.json()['data']['postId']
+    requests.put(f"{BASE_URL}/post/{postId}/like", json={"userId": 1, "password": "testpass123"})
+
+    created = requests.get(f"{BASE_URL}/sync", params={"since": start['nextSince']}).json()
+    syncedPosts = [post for post in created['data']['posts'] if post[0] == postId]
+    assert len(syncedPosts) == 1, f"New post not synced once with its like: {created}"
+    assert syncedPosts[0][4] == 1, f"New post not synced once with its like: {created}"
+    assert len(created['data']['captions']) == 1, f"New post not synced once with its like: {created}"
+
+    requests.delete(f"{BASE_URL}/post/{postId}_1_testpass123")
+    removed = requests.get(f"{BASE_URL}/sync", params={"since": created['nextSince']}).json()
+    assert removed['data']['deleted']['posts'] == [postId], f"Deleted post not synced: {removed}"
+    assert len(removed['data']['deleted']['captions']) == 1, f"Deleted post not synced: {removed}"
+
+    print("✅ Delta sync successful")
+
+def test_batch_operations():
+    print("\n20. Testing Batch Operations...")
+    requireServer()
+    with open(TEST_IMAGE_PATH, 'wb') as f:
+        f.write(b'dummy image data')
+
+    with open(TEST_IMAGE_PATH, 'rb') as f:
+        response = requests.post(
+            f"{BASE_URL}/post/create",
+            files={
+                'userId': (None, '1'),
+                'password': (None, 'testpass123'),
+                'image': ('test.jpg', f, 'image/jpeg')
+            }
+        )
+    postId = response.json()['data']['postId']
+
+    key = uuid.uuid4().hex
+    batch = {
+        "userId": 1,
+        "password": "testpass123",
+        "operations": [
+            {"op": "likePost", "postId": postId, "idempotencyKey": f"{key}-like"},
+            {"op": "createCaption", "postId": postId, "text": "Offline caption", "idempotencyKey": f"{key}-caption"},
+            {"op": "likeCaption", "captionId": 999999999}
+        ]
+    }
+    first = requests.post(f"{BASE_URL}/batch", json=batch).json()
+    results = first['data']['results']
+    assert [result['status'] for result in results] == ['ok', 'ok', 'error'], f"Batch results wrong: {first}"
+    assert results[2]['statusCode'] == 404, f"Batch results wrong: {first}"
+
+    # Resending the batch replays the keyed operations instead of adding a second caption
+    retried = requests.post(f"{BASE_URL}/batch", json=batch).json()['data']['results']
+    assert retried[0]['replayed'] and retried[1]['replayed'] and retried[1]['data'] == results[1]['data'], f"Batch retry not replayed: {retried}"
+
+    reused = requests.post(f"{BASE_URL}/batch", json={**batch, "operations": [
+        {"op": "likePost", "postId": 1, "idempotencyKey": f"{key}-like"}
+    ]}).json()['data']['results']
+    assert reused[0]['status'] == 'error', f"Batch key reused for another post not refused: {reused}"
+    assert reused[0]['statusCode'] == 422, f"Batch key reused for another post not refused: {reused}"
+
+    captions = requests.get(f"{BASE_URL}/captions/post/{postId}").json()['data']
+    post = requests.get(f"{BASE_URL}/post/{postId}").json()['data']
+    assert len(captions) == 1, f"Batch applied more than once: {captions} {post}"
+    assert post[4] == 1, f"Batch applied more than once: {captions} {post}"
+
+    atomic = requests.post(f"{BASE_URL}/batch", json={**batch, "atomic": True, "operations": [
+        {"op": "createCaption", "postId": postId, "text": "Rolled back"},
+        {"op": "addComment", "captionId": 999999999, "text": "No caption"}
+    ]})
+    captions = requests.get(f"{BASE_URL}/captions/post/{postId}").json()['data']
+    assert atomic.status_code == 404, f"Atomic batch not rolled back: {atomic.status_code} {captions}"
+    assert len(captions) == 1, f"Atomic batch not rolled back: {atomic.status_code} {captions}"
+
+    invalid = requests.post(f"{BASE_URL}/batch", json={**batch, "operations": [{"op": "createCaption", "postId": postId}]})
+    assert invalid.status_code == 400, f"Batch without caption text accepted: {invalid.status_code}"
+
+    print("✅ Batch operations successful")
+
+def test_image_index():
+    print("\n21. Testing Near-Duplicate Image Index...")
+    index = MultiIndexHashes()
+    original = 0x0123456789ABCDEF
+    index.add(1, original)
+    index.add(2, original ^ 0xFFFF0000FFFF0000)
+    index.add(3, original)
+
+    # Two bits flipped in different chunks, as re-encoding an image does
+    similar = index.search(original ^ (1 << 3) ^ (1 << 40), maxDistance=6)
+    assert similar == [(1, 2), (3, 2)], f"Near duplicates not found: {similar}"
+
+    assert not index.search(original ^ 0xFF00FF00FF00FF00, maxDistance=6), "Distant hash matched"
+
+    assert fromStoredHash(toStoredHash(0xFFFFFFFFFFFFFFFF)) == 0xFFFFFFFFFFFFFFFF, "Hash storage or undecodable image handling wrong"
+    assert imageHash(b'dummy image data') is None, "Hash storage or undecodable image handling wrong"
+
+    # A hash backfilled for an older post is picked up by a refresh, though a newer post was indexed first
+    with tempfile.TemporaryDirectory() as directory:
+        testDatabase = createDatabase(f"sqlite:///{os.path.join(directory, 'hashes.db')}")
+        connection = testDatabase.connect()
+        setupSQLiteSchema(connection.cursor())
+        connection.executescript("""
+            INSERT INTO User (id, username, name, password) VALUES (1, 'hasher', 'Hasher', 'pass');
+            INSERT INTO Post (id, userId, imageName) VALUES (1, 1, 'old.jpg'), (2, 1, 'new.jpg');
+        """)
+        connection.commit()
+        connection.close()
+
+        testIndex = ImageIndex(testDatabase)
+
+        def storeHash(postId, hashValue):
+            def operation(cursor):
+                testIndex.recordHash(cursor, postId, hashValue)
+                recordChange(cursor, 'post', postId)
+            return operation
+
+        async def backfill():
+            await testDatabase.write(storeHash(2, original ^ 0xFFFF0000FFFF0000))
+            await testIndex.refresh()
+            await testDatabase.write(storeHash(1, original))
+            await testIndex.refresh()
+            found = testIndex.hashes.search(original)
+            await testDatabase.close()
+            return found
+
+        found = asyncio.run(backfill())
+        assert found == [(1, 0)], f"Backfilled hash not picked up: {found}"
+
+    requireServer()
+    with open(TEST_IMAGE_PATH, 'wb') as f:
+        f.write(b'dummy image data')
+
+    with open(TEST_IMAGE_PATH, 'rb') as f:
+        response = requests.post(
+            f"{BASE_URL}/post/create",
+            files={
+                'userId': (None, '1'),
+                'password': (None, 'testpass123'),
+                'image': ('test.jpg', f, 'image/jpeg')
+            }
+        )
+    assert response.json()['data']['similarPostIds'] == [], f"Undecodable upload matched other posts: {response.json()}"
+
+    print("✅ Near-duplicate image index successful")
+
+def test_caption_duplicates():
+    print("\n22. Testing Near-Duplicate Captions...")
+    joke = minHash("When you finally fix the bug at 3am and it was a typo")
+    assert similarity(joke, minHash("when you finally fix the bug at 3AM, and it was a typo!!")) >= 0.9, "MinHash similarity wrong"
+    assert similarity(joke, minHash("My cat judging me for eating cereal at midnight")) <= 0.2, "MinHash similarity wrong"
+
+    groups = duplicateGroups([(1, "Same old joke", 3), (2, "same old joke!", 9), (3, "Something else entirely", 0)], 0.8)
+    assert groups == [(2, [1])], f"Duplicate groups wrong: {groups}"
+
+    # A caption committing after one with a higher id, as can happen on PostgreSQL, still gets indexed
+    connection = sqlite3.connect(':memory:')
+    connection.executescript("""
+        CREATE TABLE LiveCaption (id INTEGER PRIMARY KEY, postId INTEGER, text TEXT, created_at TEXT DEFAULT CURRENT_TIMESTAMP);
+        INSERT INTO LiveCaption (id, postId, text, created_at) VALUES (1, 1, 'An old settled joke', '2000-01-01 00:00:00');
+        INSERT INTO LiveCaption (id, postId, text) VALUES (5, 1, 'A recent joke');
+    """)
+    duplicates = CaptionDuplicates(policy='flag')
+    firstCheck = duplicates.duplicateOf(connection.cursor(), 1, "Something unrelated")
+    connection.execute("INSERT INTO LiveCaption (id, postId, text) VALUES (3, 1, 'The joke that committed late')")
+    lateDuplicate = duplicates.duplicateOf(connection.cursor(), 1, "the joke that committed late!")
+    settled = duplicates.posts[1].settledCaptionId
+    connection.close()
+    assert firstCheck is None, f"Late caption missed by the duplicate index: {firstCheck} {lateDuplicate} {settled}"
+    assert lateDuplicate == 3, f"Late caption missed by the duplicate index: {firstCheck} {lateDuplicate} {settled}"
+    assert settled == 1, f"Late caption missed by the duplicate index: {firstCheck} {lateDuplicate} {settled}"
+
+    requireServer()
+    with open(TEST_IMAGE_PATH, 'wb') as f:
+        f.write(b'dummy image data')
+
+    with open(TEST_IMAGE_PATH, 'rb') as f:
+        response = requests.post(
+            f"{BASE_URL}/post/create",
+            files={
+                'userId': (None, '1'),
+                'password': (None, 'testpass123'),
+                'userCaptionText': (None, 'Nobody expects the caption inquisition'),
+                'image': ('test.jpg', f, 'image/jpeg')
+            }
+        )
+    postId = response.json()['data']['postId']
+
+    caption = {"postId": postId, "userId": 1, "password": "testpass123"}
+    repeated = requests.post(f"{BASE_URL}/captions", json={**caption, "text": "nobody expects the Caption Inquisition!"}).json()
+    fresh = requests.post(f"{BASE_URL}/captions", json={**caption, "text": "A completely different joke"}).json()
+    assert 'duplicateOfCaptionId' in repeated['data'], f"Duplicate caption not flagged: {repeated} {fresh}"
+    assert 'duplicateOfCaptionId' not in fresh['data'], f"Duplicate caption not flagged: {repeated} {fresh}"
+
+    print("✅ Near-duplicate captions successful")
+
+def test_content_filter():
+    print("\n23. Testing Content Filter...")
+    contentFilter = ContentFilter(words=["bad", "worse thing"], policy='mask')
+    text = "Not B@D, a ｗｏｒｓｅ thing; badge and abad are fine"
+    assert contentFilter.matches(text) == [(4, 7), (11, 22)], f"Matches wrong: {contentFilter.matches(text)}"
+
+    assert contentFilter.check("so b4d really") == "so *** really", f"Masking wrong: {contentFilter.check('so b4d really')}"
+
+    with tempfile.TemporaryDirectory() as directory:
+        wordsPath = os.path.join(directory, 'blocked_words.txt')
+        with open(wordsPath, 'w') as f:
+            f.write("# comment\nfirst\n")
+
+        reloading = ContentFilter(path=wordsPath, policy='reject', reloadSeconds=0)
+        assert reloading.matches("the first one"), "Word list not loaded"
+        assert not reloading.matches("the second one"), "Word list not loaded"
+
+        with open(wordsPath, 'w') as f:
+            f.write("second\n")
+        os.utime(wordsPath, (0, 12345))
+        assert not reloading.matches("the first one"), "Word list not reloaded"
+        assert reloading.matches("the second one"), "Word list not reloaded"
+
+        try:
+            reloading.check("a second try")
+        except HTTPException as e:
+            assert e.extra == {'matches': [[2, 8]]}, f"Rejection without spans: {e.extra}"
+        else:
+            raise AssertionError("Blocked text accepted")
+
+    print("✅ Content filter successful")
+
+def test_user_suggestions():
+    print("\n24. Testing User Suggestions...")
+    requireServer()
+    username = f"suggest_{uuid.uuid4().hex[:8]}"
+    response = requests.post(f"{BASE_URL}/register", json={"username": username, "name": "Quasar Zed", "password": "testpass123"})
+    assert response.status_code == 201, f"Registration failed: {response.text}"
+
+    # Other workers pick the new user up from the change log within a couple of seconds
+    for _ in range(10):
+        byUsername = requests.get(f"{BASE_URL}/users/suggest", params={"prefix": username[:12].upper()}).json()['data']
+        byNameWord = requests.get(f"{BASE_URL}/users/suggest", params={"prefix": "zed", "limit": 50}).json()['data']
+        if any(user[1] == username for user in byUsername) and any(user[1] == username for user in byNameWord):
+            break
+        time.sleep(0.5)
+    else:
+        raise AssertionError(f"New user not suggested: {byUsername} {byNameWord}")
+
+    ranked = requests.get(f"{BASE_URL}/users/suggest", params={"prefix": "t", "limit": 50}).json()['data']
+    assert [user[4] for user in ranked] == sorted((user[4] for user in ranked), reverse=True), f"Suggestions not ranked by activity: {ranked}"
+
+    assert requests.get(f"{BASE_URL}/users/suggest", params={"prefix": ""}).status_code == 400, "Empty prefix accepted"
+
+    print("✅ User suggestions successful")
+
+def test_username_availability():
+    print("\n25. Testing Username Availability and Bulk Registration...")
+    bloom = BloomFilter(1000, 0.01)
+    for i in range(1000):
+        bloom.add(f"user{i}".encode())
+    falsePositives = sum(1 for i in range(1000, 11000) if f"user{i}".encode() in bloom)
+    assert all(f"user{i}".encode() in bloom for i in range(1000)), f"Bloom filter wrong: {falsePositives} false positives in 10000"
+    assert falsePositives <= 300, f"Bloom filter wrong: {falsePositives} false positives in 10000"
+
+    requireServer()
+    taken = requests.get(f"{BASE_URL}/register/available", params={"username": TEST_USERNAME}).json()['data']
+    free = requests.get(f"{BASE_URL}/register/available", params={"username": f"free_{uuid.uuid4().hex[:8]}"}).json()['data']
+    assert not taken['available'], f"Availability wrong: {taken} {free}"
+    assert free['available'], f"Availability wrong: {taken} {free}"
+
+    # Racing registrations for one name: the unique index lets exactly one through
+    username = f"race_{uuid.uuid4().hex[:8]}"
+    with ThreadPoolExecutor(max_workers=8) as executor:
+        statuses = list(executor.map(
+            lambda _: requests.post(f"{BASE_URL}/register", json={"username": username, "name": "Racer", "password": "testpass123"}).status_code,
+            range(8)
+        ))
+    assert sorted(statuses) == [201] + [400] * 7, f"Racing registrations: {statuses}"
+
+    with tempfile.TemporaryDirectory() as directory:
+        importPath = os.path.join(directory, 'users.csv')
+        imported = [f"import_{uuid.uuid4().hex[:8]}" for _ in range(3)]
+        with open(importPath, 'w') as f:
+            f.write("username,name,password\n")
+            f.write(f"{imported[0]},Imported One,pass123\n{imported[1]},Imported Two,pass123\n")
+            f.write(f"{username},Taken Already,pass123\n{imported[2]},Short Password,x\n")
+
+        result = subprocess.run([sys.executable, '-m', 'src.import_users', importPath], capture_output=True, text=True)
+        assert "Registered 2 users, skipped 1 taken usernames and 1 invalid rows" in result.stdout, f"Bulk import wrong: {result.stdout} {result.stderr}"
+
+    print("✅ Username availability and bulk registration successful")
+
+def test_streaming_export():
+    print("\n26. Testing Streaming Export...")
+    # Offsets are converted to the UTC times stored, not dropped
+    assert normalizeSince("2024-01-01T12:00:00+02:00") == "2024-01-01 10:00:00", "Since not normalised to UTC"
+    assert normalizeSince("2024-01-01T12:00:00Z") == "2024-01-01 12:00:00", "Since not normalised to UTC"
+    assert normalizeSince("2024-01-01") == "2024-01-01 00:00:00", "Since not normalised to UTC"
+
+    requireServer()
+    with open(TEST_IMAGE_PATH, 'wb') as f:
+        f.write(b'dummy image data')
+
+    with open(TEST_IMAGE_PATH, 'rb') as f:
+        response = requests.post(
+            f"{BASE_URL}/post/create",
+            files={
+                'userId': (None, '1'),
+                'password': (None, 'testpass123'),
+                'image': ('test.jpg', f, 'image/jpeg')
+            }
+        )
+    postId = response.json()['data']['postId']
+
+    texts = [f"Export caption {i} {uuid.uuid4().hex[:6]}" for i in range(3)]
+    requests.post(f"{BASE_URL}/batch", json={
+        "userId": 1,
+        "password": "testpass123",
+        "operations": [{"op": "createCaption", "postId": postId, "text": text} for text in texts]
+    })
+
+    response = requests.get(f"{BASE_URL}/export/captions", params={"postId": postId}, stream=True)
+    rows = [json.loads(line) for line in response.iter_lines() if line]
+    assert response.headers['content-type'] == 'application/x-ndjson', f"NDJSON export wrong: {response.headers} {rows}"
+    assert [row['text'] for row in rows] == texts, f"NDJSON export wrong: {response.headers} {rows}"
+
+    # Resuming after the first row skips it
+    resumed = requests.get(f"{BASE_URL}/export/captions", params={"postId": postId, "afterId": rows[0]['id']}).text
+    assert len(resumed.splitlines()) == 2, f"afterId not applied: {resumed}"
+
+    lines = requests.get(f"{BASE_URL}/export/posts", params={"format": "csv", "since": "2000-01-01"}).text.splitlines()
+    assert lines[0] == 'id,userId,imageName,created_at,likes,topCaptionId,captionCount', f"CSV export wrong: {lines[:3]}"
+    assert any(line.startswith(f"{postId},") for line in lines), f"CSV export wrong: {lines[:3]}"
+
+    statuses = [
+        requests.get(f"{BASE_URL}/export/passwords").status_code,
+        requests.get(f"{BASE_URL}/export/users", params={"postId": postId}).status_code,
+        requests.get(f"{BASE_URL}/export/posts", params={"since": "yesterday"}).status_code,
+    ]
+    assert statuses == [404, 400, 400], f"Bad exports not refused: {statuses}"
+
+    result = subprocess.run([sys.executable, '-m', 'src.export', 'captions', '--format', 'csv', '--post-id', str(postId)], capture_output=True, text=True)
+    assert len(result.stdout.splitlines()) == 4, f"Export CLI wrong: {result.stdout} {result.stderr}"
+
+    print("✅ Streaming export successful")
+
+def test_online_backup():
+    print("\n27. Testing Online Backup and Restore...")
+    with tempfile.TemporaryDirectory() as directory:
+        databasePath = os.path.join(directory, 'live.db')
+        connection = sqlite3.connect(databasePath)
+        connection.execute("PRAGMA journal_mode = WAL")
+        connection.execute("CREATE TABLE Row (id INTEGER PRIMARY KEY, payload BLOB)")
+        connection.executemany("INSERT INTO Row (payload) VALUES (?)", [(os.urandom(200),) for _ in range(20000)])
+        connection.commit()
+        archive = sqlite3.connect(os.path.join(directory, 'live.archive.db'))
+        archive.execute("CREATE TABLE Row (id INTEGER PRIMARY KEY, payload BLOB)")
+        archive.executemany("INSERT INTO Row (payload) VALUES (?)", [(os.urandom(200),) for _ in range(500)])
+        archive.commit()
+        archive.close()
+
+        # Commits keep landing while the backup copies in small steps
+        stop = False
+        def keepWriting():
+            writer = sqlite3.connect(databasePath, timeout=5)
+            while not stop:
+                writer.execute("INSERT INTO Row (payload) VALUES (?)", (os.urandom(200),))
+                writer.commit()
+            writer.close()
+
+        with ThreadPoolExecutor(max_workers=1) as executor:
+            writing = executor.submit(keepWriting)
+            stats = createBackup(databasePath, os.path.join(directory, 'backups'), compress=True, pagesPerStep=16, sleepSeconds=0.001, keep=1)
+            stop = True
+            writing.result()
+
+        assert stats.verified, f"Backup wrong: {stats}"
+        assert stats.path.endswith('.db.gz'), f"Backup wrong: {stats}"
+        assert stats.steps >= 2, f"Backup wrong: {stats}"
+        assert not verifyBackup(stats.path), f"Backup wrong: {stats}"
+        assert stats.archivePath == archiveBackupPath(stats.path), f"Archive not backed up with the database: {stats}"
+        assert os.path.exists(stats.archivePath), f"Archive not backed up with the database: {stats}"
+        assert listBackups(os.path.join(directory, 'backups')) == [stats.path], f"Archive not backed up with the database: {stats}"
+
+        restoredPath = os.path.join(directory, 'restored.db')
+        restoreBackup(stats.path, restoredPath)
+        restored = sqlite3.connect(restoredPath).execute("SELECT COUNT(*) FROM Row").fetchone()[0]
+        restoredArchive = sqlite3.connect(os.path.join(directory, 'restored.archive.db')).execute("SELECT COUNT(*) FROM Row").fetchone()[0]
+        assert restored >= 20000, f"Restore wrong: {restored} rows, {restoredArchive} archived"
+        assert restoredArchive == 500, f"Restore wrong: {restored} rows, {restoredArchive} archived"
+
+        # A backup without an archive can't be restored over a database that has one
+        os.remove(stats.archivePath)
+        try:
+            restoreBackup(stats.path, restoredPath)
+        except RuntimeError:
+            pass
+        else:
+            raise AssertionError("Backup without its archive restored over an archive")
+
+        backupDirectory = os.path.join(directory, 'server')
+        result = subprocess.run([sys.executable, '-m', 'src.backup', '--directory', backupDirectory, 'create'], capture_output=True, text=True)
+        backups = listBackups(backupDirectory)
+        assert result.returncode == 0, f"Backup CLI wrong: {result.stdout} {result.stderr}"
+        assert len(backups) == 1, f"Backup CLI wrong: {result.stdout} {result.stderr}"
+        assert not verifyBackup(backups[0]), f"Backup CLI wrong: {result.stdout} {result.stderr}"
+
+    print("✅ Online backup and restore successful")
+
+def test_post_archive():
+    print("\n28. Testing Post Archive...")
+    with tempfile.TemporaryDirectory() as directory:
+        testDatabase = createDatabase(f"sqlite:///{os.path.join(directory, 'archive.db')}")
+        connection = testDatabase.connect()
+        setupSQLiteSchema(connection.cursor())
+        setupSQLiteArchive(connection.cursor(), testDatabase.archiveName)
+        connection.executescript("""
+            INSERT INTO User (id, username, name, password) VALUES (1, 'archivist', 'Archivist', 'pass');
+            INSERT INTO Post (id, userId, imageName, created_at) VALUES (1, 1, 'old.jpg', '2000-01-01 00:00:00'), (2, 1, 'new.jpg', CURRENT_TIMESTAMP);
+            INSERT INTO Caption (id, postId, userId, text) VALUES (1, 1, 1, 'old caption'), (2, 2, 1, 'new caption');
+            INSERT INTO UserLikedPosts (userId, postId) VALUES (1, 1);
+            INSERT INTO CaptionComments (id, captionId, userId, text) VALUES (1, 1, 1, 'old comment');
+        """)
+        connection.commit()
+        connection.close()
+
+        async def archive():
+            archiver = PostArchiver(testDatabase, batchSize=1)
+            before = await archiver.hotSetSize()
+            archived = await archiver.run(timedelta(days=30))
+            after = await archiver.hotSetSize()
+
+            def readBack(cursor):
+                return (
+                    cursor.execute("SELECT id FROM Post").fetchall(),
+                    queries.POST_BY_ID.oneOrArchived(cursor, (1,), 1),
+                    queries.CAPTIONS_BY_POST.allOrArchived(cursor, (1,)),
+                    [post.id for post in queries.POSTS_WITH_USERNAME_BY_USER.allWithArchived(cursor, (1,))],
+                    sorted(caption.id for caption in queries.byIdsWithArchived(cursor, queries.captionsWithUsernameByIds, [1, 2])),
+                    cursor.execute(queries.archivedSql("SELECT text FROM CaptionComments WHERE captionId = 1")).fetchall(),
+                )
+
+            readBackRows = await testDatabase.read(readBack)
+            exported = {}
+            for table in ('posts', 'captions', 'comments'):
+                chunks = [chunk async for chunk in exportRows(table, 'ndjson', database=testDatabase)]
+                exported[table] = [json.loads(line)['id'] for line in b''.join(chunks).decode().splitlines()]
+            await testDatabase.close()
+            return archived, before, after, readBackRows, exported
+
+        archived, before, after, (hotPosts, oldPost, oldCaptions, userPosts, captionIds, oldComments), exported = asyncio.run(archive())
+
+        assert archived == 1, f"Archiving wrong: {archived} {hotPosts} {[str(size) for size in after]}"
+        assert hotPosts == [(2,)], f"Archiving wrong: {archived} {hotPosts} {[str(size) for size in after]}"
+        assert [size.rows for size in after][:2] == [1, 1], f"Archiving wrong: {archived} {hotPosts} {[str(size) for size in after]}"
+        assert [size.rows for size in before][:2] == [2, 2], f"Archiving wrong: {archived} {hotPosts} {[str(size) for size in after]}"
+
+        assert oldPost is not None, f"Archived post not read back: {oldPost} {oldCaptions}"
+        assert oldPost.likedByViewer, f"Archived post not read back: {oldPost} {oldCaptions}"
+        assert [caption.text for caption in oldCaptions] == ['old caption'], f"Archived post not read back: {oldPost} {oldCaptions}"
+
+        assert userPosts == [2, 1], f"Reads spanning the archive wrong: {userPosts} {captionIds} {oldComments}"
+        assert captionIds == [1, 2], f"Reads spanning the archive wrong: {userPosts} {captionIds} {oldComments}"
+        assert oldComments == [('old comment',)], f"Reads spanning the archive wrong: {userPosts} {captionIds} {oldComments}"
+
+        assert exported == {'posts': [1, 2], 'captions': [1, 2], 'comments': [1]}, f"Export missed archived rows: {exported}"
+
+    requireServer()
+    # Against the server: a backdated post is archived by the CLI and still served
+    with open(TEST_IMAGE_PATH, 'wb') as f:
+        f.write(b'dummy image data')
+
+    with open(TEST_IMAGE_PATH, 'rb') as f:
+        response = requests.post(
+            f"{BASE_URL}/post/create",
+            files={
+                'userId': (None, '1'),
+                'password': (None, 'testpass123'),
+                'image': ('test.jpg', f, 'image/jpeg')
+            }
+        )
+    postId = response.json()['data']['postId']
+    captionId = requests.post(f"{BASE_URL}/batch", json={
+        "userId": 1,
+        "password": "testpass123",
+        "operations": [{"op": "createCaption", "postId": postId, "text": "Caption to archive"}]
+    }).json()['data']['results'][0]['data']['captionId']
+
+    connection = sqlite3.connect('CapRank.db', timeout=20)
+    connection.execute("UPDATE Post SET created_at = '2000-01-01 00:00:00' WHERE id = ?", (postId,))
+    connection.commit()
+    connection.close()
+
+    result = subprocess.run([sys.executable, '-m', 'src.archive_posts', '--older-than-days', '3650'], capture_output=True, text=True)
+    assert "Archived 1 posts" in result.stdout, f"Archive CLI wrong: {result.stdout} {result.stderr}"
+    assert "Hot set after:" in result.stdout, f"Archive CLI wrong: {result.stdout} {result.stderr}"
+
+    post = requests.get(f"{BASE_URL}/post/{postId}")
+    captions = requests.get(f"{BASE_URL}/captions/post/{postId}").json()['data']
+    comments = requests.get(f"{BASE_URL}/captions/comments/{captionId}")
+    assert post.status_code == 200, f"Archived post not served: {post.text} {captions} {comments.text}"
+    assert post.json()['data'][0] == postId, f"Archived post not served: {post.text} {captions} {comments.text}"
+    assert [caption[0] for caption in captions] == [captionId], f"Archived post not served: {post.text} {captions} {comments.text}"
+    assert comments.status_code == 200, f"Archived post not served: {post.text} {captions} {comments.text}"
+
+    # Owners can still delete what was archived, and the purge job clears it from the archive
+    captionDeleted = requests.delete(f"{BASE_URL}/captions/{captionId}_1_testpass123")
+    postDeleted = requests.delete(f"{BASE_URL}/post/{postId}_1_testpass123")
+    time.sleep(1)
+    archive = sqlite3.connect('CapRank.archive.db', timeout=20)
+    archivedRows = archive.execute("SELECT (SELECT COUNT(*) FROM Post WHERE id = ?) + (SELECT COUNT(*) FROM Caption WHERE postId = ?)", (postId, postId)).fetchone()[0]
+    archive.close()
+    assert captionDeleted.status_code == 200, f"Archived post not deleted: {captionDeleted.text} {postDeleted.text} {archivedRows}"
+    assert postDeleted.status_code == 200, f"Archived post not deleted: {captionDeleted.text} {postDeleted.text} {archivedRows}"
+    assert requests.get(f"{BASE_URL}/post/{postId}").status_code == 404, f"Archived post not deleted: {captionDeleted.text} {postDeleted.text} {archivedRows}"
+    assert not archivedRows, f"Archived post not deleted: {captionDeleted.text} {postDeleted.text} {archivedRows}"
+
+    # Purging a user clears their archived posts too
+    username = f"archived_{uuid.uuid4().hex[:8]}"
+    requests.post(f"{BASE_URL}/register", json={"username": username, "name": "Archived", "password": "testpass123"})
+    userId = requests.post(f"{BASE_URL}/login", json={"username": username, "password": "testpass123"}).json()['data']['id']
+    with open(TEST_IMAGE_PATH, 'rb') as f:
+        userPostId = requests.post(
+            f"{BASE_URL}/post/create",
+            files={
+                'userId': (None, str(userId)),
+                'password': (None, 'testpass123'),
+                'image': ('test.jpg', f, 'image/jpeg')
+            }
+        ).json()['data']['postId']
+
+    connection = sqlite3.connect('CapRank.db', timeout=20)
+    connection.execute("UPDATE Post SET created_at = '2000-01-01 00:00:00' WHERE id = ?", (userPostId,))
+    connection.commit()
+    connection.close()
+    subprocess.run([sys.executable, '-m', 'src.archive_posts', '--older-than-days', '3650'], capture_output=True, text=True)
+
+    userDeleted = requests.delete(f"{BASE_URL}/users", json={"userId": userId, "password": "testpass123"})
+    time.sleep(1)
+    archive = sqlite3.connect('CapRank.archive.db', timeout=20)
+    archivedUserPosts = archive.execute("SELECT COUNT(*) FROM Post WHERE userId = ?", (userId,)).fetchone()[0]
+    archive.close()
+    assert userDeleted.status_code == 200, f"Purged user's archived posts left behind: {userDeleted.text} {archivedUserPosts}"
+    assert not archivedUserPosts, f"Purged user's archived posts left behind: {userDeleted.text} {archivedUserPosts}"
+
+    print("✅ Post archive successful")
+
+def test_viewer_like_flags():
+    print("\n29. Testing Viewer Like Flags...")
+    with tempfile.TemporaryDirectory() as directory:
+        path = os.path.join(directory, 'likes.db')
+        viewer = sqlite3.connect(path, isolation_level=None)
+        setupSQLiteSchema(viewer.cursor())
+        viewer.executescript("""
+            INSERT INTO User (id, username, name, password) VALUES (1, 'viewer', 'Viewer', 'pass');
+            INSERT INTO Post (id, userId, imageName) VALUES (1, 1, 'a.jpg'), (2, 1, 'b.jpg'), (3, 1, 'c.jpg');
+            INSERT INTO UserLikedPosts (userId, postId) VALUES (1, 1);
+        """)
+
+        filters = ViewerLikeFilters()
+        before = filters.likedByViewer(viewer.cursor(), 'post', 1, [1, 2, 3])
+
+        # Another process likes post 2 within the filter's lifetime; its filter here never hears of it
+        otherProcess = sqlite3.connect(path, isolation_level=None)
+        otherProcess.execute("BEGIN IMMEDIATE")
+        otherProcess.execute("INSERT INTO UserLikedPosts (userId, postId) VALUES (1, 2)")
+        recordChange(otherProcess.cursor(), 'post', 2)
+        otherProcess.execute("COMMIT")
+        otherProcess.close()
+
+        after = filters.likedByViewer(viewer.cursor(), 'post', 1, [1, 2, 3])
+        flagged = filters.withLikedFlag(viewer.cursor(), 'post', 1, [(1,), (2,), (3,)])
+        viewer.close()
+
+        assert before == {1}, f"Liked flags wrong: {before} {after} {flagged}"
+        assert after == {1, 2}, f"Liked flags wrong: {before} {after} {flagged}"
+        assert flagged == [(1, True), (2, True), (3, False)], f"Liked flags wrong: {before} {after} {flagged}"
+
+    print("✅ Viewer like flags successful")
+
+def test_group_commit():
+    print("\n30. Testing Group Commit and Savepoints...")
+    with tempfile.TemporaryDirectory() as directory:
+        testDatabase = createDatabase(f"sqlite:///{os.path.join(directory, 'group.db')}")
+        connection = testDatabase.connect()
+        setupSQLiteSchema(connection.cursor())
+        connection.commit()
+        connection.close()
+
+        batchSizes = []
+        commitBatch = testDatabase.writeScheduler._commitBatch
+        def countingCommitBatch(operations):
+            batchSizes.append(len(operations))
+            return commitBatch(operations)
+        testDatabase.writeScheduler._commitBatch = countingCommitBatch
+
+        def insertUser(index):
+            def operation(cursor):
+                cursor.execute("INSERT INTO User (username, name, password) VALUES (?, 'Group', 'pass') RETURNING id", (f"group_{index}",))
+                userId = cursor.fetchone()[0]
+                # Odd operations fail after writing, which their savepoint must undo
+                if index % 2:
+                    raise ValueError(f"operation {index} failed")
+                return userId
+            return operation
+
+        def slowRead(cursor):
+            time.sleep(0.3)
+            return cursor.execute("SELECT 1").fetchone()[0]
+
+        async def run():
+            outcomes = await asyncio.gather(*(testDatabase.write(insertUser(index)) for index in range(20)), return_exceptions=True)
+            usernames = await testDatabase.read(lambda cursor: [row[0] for row in cursor.execute("SELECT username FROM User ORDER BY id")])
+
+            # Reads run on the reader threads, so two slow ones overlap instead of queueing on the loop
+            start = time.monotonic()
+            await asyncio.gather(testDatabase.read(slowRead), testDatabase.read(slowRead))
+            readSeconds = time.monotonic() - start
+
+            await testDatabase.close()
+            return outcomes, usernames, readSeconds
+
+        outcomes, usernames, readSeconds = asyncio.run(run())
+
+        failures = [index for index, outcome in enumerate(outcomes) if isinstance(outcome, Exception)]
+        assert failures == list(range(1, 20, 2)), f"Failing operations not reported to their callers: {outcomes}"
+        assert str(outcomes[1]) == "operation 1 failed", f"Failing operations not reported to their callers: {outcomes}"
+
+        assert usernames == [f"group_{index}" for index in range(0, 20, 2)], f"Savepoints didn't isolate failing operations: {usernames}"
+
+        assert max(batchSizes) >= 2, f"Concurrent writes not grouped into shared commits: {batchSizes}"
+        assert sum(batchSizes) == 20, f"Concurrent writes not grouped into shared commits: {batchSizes}"
+
+        assert readSeconds <= 0.55, f"Reads blocked each other: {readSeconds:.2f}s"
+
+    print("✅ Group commit and savepoints successful")
+
+def test_buffered_like_counters():
+    print("\n31. Testing Buffered Like Counters...")
+    with tempfile.TemporaryDirectory() as directory:
+        testDatabase = createDatabase(f"sqlite:///{os.path.join(directory, 'counters.db')}")
+        connection = testDatabase.connect()
+        setupSQLiteSchema(connection.cursor())
+        connection.executescript("""
+            INSERT INTO User (id, username, name, password) VALUES (1, 'counter', 'Counter', 'pass');
+            INSERT INTO Post (id, userId, imageName, likes) VALUES (1, 1, 'a.jpg', 5);
+        """)
+        connection.commit()
+        connection.close()
+
+        # Query.all folds in the shared counters' pending deltas, so the test borrows them
+        savedMode, savedDatabase = likeCounters.mode, likeCounters.database
+        likeCounters.mode, likeCounters.database = 'buffered', testDatabase
+
+        def readPost(cursor):
+            return cursor.execute("SELECT likes FROM Post WHERE id = 1").fetchone()[0]
+
+        def showPost(cursor):
+            return queries.POST_BY_ID.one(cursor, (1,)).likes
+
+        async def run():
+            for delta in (1, 1, -1, 1):
+                likeCounters.increment(None, 'post', 1, delta)
+
+            committedBefore = await testDatabase.read(readPost)
+            shownBefore = await testDatabase.read(showPost)
+            flushed = await likeCounters.flush()
+            committedAfter = await testDatabase.read(readPost)
+            shownAfter = await testDatabase.read(showPost)
+            logged = await testDatabase.read(lambda cursor: cursor.execute("SELECT entity, entityId FROM ChangeLog").fetchall())
+            await testDatabase.close()
+            return committedBefore, shownBefore, flushed, committedAfter, shownAfter, logged
+
+        try:
+            committedBefore, shownBefore, flushed, committedAfter, shownAfter, logged = asyncio.run(run())
+        finally:
+            likeCounters.mode, likeCounters.database = savedMode, savedDatabase
+
+        # Pending deltas show in reads straight away, and once flushed are in the row instead
+        assert (committedBefore, shownBefore) == (5, 7), f"Buffered likes wrong: {committedBefore} {shownBefore} {flushed} {committedAfter} {shownAfter}"
+        assert flushed == 1, f"Buffered likes wrong: {committedBefore} {shownBefore} {flushed} {committedAfter} {shownAfter}"
+        assert (committedAfter, shownAfter) == (7, 7), f"Buffered likes wrong: {committedBefore} {shownBefore} {flushed} {committedAfter} {shownAfter}"
+        assert logged == [('post', 1)], f"Flush not logged or deltas left pending: {logged}"
+        assert not likeCounters.pending['post'], f"Flush not logged or deltas left pending: {logged}"
+
+    print("✅ Buffered like counters successful")
+
 def run_all_tests():
     print("Starting Backend Tests...")
     
@@ -237,12 +1411,45 @@ def run_all_tests():
         test_user_login,
         test_post_creation,
         test_caption_creation,
-        test_like_functionality
+        test_like_functionality,
+        test_batch_captions,
+        test_idempotent_like,
+        test_database_backends,
+        test_concurrent_migrations,
+        test_job_queue,
+        test_soft_delete,
+        test_garbage_collector,
+        test_comment_pages,
+        test_rate_limiter,
+        test_response_cache,
+        test_query_registry,
+        test_trending_posts,
+        test_delta_sync,
+        test_batch_operations,
+        test_image_index,
+        test_caption_duplicates,
+        test_content_filter,
+        test_user_suggestions,
+        test_username_availability,
+        test_streaming_export,
+        test_online_backup,
+        test_post_archive,
+        test_viewer_like_flags,
+        test_group_commit,
+        test_buffered_like_counters
     ]
     
     results = []
     for test in tests:
-        results.append(test())
+        # Older tests report by returning False, newer ones by failing an assert
+        try:
+            results.append(test() is not False)
+        except unittest.SkipTest as e:
+            print(f"⚠️  Skipped: {e}")
+            results.append(True)
+        except Exception as e:
+            print(f"❌ {test.__name__} failed: {e!r}")
+            results.append(False)
     
     success_count = sum(1 for result in results if result)
     total_tests = len(results)